@@ -0,0 +1,87 @@
+#!/bin/env python3
+
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2
+
+# Compare the engines that can merge the content of blobs when the same file
+# is modified along a series of commits that is being rebased.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pygit2
+from pygit2.enums import FileMode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rebasedashdash import Diff3Merger
+from rebasedashdash import _merge_blobs_3way_trees
+from rebasedashdash import merge_blob_contents
+from rebasedashdash import DiffAlgorithm
+
+
+def create_series(repo: pygit2.Repository, lines: int, commits: int):
+    # versions of the file along the series and the version of the file upstream
+    content = [f"line {i} of the file that is being rebased\n" for i in range(lines)]
+    upstream = repo.create_blob("".join(["header added upstream\n"] + content))
+    versions = [repo.create_blob("".join(content))]
+    step = max(1, lines // (commits + 1))
+    for i in range(commits):
+        content[step * (i + 1)] = f"line modified in commit {i}\n"
+        versions.append(repo.create_blob("".join(content)))
+    return versions, upstream
+
+
+def merge_trees(repo, ancestor, ours, theirs):
+    merge_result = _merge_blobs_3way_trees(
+        repo, ancestor, ours, theirs, DiffAlgorithm.MYERS
+    )
+    return None if merge_result.conflicts else merge_result["a"].id
+
+
+def merge_file(repo, ancestor, ours, theirs):
+    return merge_blob_contents(repo, ancestor, ours, theirs)
+
+
+def run(repo, versions, upstream, create_merge) -> float:
+    start = time.perf_counter()
+    merge = create_merge()
+    rebased = upstream
+    for parent_id, commit_id in zip(versions, versions[1:]):
+        rebased = merge(
+            repo,
+            (parent_id, FileMode.BLOB),
+            (commit_id, FileMode.BLOB),
+            (rebased, FileMode.BLOB),
+        )
+        assert rebased is not None
+    return time.perf_counter() - start
+
+
+parser = argparse.ArgumentParser(description="Benchmark of 3-way blob merges")
+parser.add_argument("--lines", type=int, default=20000, help="Lines in the file.")
+parser.add_argument("--commits", type=int, default=50, help="Commits in the series.")
+parser.add_argument("--repeat", type=int, default=3, help="Best out of this many runs.")
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as path:
+    repo = pygit2.init_repository(path, bare=True)
+    versions, upstream = create_series(repo, args.lines, args.commits)
+
+    # each engine is created once per run
+    engines = {
+        "libgit2 tree merge": lambda: merge_trees,
+        "libgit2 file merge": lambda: merge_file,
+        "diff3 (no cache)": lambda: lambda *params: Diff3Merger().merge(*params),
+        "diff3": lambda: Diff3Merger().merge,
+    }
+
+    print(f"{args.commits} commits modifying a file with {args.lines} lines")
+    for name, create_merge in engines.items():
+        elapsed = min(
+            run(repo, versions, upstream, create_merge) for _ in range(args.repeat)
+        )
+        print(f"{name:20} {elapsed * 1000:10.1f} ms")
@@ -0,0 +1,156 @@
+#!/bin/env python3
+
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2
+
+# Time it takes rebase-- to print the final commit of an empty rebase (the source is
+# already on top of upstream), which is pretty much the time it takes to start:
+# the interpreter, the imports, parsing the options and opening the repository.
+# It exits with an error if the median is over --budget so that regressions are caught.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pygit2
+
+REBASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rebase--")
+
+
+def create_repository(path: str):
+    # main and topic on the same commit so there is nothing to rebase
+    repo = pygit2.init_repository(path)
+    repo.config["user.name"] = "rebase--"
+    repo.config["user.email"] = "rebase--@example.com"
+    signature = pygit2.Signature("rebase--", "rebase--@example.com")
+    tree_id = repo.TreeBuilder().write()
+    commit_id = repo.create_commit(
+        "refs/heads/main", signature, signature, "base", tree_id, []
+    )
+    repo.set_head("refs/heads/main")
+    repo.references.create("refs/heads/topic", commit_id)
+
+
+def time_to_first_commit(command: list[str], cwd: str, env: dict) -> float:
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=cwd, env=env, stdout=subprocess.PIPE, text=True
+    )
+    seconds = None
+    for line in process.stdout:
+        if seconds is None and line.startswith("Final rebase commit"):
+            seconds = time.perf_counter() - start
+    if process.wait() != 0 or seconds is None:
+        sys.exit(f"{' '.join(command)} did not finish the rebase")
+    return seconds
+
+
+def print_imports(command: list[str], cwd: str, env: dict, count: int):
+    # slowest imports of the script itself (cumulative time)
+    result = subprocess.run(
+        [command[0], "-X", "importtime"] + command[1:],
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            imports.append((int(cumulative), name.strip()))
+    for cumulative, name in sorted(imports, reverse=True)[:count]:
+        print(f"    {name:30} {cumulative / 1000:10.1f} ms")
+
+
+parser = argparse.ArgumentParser(description="Benchmark of the startup of rebase--")
+parser.add_argument("--runs", type=int, default=10, help="Times to run each command.")
+parser.add_argument(
+    "--budget",
+    type=float,
+    default=None,
+    help="Fail if the median of rebase-- (in ms) is over this.",
+)
+parser.add_argument(
+    "--zipapp", type=str, default=None, help="Also time this zipapp of rebase--."
+)
+parser.add_argument(
+    "--daemon",
+    action="store_true",
+    default=False,
+    help="Also time rebase-- forwarding the rebase to a daemon.",
+)
+parser.add_argument(
+    "--imports",
+    type=int,
+    default=0,
+    help="Show this many of the slowest imports of rebase--.",
+)
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as path:
+    create_repository(path)
+    env = dict(os.environ)
+    env["PYTHONUNBUFFERED"] = "1"  # the final commit is seen as soon as it is printed
+    env.pop("REBASEDASHDASH_DAEMON", None)
+    rebase = [sys.executable, REBASE, "main", "topic"]
+
+    commands = {"rebase--": (rebase, env)}
+    if args.zipapp:
+        commands["zipapp"] = ([sys.executable, args.zipapp, "main", "topic"], env)
+    daemon = None
+    if args.daemon:
+        socket_path = os.path.join(path, "rebase--.socket")
+        daemon = subprocess.Popen(
+            [sys.executable, REBASE, "--daemon", socket_path],
+            cwd=path,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        daemon.stdout.readline()  # listening
+        commands["daemon"] = (rebase, dict(env, REBASEDASHDASH_DAEMON=socket_path))
+
+    # just starting the interpreter, for reference
+    print("python startup (no rebase): ", end="")
+    python_start = min(
+        time_to_first_commit(
+            [sys.executable, "-c", "print('Final rebase commit')"], path, env
+        )
+        for _ in range(args.runs)
+    )
+    print(f"{python_start * 1000:.1f} ms")
+
+    medians = {}
+    try:
+        for name, (command, command_env) in commands.items():
+            # the first run is not timed: it writes the bytecode (if it can) and warms the daemon
+            time_to_first_commit(command, path, command_env)
+            times = [
+                time_to_first_commit(command, path, command_env)
+                for _ in range(args.runs)
+            ]
+            medians[name] = statistics.median(times)
+            print(
+                f"{name:10} best {min(times) * 1000:8.1f} ms, "
+                f"median {medians[name] * 1000:8.1f} ms"
+            )
+        if args.imports:
+            print("Slowest imports of rebase--:")
+            print_imports(rebase, path, env, args.imports)
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+
+if args.budget is not None and medians["rebase--"] * 1000 > args.budget:
+    sys.exit(
+        f"rebase-- took {medians['rebase--'] * 1000:.1f} ms, "
+        f"over the budget of {args.budget} ms"
+    )
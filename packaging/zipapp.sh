@@ -0,0 +1,47 @@
+#!/bin/bash
+
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2
+
+#
+# It will create a single-file rebase-- (a python zipapp) that can be run
+# anywhere pygit2 is installed.
+#
+# Parameters
+# - where to write the zipapp (default: rebase--.pyz)
+#
+# Bytecode is compiled with the python3 that builds the zipapp. Other versions
+# of python use the sources that are also in the zipapp.
+
+set -e
+
+OUTPUT=$( realpath "${1:-rebase--.pyz}" )
+
+cd "$( dirname $0 )/.."
+
+BUILD_DIR=$( mktemp -d )
+trap "rm -fR $BUILD_DIR" EXIT
+
+cp rebasedashdash.py $BUILD_DIR/
+cp rebase-- $BUILD_DIR/__main__.py
+
+# zipimport does not write bytecode, it reads it from the zipapp if it is there
+# (next to the source, checked by hash instead of modification time)
+python3 - $BUILD_DIR <<'PYTHON'
+import os
+import py_compile
+import sys
+
+for name in ("__main__", "rebasedashdash"):
+    py_compile.compile(
+        os.path.join(sys.argv[1], f"{name}.py"),
+        cfile=os.path.join(sys.argv[1], f"{name}.pyc"),
+        dfile=f"{name}.py",
+        doraise=True,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+    )
+PYTHON
+
+python3 -m zipapp $BUILD_DIR -p "/usr/bin/env python3" -o "$OUTPUT"
+
+echo Created $OUTPUT
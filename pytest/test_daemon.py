@@ -0,0 +1,106 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+from rebasedashdash import RebaseOptions
+from rebasedashdash import create_daemon
+from rebasedashdash import open_repository
+from rebasedashdash import warm_up
+
+from common import create_repository
+
+
+def echo_handler(cwd, arguments, stdin):
+    return len(arguments), f"{cwd} {' '.join(arguments)}", stdin or ""
+
+
+def repository_handler(cwd, arguments, stdin):
+    # the repository and the caches have to be the same object on every request
+    repo = open_repository(cwd)
+    rebase_options = RebaseOptions(None, None)
+    warmed_up = warm_up(repo, rebase_options)
+    return (
+        0,
+        json.dumps(
+            [
+                id(repo),
+                id(rebase_options.merge_bases),
+                id(rebase_options.tree_merge_cache),
+            ]
+        ),
+        str(warmed_up),
+    )
+
+
+def send_request(socket_path, request: bytes) -> dict:
+    with socket.socket(socket.AF_UNIX) as client:
+        client.connect(socket_path)
+        client.sendall(request + b"\n")
+        client.shutdown(socket.SHUT_WR)
+        return json.loads(b"".join(iter(lambda: client.recv(65536), b"")))
+
+
+@pytest.fixture
+def start_daemon(tmp_path):
+    daemons = []
+
+    def start(handler, jobs=1):
+        daemon = create_daemon(str(tmp_path / "socket"), handler, jobs)
+        threading.Thread(target=daemon.serve_forever, daemon=True).start()
+        daemons.append(daemon)
+        return daemon
+
+    yield start
+    for daemon in daemons:
+        daemon.shutdown()
+        daemon.server_close()
+
+
+def test_daemon_requests(tmp_path, start_daemon):
+    daemon = start_daemon(echo_handler, 2)
+    socket_path = daemon.server_address
+    assert os.stat(socket_path).st_mode & 0o077 == 0
+
+    request = {"cwd": "/somewhere", "arguments": ["main", "--verbose"], "stdin": "b1"}
+    response = send_request(socket_path, json.dumps(request).encode())
+    assert response == {
+        "exit_code": 2,
+        "stdout": "/somewhere main --verbose",
+        "stderr": "b1",
+    }
+
+    response = send_request(socket_path, b"not json")
+    assert response["exit_code"] == 1
+    assert response["stderr"].startswith("Bad request")
+
+    # a second daemon can't use the same socket
+    with pytest.raises(OSError):
+        create_daemon(socket_path, echo_handler)
+    daemon.shutdown()
+    daemon.server_close()
+    assert not os.path.exists(socket_path)
+
+
+def test_daemon_keeps_repositories(tmp_path, start_daemon):
+    create_repository(tmp_path / "repo")
+    daemon = start_daemon(repository_handler)
+
+    request = json.dumps({"cwd": str(tmp_path / "repo"), "arguments": []}).encode()
+    responses = [send_request(daemon.server_address, request) for _ in range(2)]
+    assert responses[0]["stderr"] == "True"
+    assert responses[0]["stdout"] == responses[1]["stdout"]
+    assert daemon.requests == 2
+
+    # nothing is kept outside of the daemon
+    assert open_repository(str(tmp_path / "repo")) is not open_repository(
+        str(tmp_path / "repo")
+    )
+    assert not warm_up(
+        open_repository(str(tmp_path / "repo")), RebaseOptions(None, None)
+    )
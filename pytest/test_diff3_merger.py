@@ -0,0 +1,146 @@
+# copyright (c) 2025 Edmundo Carmona Antoranz
+# released under the terms of GPLv2.0
+
+import pygit2
+import pytest
+from pygit2.enums import FileMode
+
+import rebasedashdash
+from rebasedashdash import Diff3Merger
+from rebasedashdash import LineTokens
+from rebasedashdash import merge_blobs_3way
+
+from common import create_repository
+
+ANCESTOR = "".join(f"line {i}\n" for i in range(100))
+
+
+@pytest.fixture(params=["numpy", "python"])
+def tokenizer(request, monkeypatch):
+    rebasedashdash._import_numpy()  # numpy is imported when it is first needed
+    if request.param == "python":
+        monkeypatch.setattr(rebasedashdash, "numpy", None)
+    elif rebasedashdash.numpy is None:
+        pytest.skip("numpy is not available")
+    return request.param
+
+
+def create_blobs(repo, *contents):
+    return tuple((repo.create_blob(content), FileMode.BLOB) for content in contents)
+
+
+def test_tokens(tokenizer):
+    tokens = LineTokens(b"line 1\nline 2\n\nline 4")
+    assert len(tokens) == 4
+    assert list(tokens.offsets) == [0, 7, 14, 15, 21]
+    assert tokens.content(1, 3) == b"line 2\n\n"
+    assert tokens.hashes[0] != tokens.hashes[1]
+    assert LineTokens(b"line 1").hashes[0] != tokens.hashes[0]  # no line break
+    assert LineTokens(b"line 2\nline 1\n").hashes[1] == tokens.hashes[0]
+
+    assert len(LineTokens(b"")) == 0
+    assert len(LineTokens(b"\n")) == 1
+
+
+def test_tokens_hashes(tokenizer):
+    # lines that go across the chunks that are hashed
+    line = b"".join(bytes([i % 256]) for i in range(1000)).replace(b"\n", b"") + b"\n"
+    tokens = LineTokens(b"first\n" + line * 200 + b"last\n" + line)
+    assert len(set(tokens.hashes[1:201])) == 1
+    assert tokens.hashes[201] not in (tokens.hashes[0], tokens.hashes[1])
+    assert tokens.hashes[202] == tokens.hashes[1]
+
+
+def test_merge(tmp_path, tokenizer):
+    repo = create_repository(tmp_path)
+    merger = Diff3Merger()
+
+    ours = (
+        "line -1 (ours)\n"
+        + ANCESTOR.replace("line 10\n", "line 10 (ours)\n")
+        + "line 100 (ours)"
+    )
+    theirs = ANCESTOR.replace("line 50\nline 51\n", "").replace(
+        "line 80\n", "line 80\nline 80.5 (theirs)\n"
+    )
+    blobs = create_blobs(repo, ANCESTOR, ours, theirs)
+
+    res = merger.merge(repo, *blobs)
+    assert res == repo.create_blob(
+        "line -1 (ours)\n"
+        + ANCESTOR.replace("line 10\n", "line 10 (ours)\n")
+        .replace("line 50\nline 51\n", "")
+        .replace("line 80\n", "line 80\nline 80.5 (theirs)\n")
+        + "line 100 (ours)"
+    )
+    # same as libgit2
+    assert merge_blobs_3way(repo, *blobs) == (res, FileMode.BLOB)
+    assert merge_blobs_3way(repo, *blobs, diff3_merger=merger) == (res, FileMode.BLOB)
+
+
+def test_conflict(tmp_path, tokenizer):
+    repo = create_repository(tmp_path)
+    merger = Diff3Merger()
+
+    blobs = create_blobs(
+        repo,
+        ANCESTOR,
+        ANCESTOR.replace("line 10\n", "line 10 (ours)\n"),
+        ANCESTOR.replace("line 10\n", "line 10 (theirs)\n"),
+    )
+    assert merger.merge(repo, *blobs) is None
+    res = merge_blobs_3way(repo, *blobs, diff3_merger=merger)
+    assert isinstance(res, pygit2.Index)
+
+    # same change on both sides
+    ours = ANCESTOR.replace("line 10\n", "line 10 (ours)\n")
+    blobs = create_blobs(repo, ANCESTOR, ours, ours.replace("line 90\n", ""))
+    assert merger.merge(repo, *blobs) == repo.create_blob(ours.replace("line 90\n", ""))
+
+
+def test_added_on_both_sides(tmp_path, tokenizer):
+    repo = create_repository(tmp_path)
+
+    _, ours, theirs = create_blobs(
+        repo,
+        "",
+        "line 1\n",
+        "line 1\nline 2\n",
+    )
+    assert Diff3Merger().merge(repo, None, ours, theirs) is None
+
+
+def test_tokens_cache(tmp_path, tokenizer):
+    repo = create_repository(tmp_path)
+    merger = Diff3Merger()
+
+    versions = [ANCESTOR]
+    for i in range(5):
+        versions.append(
+            versions[-1].replace(f"line {i * 10 + 10}\n", f"line {i * 10 + 10}!\n")
+        )
+    blob_ids = [repo.create_blob(version) for version in versions]
+    upstream = repo.create_blob("header\n" + ANCESTOR)
+
+    # rebasing a series of commits that modify the same file
+    rebased = upstream
+    for parent_id, commit_id in zip(blob_ids, blob_ids[1:]):
+        rebased = merger.merge(
+            repo,
+            (parent_id, FileMode.BLOB),
+            (commit_id, FileMode.BLOB),
+            (rebased, FileMode.BLOB),
+        )
+    assert rebased == repo.create_blob("header\n" + versions[-1])
+    # the parent of each commit was tokenized in the previous merge already
+    assert (merger.tokens_cache.hits, merger.tokens_cache.misses) == (4, 11)
+
+
+def test_hash_collision(tokenizer):
+    old = LineTokens(b"line 1\nline 2\nline 3\n")
+    new = LineTokens(b"line 1\nline 2 (new)\nline 3\n")
+    # all lines collide: they have to be compared by content
+    for tokens in (old, new):
+        for line in range(len(tokens)):
+            tokens.hashes[line] = 0
+    assert Diff3Merger().diff(old, new, 0) == [(1, 2, b"line 2 (new)\n", 0)]
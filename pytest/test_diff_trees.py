@@ -0,0 +1,138 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import pygit2
+from pygit2.enums import FileMode
+
+import rebasedashdash
+from rebasedashdash import RebaseOptions
+from rebasedashdash import rebase
+
+from common import add_test_blob
+from common import add_test_tree
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def file_content(name, first_line="", last_line=""):
+    return first_line + "".join(f"{name} {i}\n" for i in range(10)) + last_line
+
+
+def create_tree(changes={}, blob_dir=False, executables=()):
+    # changes: path => (first line, last line), None to delete the file
+    root_tree = create_test_tree()
+    for directory in ("a", "b", "c"):
+        tree = add_test_tree(root_tree, directory)
+        for i in range(20):
+            path = f"{directory}/file{i}.txt"
+            if path in changes and changes[path] is None:
+                continue
+            add_test_blob(
+                tree,
+                f"file{i}.txt",
+                FileMode.BLOB_EXECUTABLE if path in executables else FileMode.BLOB,
+                file_content(path, *changes.get(path, ("", ""))),
+            )
+    if blob_dir:
+        # d is a file instead of a directory
+        add_test_blob(root_tree, "d", FileMode.BLOB, "d\n")
+    else:
+        add_test_blob(add_test_tree(root_tree, "d"), "file.txt", FileMode.BLOB, "d\n")
+    return root_tree
+
+
+def create_scenario(repo, main_changes, other_changes, main_blob_dir=False):
+    # * main
+    # | * other
+    # |/
+    # * base
+    base = create_commit(repo, create_tree(), "base")
+    main = create_commit(repo, create_tree(main_changes, main_blob_dir), "main", [base])
+    other = create_commit(repo, create_tree(other_changes), "other", [base])
+    return repo.get(main), repo.get(other)
+
+
+def run_rebase(repo, main, other, diff_trees):
+    conflicts = []
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.diff_trees = diff_trees
+    return rebase(repo, rebase_options, conflicts), conflicts
+
+
+def test_diff_trees(tmp_path, monkeypatch):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(
+        repo,
+        {
+            "a/file3.txt": ("main\n", ""),
+            "b/file5.txt": ("main\n", ""),
+            "c/file7.txt": None,
+        },
+        {"a/file3.txt": ("", "other\n"), "b/file6.txt": ("other\n", "")},
+    )
+
+    walk_result, conflicts = run_rebase(repo, main, other, False)
+    assert isinstance(walk_result, pygit2.Commit)
+    assert conflicts == []
+
+    # trees are not walked
+    monkeypatch.setattr(rebasedashdash, "TreesIterator", None)
+    result, conflicts = run_rebase(repo, main, other, True)
+    assert isinstance(result, pygit2.Commit)
+    assert conflicts == []
+    assert result.tree.id == walk_result.tree.id
+    assert result.tree["a/file3.txt"].data.decode() == file_content(
+        "a/file3.txt", "main\n", "other\n"
+    )
+    assert "c/file7.txt" not in result.tree
+
+
+def test_diff_trees_conflict(tmp_path, monkeypatch):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(
+        repo, {"b/file5.txt": ("main\n", "")}, {"b/file5.txt": ("other\n", "")}
+    )
+
+    monkeypatch.setattr(rebasedashdash, "TreesIterator", None)
+    result, conflicts = run_rebase(repo, main, other, True)
+    assert isinstance(result, tuple)
+    assert [conflict[0] for conflict in conflicts] == ["b/file5.txt"]
+
+
+def test_diff_trees_blob_and_tree(tmp_path):
+    repo = create_repository(tmp_path)
+    # d is turned into a file upstream, trees have to be walked
+    main, other = create_scenario(
+        repo, {"a/file3.txt": ("main\n", "")}, {"a/file4.txt": ("other\n", "")}, True
+    )
+
+    walk_result, conflicts = run_rebase(repo, main, other, False)
+    assert isinstance(walk_result, pygit2.Commit)
+    result, conflicts = run_rebase(repo, main, other, True)
+    assert isinstance(result, pygit2.Commit)
+    assert result.tree.id == walk_result.tree.id
+    assert isinstance(result.tree["d"], pygit2.Blob)
+
+
+def test_diff_trees_filemode(tmp_path, monkeypatch):
+    repo = create_repository(tmp_path)
+    base = create_commit(repo, create_tree(), "base")
+    # only the mode of the file changes upstream
+    main = repo.get(
+        create_commit(repo, create_tree(executables=("a/file3.txt",)), "main", [base])
+    )
+    other = repo.get(
+        create_commit(
+            repo, create_tree({"b/file6.txt": ("other\n", "")}), "other", [base]
+        )
+    )
+
+    walk_result, conflicts = run_rebase(repo, main, other, False)
+    assert isinstance(walk_result, pygit2.Commit)
+    monkeypatch.setattr(rebasedashdash, "TreesIterator", None)
+    result, conflicts = run_rebase(repo, main, other, True)
+    assert isinstance(result, pygit2.Commit)
+    assert conflicts == []
+    assert result.tree["a/file3.txt"].filemode == FileMode.BLOB_EXECUTABLE
+    assert result.tree.id == walk_result.tree.id
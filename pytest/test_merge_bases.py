@@ -0,0 +1,85 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import random
+import shutil
+import subprocess
+
+import pygit2
+import pytest
+from pygit2.enums import FileMode
+
+from rebasedashdash import CommitGraph
+from rebasedashdash import MergeBases
+
+from common import add_test_blob
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+from common import write_test_tree
+
+
+def create_history(repo, commits_count=60, commit_ids=()):
+    # random history with merges (some of them octopus merges) and criss-cross merges
+    randomizer = random.Random(20 + len(commit_ids))
+    commit_ids = list(commit_ids)
+    for i in range(len(commit_ids), len(commit_ids) + commits_count):
+        root_tree = create_test_tree()
+        add_test_blob(root_tree, "a.txt", FileMode.BLOB, f"{i}\n")
+        tree_id = write_test_tree(repo, root_tree)
+        parents_count = min(len(commit_ids), randomizer.choice((1, 1, 1, 2, 2, 3)))
+        parents = randomizer.sample(commit_ids[-10:], parents_count)
+        commit_ids.append(create_commit(repo, tree_id, f"commit {i}", parents))
+        repo.references.create(f"refs/tags/{commit_ids[-1]}", commit_ids[-1])
+    return commit_ids
+
+
+def check_merge_bases(repo, commit_ids, merge_bases):
+    randomizer = random.Random(30)
+    for _ in range(100):
+        pair = randomizer.sample(commit_ids, 2)
+        assert merge_bases.get(repo, pair) == repo.merge_base_many(pair)
+    misses = merge_bases.misses
+    assert merge_bases.get(repo, list(reversed(pair))) == repo.merge_base_many(pair)
+    assert merge_bases.misses == misses
+
+
+def test_merge_bases(tmp_path):
+    repo = create_repository(tmp_path)
+    commit_ids = create_history(repo)
+    check_merge_bases(repo, commit_ids, MergeBases())
+
+    # with generation numbers for the commits
+    merge_bases = MergeBases()
+    for commit_id in commit_ids:
+        commit = repo.get(commit_id)
+        merge_bases.add_commit(repo, commit.id, commit.commit_time, commit.parent_ids)
+    check_merge_bases(repo, commit_ids, merge_bases)
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not available")
+def test_commit_graph(tmp_path):
+    repo = create_repository(tmp_path)
+    assert CommitGraph.open(repo) is None
+    commit_ids = create_history(repo, 40)
+    subprocess.run(
+        ["git", "commit-graph", "write", "--reachable"], cwd=repo.path, check=True
+    )
+    commit_graph = CommitGraph.open(repo)
+    assert commit_graph.commits_count == 40
+
+    generations = {}
+    for commit_id in commit_ids:
+        commit = repo.get(commit_id)
+        generation, commit_time, parent_ids = commit_graph.get(commit_id)
+        assert parent_ids == commit.parent_ids
+        assert commit_time == commit.commit_time
+        assert generation == 1 + max(
+            (generations[parent_id] for parent_id in parent_ids), default=0
+        )
+        generations[commit_id] = generation
+    assert commit_graph.get(repo.get(commit_ids[0]).tree_id) is None
+
+    # commits that are not in the graph
+    commit_ids = create_history(repo, 20, commit_ids)
+    check_merge_bases(repo, commit_ids, MergeBases(commit_graph))
@@ -4,6 +4,8 @@
 import pygit2
 from pygit2.enums import FileMode
 
+from rebasedashdash import Diff3Merger
+from rebasedashdash import merge_blob_deltas
 from rebasedashdash import merge_blobs
 
 from common import create_repository
@@ -606,3 +608,102 @@ def test_multiple_parents_change_between_bases_and_parents(tmp_path):
     )
 
     assert res == (expected_blob.id, FileMode.BLOB)
+
+
+## composed changes
+def file_lines(*changes):
+    # 14 lines, changes is a list of (line, new content)
+    lines = [f"line {i}\n" for i in range(14)]
+    for line, content in changes:
+        lines[line] = content
+    return "".join(lines)
+
+
+def create_octopus_blobs(repo, rebased_changes):
+    # merge commit with 3 parents. Each parent changed a line of the file, the merge
+    # commit changed another line. Upstream changed the first line.
+    blobs = {
+        "base": file_lines(),
+        "commit": file_lines((2, "p1\n"), (4, "p2\n"), (6, "p3\n"), (8, "merge\n")),
+        "new_base": file_lines((0, "upstream\n")),
+    }
+    for i, line in enumerate((2, 4, 6), 1):
+        blobs[f"parent{i}"] = file_lines((line, f"p{i}\n"))
+        blobs[f"rebased_parent{i}"] = file_lines(
+            (0, "upstream\n"), (line, f"p{i}\n"), *rebased_changes.get(i, [])
+        )
+    return {
+        name: create_blob(repo, "testfile.txt", content)
+        for name, content in blobs.items()
+    }
+
+
+def test_multiple_parents_composed(tmp_path):
+    repo = create_repository(tmp_path)
+    # the second parent was modified while being rebased
+    blobs = create_octopus_blobs(repo, {2: [(11, "rebased p2\n")]})
+    expected_content = file_lines(
+        (0, "upstream\n"),
+        (2, "p1\n"),
+        (4, "p2\n"),
+        (6, "p3\n"),
+        (8, "merge\n"),
+        (11, "rebased p2\n"),
+    )
+    args = (
+        blobs["commit"],
+        blobs["base"],
+        [blobs[f"parent{i}"] for i in (1, 2, 3)],
+        blobs["new_base"],
+        [blobs[f"rebased_parent{i}"] for i in (1, 2, 3)],
+    )
+
+    objects = set(repo.odb)
+    res = merge_blobs(repo, *args)
+    assert res == (repo.create_blob(expected_content), FileMode.BLOB)
+    # only the result was written
+    assert len(set(repo.odb) - objects) == 1
+
+    assert merge_blobs(repo, *args, compose=False) == res
+    assert merge_blobs(repo, *args, diff3_merger=Diff3Merger()) == res
+
+
+def test_multiple_parents_composed_overlap(tmp_path):
+    repo = create_repository(tmp_path)
+    # the change of the rebased first parent touches the change of the merge commit
+    blobs = create_octopus_blobs(repo, {1: [(1, "rebased p1\n")]})
+    items = {name: (blob.id, blob.filemode) for name, blob in blobs.items()}
+
+    assert (
+        merge_blob_deltas(
+            repo,
+            items["commit"],
+            items["base"],
+            [items[f"parent{i}"] for i in (1, 2, 3)],
+            items["new_base"],
+            [items[f"rebased_parent{i}"] for i in (1, 2, 3)],
+        )
+        is None
+    )
+    # the chained 3-way merges can solve it
+    res = merge_blobs(
+        repo,
+        blobs["commit"],
+        blobs["base"],
+        [blobs[f"parent{i}"] for i in (1, 2, 3)],
+        blobs["new_base"],
+        [blobs[f"rebased_parent{i}"] for i in (1, 2, 3)],
+    )
+    assert res == (
+        repo.create_blob(
+            file_lines(
+                (0, "upstream\n"),
+                (2, "p1\n"),
+                (1, "rebased p1\n"),
+                (4, "p2\n"),
+                (6, "p3\n"),
+                (8, "merge\n"),
+            )
+        ),
+        FileMode.BLOB,
+    )
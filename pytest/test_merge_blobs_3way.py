@@ -4,6 +4,8 @@
 import pygit2
 from pygit2.enums import FileMode
 
+from rebasedashdash import DiffAlgorithm
+from rebasedashdash import LRUCache
 from rebasedashdash import merge_blobs_3way
 
 from common import create_repository
@@ -262,3 +264,121 @@ def test_conflict_tree_conflict(tmp_path):
     assert conflict[0] == pygit2.IndexEntry("a", ancestor_blob_id, FileMode.BLOB)
     assert conflict[1] is None
     assert conflict[2] == pygit2.IndexEntry("a", their_blob_id, FileMode.BLOB)
+
+
+def test_merge_content(tmp_path):
+    repo = create_repository(tmp_path)
+
+    ancestor_blob_id = repo.create_blob("line 1\nline 2\nline 3\nline 4\nline 5\n")
+    our_blob_id = repo.create_blob("line 1 (ours)\nline 2\nline 3\nline 4\nline 5\n")
+    their_blob_id = repo.create_blob(
+        "line 1\nline 2\nline 3\nline 4\nline 5 (theirs)\n"
+    )
+    expected_blob_id = repo.create_blob(
+        "line 1 (ours)\nline 2\nline 3\nline 4\nline 5 (theirs)\n"
+    )
+
+    res = merge_blobs_3way(
+        repo,
+        (ancestor_blob_id, FileMode.BLOB),
+        (our_blob_id, FileMode.BLOB),
+        (their_blob_id, FileMode.BLOB_EXECUTABLE),
+    )
+    assert res == (expected_blob_id, FileMode.BLOB_EXECUTABLE)
+
+
+def test_merge_content_diff_algorithms(tmp_path):
+    repo = create_repository(tmp_path)
+
+    ancestor_blob_id = repo.create_blob("line 1\nline 2\nline 3\nline 4\nline 5\n")
+    our_blob_id = repo.create_blob("line 1 (ours)\nline 2\nline 3\nline 4\nline 5\n")
+    their_blob_id = repo.create_blob(
+        "line 1\nline 2\nline 3\nline 4\nline 5 (theirs)\n"
+    )
+    expected_blob_id = repo.create_blob(
+        "line 1 (ours)\nline 2\nline 3\nline 4\nline 5 (theirs)\n"
+    )
+
+    for diff_algorithm in DiffAlgorithm:
+        res = merge_blobs_3way(
+            repo,
+            (ancestor_blob_id, FileMode.BLOB),
+            (our_blob_id, FileMode.BLOB),
+            (their_blob_id, FileMode.BLOB),
+            diff_algorithm=diff_algorithm,
+        )
+        assert res == (expected_blob_id, FileMode.BLOB)
+
+
+def test_merge_content_no_scratch_trees(tmp_path):
+    repo = create_repository(tmp_path)
+
+    ancestor_blob_id = repo.create_blob("line 1\nline 2\nline 3\nline 4\nline 5\n")
+    our_blob_id = repo.create_blob("line 1 (ours)\nline 2\nline 3\nline 4\nline 5\n")
+    their_blob_id = repo.create_blob(
+        "line 1\nline 2\nline 3\nline 4\nline 5 (theirs)\n"
+    )
+
+    # only the merged blob makes it into the object database
+    objects_before = set(repo.odb)
+    res = merge_blobs_3way(
+        repo,
+        (ancestor_blob_id, FileMode.BLOB),
+        (our_blob_id, FileMode.BLOB),
+        (their_blob_id, FileMode.BLOB),
+    )
+    assert set(repo.odb) - objects_before == {res[0]}
+
+    # a conflict does not write anything
+    objects_before = set(repo.odb)
+    res = merge_blobs_3way(
+        repo,
+        (ancestor_blob_id, FileMode.BLOB),
+        (our_blob_id, FileMode.BLOB),
+        (repo.create_blob("line 1 (theirs)\nline 2\n"), FileMode.BLOB),
+    )
+    assert isinstance(res, pygit2.Index)
+    assert len(set(repo.odb) - objects_before) == 1  # the blob for theirs
+
+
+def test_cache(tmp_path):
+    repo = create_repository(tmp_path)
+    cache = LRUCache(2)
+
+    ancestor_blob_id = repo.create_blob("line 1\nline 2\nline 3\nline 4\nline 5\n")
+    our_blob_id = repo.create_blob("line 1 (ours)\nline 2\nline 3\nline 4\nline 5\n")
+    their_blob_id = repo.create_blob(
+        "line 1\nline 2\nline 3\nline 4\nline 5 (theirs)\n"
+    )
+    conflicting_blob_id = repo.create_blob("line 1 (theirs)\nline 2\n")
+
+    merge = (
+        (ancestor_blob_id, FileMode.BLOB),
+        (our_blob_id, FileMode.BLOB),
+        (their_blob_id, FileMode.BLOB),
+    )
+    conflict = (
+        (ancestor_blob_id, FileMode.BLOB),
+        (our_blob_id, FileMode.BLOB),
+        (conflicting_blob_id, FileMode.BLOB),
+    )
+
+    res = merge_blobs_3way(repo, *merge, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert merge_blobs_3way(repo, *merge, cache=cache) == res
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    res = merge_blobs_3way(repo, *conflict, cache=cache)
+    assert isinstance(res, pygit2.Index)
+    res = merge_blobs_3way(repo, *conflict, cache=cache)
+    assert isinstance(res, pygit2.Index)
+    assert res.conflicts["a"][2] == pygit2.IndexEntry(
+        "a", conflicting_blob_id, FileMode.BLOB
+    )
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # the oldest item is dropped when the cache is full
+    merge_blobs_3way(repo, *merge, diff_algorithm=DiffAlgorithm.PATIENCE, cache=cache)
+    assert len(cache) == 2
+    merge_blobs_3way(repo, *merge, cache=cache)
+    assert (cache.hits, cache.misses) == (2, 4)
@@ -0,0 +1,257 @@
+# copyright (c) 2025 Edmundo Carmona Antoranz
+# released under the terms of GPLv2.0
+
+import pygit2
+import pytest
+from pygit2.enums import FileMode
+
+import rebasedashdash
+from rebasedashdash import BlobMergePolicy
+from rebasedashdash import Diff3Merger
+from rebasedashdash import MergeStrategy
+from rebasedashdash import get_merge_policy
+from rebasedashdash import merge_blob_contents_streaming
+from rebasedashdash import merge_blob_deltas
+from rebasedashdash import merge_blobs_3way
+
+from common import add_test_blob
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+ANCESTOR = "line 1\nline 2\nline 3\nline 4\nline 5\n"
+OURS = "line 1 (ours)\nline 2\nline 3\nline 4\nline 5\n"
+THEIRS = "line 1\nline 2\nline 3\nline 4\nline 5 (theirs)\n"
+
+
+def create_blobs(repo, ancestor, ours, theirs):
+    return tuple(
+        (repo.create_blob(content), FileMode.BLOB)
+        for content in (ancestor, ours, theirs)
+    )
+
+
+def test_text(tmp_path):
+    repo = create_repository(tmp_path)
+
+    res = merge_blobs_3way(
+        repo,
+        *create_blobs(repo, ANCESTOR, OURS, THEIRS),
+        merge_policy=BlobMergePolicy(),
+    )
+    assert isinstance(res, tuple)
+
+
+def test_binary(tmp_path):
+    repo = create_repository(tmp_path)
+
+    res = merge_blobs_3way(
+        repo,
+        *create_blobs(repo, ANCESTOR + "\0", OURS + "\0", THEIRS + "\0"),
+        merge_policy=BlobMergePolicy(),
+    )
+    assert isinstance(res, pygit2.Index)
+
+
+def test_lfs_pointer(tmp_path):
+    repo = create_repository(tmp_path)
+
+    pointer = (
+        "version https://git-lfs.github.com/spec/v1\n" "oid sha256:{}\n" "size 12345\n"
+    )
+    res = merge_blobs_3way(
+        repo,
+        *create_blobs(
+            repo,
+            pointer.format("a" * 64),
+            pointer.format("b" * 64),
+            pointer.format("c" * 64),
+        ),
+        merge_policy=BlobMergePolicy(),
+    )
+    assert isinstance(res, pygit2.Index)
+
+
+def test_big_file_threshold(tmp_path):
+    repo = create_repository(tmp_path)
+
+    blobs = create_blobs(repo, ANCESTOR, OURS, THEIRS)
+
+    res = merge_blobs_3way(
+        repo, *blobs, merge_policy=BlobMergePolicy(big_file_threshold=10)
+    )
+    assert isinstance(res, pygit2.Index)
+
+    res = merge_blobs_3way(
+        repo, *blobs, merge_policy=BlobMergePolicy(big_file_threshold=None)
+    )
+    assert isinstance(res, tuple)
+
+
+def test_strategies(tmp_path):
+    repo = create_repository(tmp_path)
+
+    ancestor, ours, theirs = create_blobs(repo, ANCESTOR, OURS, THEIRS)
+    theirs = (theirs[0], FileMode.BLOB_EXECUTABLE)
+
+    res = merge_blobs_3way(
+        repo, ancestor, ours, theirs, merge_policy=BlobMergePolicy(MergeStrategy.OURS)
+    )
+    assert res == (ours[0], FileMode.BLOB_EXECUTABLE)
+
+    res = merge_blobs_3way(
+        repo,
+        ancestor,
+        ours,
+        theirs,
+        merge_policy=BlobMergePolicy(MergeStrategy.THEIRS),
+    )
+    assert res == (theirs[0], FileMode.BLOB_EXECUTABLE)
+
+    res = merge_blobs_3way(
+        repo,
+        ancestor,
+        ours,
+        theirs,
+        merge_policy=BlobMergePolicy(MergeStrategy.CONFLICT),
+    )
+    assert isinstance(res, pygit2.Index)
+
+
+def test_gitattributes(tmp_path):
+    repo = create_repository(tmp_path)
+
+    root_tree = create_test_tree()
+    add_test_blob(
+        root_tree,
+        ".gitattributes",
+        FileMode.BLOB,
+        "*.bin binary\n"
+        "*.nodiff -diff\n"
+        "*.lfs filter=lfs\n"
+        "*.ours merge=ours\n"
+        "*.theirs merge=theirs\n"
+        "*.txt merge\n",
+    )
+    commit = repo.get(create_commit(repo, root_tree, "attributes"))
+
+    assert get_merge_policy(repo, "a.bin", commit, 10) == BlobMergePolicy(
+        MergeStrategy.CONFLICT, 10
+    )
+    assert get_merge_policy(repo, "dir/a.nodiff", commit).strategy == (
+        MergeStrategy.CONFLICT
+    )
+    assert get_merge_policy(repo, "a.lfs", commit).strategy == MergeStrategy.CONFLICT
+    assert get_merge_policy(repo, "a.ours", commit).strategy == MergeStrategy.OURS
+    assert get_merge_policy(repo, "a.theirs", commit).strategy == MergeStrategy.THEIRS
+    assert get_merge_policy(repo, "a.txt", commit).strategy == MergeStrategy.TEXT
+    assert get_merge_policy(repo, "a.c", commit).strategy is None
+    assert get_merge_policy(repo, "a.c", None).strategy is None
+
+
+def test_streaming(tmp_path):
+    repo = create_repository(tmp_path)
+
+    ancestor = "".join(f"line {i}\n" for i in range(1000))
+    ours = ancestor.replace("line 10\n", "line 10 (ours)\n").replace(
+        "line 500\n", "line 500\nline 500.5 (ours)\n"
+    )
+    theirs = "line -1 (theirs)\n" + ancestor.replace("line 20\nline 21\n", "").replace(
+        "line 999\n", "line 999 (theirs)"
+    )
+    expected = repo.create_blob(
+        "line -1 (theirs)\n"
+        + ancestor.replace("line 10\n", "line 10 (ours)\n")
+        .replace("line 500\n", "line 500\nline 500.5 (ours)\n")
+        .replace("line 20\nline 21\n", "")
+        .replace("line 999\n", "line 999 (theirs)")
+    )
+    blobs = create_blobs(repo, ancestor, ours, theirs)
+
+    # the regular 3-way merge agrees
+    res = merge_blobs_3way(
+        repo, *blobs, merge_policy=BlobMergePolicy(streaming_threshold=None)
+    )
+    assert res == (expected, FileMode.BLOB)
+
+    for chunk_size in (7, 100, 1024 * 1024):
+        res = merge_blob_contents_streaming(repo, *blobs, chunk_size=chunk_size)
+        assert res == expected
+
+    res = merge_blobs_3way(
+        repo, *blobs, merge_policy=BlobMergePolicy(streaming_threshold=100)
+    )
+    assert res == (expected, FileMode.BLOB)
+
+
+def test_streaming_conflict(tmp_path):
+    repo = create_repository(tmp_path)
+
+    ancestor = "".join(f"line {i}\n" for i in range(100))
+    ours = ancestor.replace("line 10\n", "line 10 (ours)\n")
+    theirs = ancestor.replace("line 11\n", "line 11 (theirs)\n")
+    blobs = create_blobs(repo, ancestor, ours, theirs)
+
+    assert merge_blob_contents_streaming(repo, *blobs) is None
+    res = merge_blobs_3way(
+        repo, *blobs, merge_policy=BlobMergePolicy(streaming_threshold=100)
+    )
+    assert isinstance(res, pygit2.Index)
+
+    # the same change on both sides is not a conflict
+    blobs = create_blobs(repo, ancestor, ours, ours + "last line\n")
+    assert merge_blob_contents_streaming(repo, *blobs) == repo.create_blob(
+        ours + "last line\n"
+    )
+
+
+def test_streaming_windows(tmp_path, monkeypatch):
+    repo = create_repository(tmp_path)
+
+    # changes at both ends of a big file, what is in between is not diffed
+    ancestor = "".join(f"line {i}\n" for i in range(20000))
+    ours = "line 0 (ours)\n" + ancestor[len("line 0\n") :]
+    theirs = ancestor[: -len("line 19999\n")] + "line 19999 (theirs)\n"
+    blobs = create_blobs(repo, ancestor, ours, theirs)
+
+    windows = []
+    get_line_offsets = rebasedashdash._get_line_offsets
+
+    def record_window(content):
+        windows.append(len(content))
+        return get_line_offsets(content)
+
+    monkeypatch.setattr(rebasedashdash, "_get_line_offsets", record_window)
+    res = merge_blob_contents_streaming(repo, *blobs, chunk_size=1024)
+    assert res == repo.create_blob(
+        "line 0 (ours)\n"
+        + ancestor[len("line 0\n") : -len("line 19999\n")]
+        + "line 19999 (theirs)\n"
+    )
+    assert windows
+    assert max(windows) < 4 * 1024 < len(ancestor)
+
+
+def test_binary_not_loaded_to_decide(tmp_path, monkeypatch):
+    repo = create_repository(tmp_path)
+
+    # bigger than an LFS pointer: only the headers are read to decide
+    padding = "".join(f"padding line {i}\n" for i in range(100))
+    blobs = create_blobs(
+        repo, padding + ANCESTOR + "\0", padding + OURS + "\0", padding + THEIRS + "\0"
+    )
+    get = repo.get
+    monkeypatch.setattr(repo, "get", lambda *args: pytest.fail("blob was loaded"))
+    assert BlobMergePolicy().get_strategy(repo, *blobs) == MergeStrategy.TEXT
+    monkeypatch.setattr(repo, "get", get)
+
+    # the merges find out when they load the content
+    res = merge_blobs_3way(repo, *blobs, merge_policy=BlobMergePolicy())
+    assert isinstance(res, pygit2.Index)
+    res = merge_blobs_3way(
+        repo, *blobs, merge_policy=BlobMergePolicy(), diff3_merger=Diff3Merger()
+    )
+    assert isinstance(res, pygit2.Index)
+    assert merge_blob_contents_streaming(repo, *blobs) is None
+    ancestor, ours, theirs = blobs
+    assert merge_blob_deltas(repo, ours, ancestor, [], theirs, []) is None
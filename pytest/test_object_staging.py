@@ -0,0 +1,159 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import os
+
+import pygit2
+from pygit2.enums import FileMode
+
+from rebasedashdash import LRUCache
+from rebasedashdash import MergeBases
+from rebasedashdash import RebaseOptions
+from rebasedashdash import rebase
+
+from common import add_test_blob
+from common import add_test_tree
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def create_tree(first_line="", last_line="", conflict=""):
+    root_tree = create_test_tree()
+    content = "".join(f"line {i}\n" for i in range(10))
+    add_test_blob(
+        root_tree, "file.txt", FileMode.BLOB, first_line + content + last_line
+    )
+    tree = add_test_tree(root_tree, "dir")
+    add_test_blob(tree, "conflict.txt", FileMode.BLOB, f"conflict{conflict}\n")
+    return root_tree
+
+
+def create_scenario(repo, conflict):
+    # * main: adds a line at the beginning of file.txt
+    # | * other 2: adds a line at the end of file.txt
+    # | * other 1
+    # |/
+    # * base
+    base = create_commit(repo, create_tree(), "base")
+    main = create_commit(
+        repo,
+        create_tree("main\n", conflict=" main" if conflict else ""),
+        "main",
+        [base],
+    )
+    other = create_commit(
+        repo, create_tree(conflict=" other" if conflict else ""), "other 1", [base]
+    )
+    other = create_commit(
+        repo,
+        create_tree(last_line="other\n", conflict=" other" if conflict else ""),
+        "other 2",
+        [other],
+    )
+    return repo.get(main), repo.get(other)
+
+
+def list_objects(repo):
+    objects_path = os.path.join(repo.path, "objects")
+    return {
+        os.path.relpath(os.path.join(path, name), objects_path)
+        for path, _, names in os.walk(objects_path)
+        for name in names
+    }
+
+
+def test_objects_flushed_in_a_pack(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, False)
+    objects = list_objects(repo)
+
+    conflicts = []
+    result = rebase(repo, RebaseOptions(main, other), conflicts)
+    assert isinstance(result, pygit2.Commit)
+    assert conflicts == []
+
+    new_objects = list_objects(repo) - objects
+    # no loose objects, a single pack
+    assert sorted(os.path.splitext(path)[1] for path in new_objects) == [
+        ".idx",
+        ".pack",
+    ]
+    assert all(path.startswith("pack/") for path in new_objects)
+
+    # a new handle on the repository sees all the new objects
+    repo = pygit2.Repository(repo.path)
+    result = repo.get(result.id)
+    assert result.tree["file.txt"].data.decode() == (
+        "main\n" + "".join(f"line {i}\n" for i in range(10)) + "other\n"
+    )
+    assert repo.get(result.parents[0].id).parents[0].id == main.id
+
+
+def test_nothing_written_on_conflict(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, True)
+    objects = list_objects(repo)
+
+    conflicts = []
+    result = rebase(repo, RebaseOptions(main, other), conflicts)
+    assert isinstance(result, tuple)
+    assert [conflict[0] for conflict in conflicts] == ["dir/conflict.txt"]
+
+    assert list_objects(repo) == objects
+
+
+def test_no_staging(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, True)
+    objects = list_objects(repo)
+
+    conflicts = []
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.stage_objects = False
+    result = rebase(repo, rebase_options, conflicts)
+    assert isinstance(result, tuple)
+
+    # objects created before finding the conflict were written as loose objects
+    new_objects = list_objects(repo) - objects
+    assert new_objects
+    assert not any(path.startswith("pack/") for path in new_objects)
+
+
+def test_caches_kept(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, False)
+
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.blob_merge_cache = LRUCache(100)
+    rebase_options.tree_merge_cache = LRUCache(100)
+    rebase_options.merge_bases = MergeBases()
+    result = rebase(repo, rebase_options, [])
+    assert isinstance(result, pygit2.Commit)
+
+    # the results were flushed so they are kept for the next rebase
+    assert (result.tree["file.txt"].id, FileMode.BLOB) in (
+        rebase_options.blob_merge_cache._items.values()
+    )
+    assert len(rebase_options.tree_merge_cache) > 0
+    assert rebase_options.merge_bases._commits.keys() >= {result.id}
+
+
+def test_caches_without_unflushed_objects(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, True)
+
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.blob_merge_cache = LRUCache(100)
+    rebase_options.tree_merge_cache = LRUCache(100)
+    rebase_options.merge_bases = MergeBases()
+    result = rebase(repo, rebase_options, [])
+    assert isinstance(result, tuple)
+
+    # nothing was written into the repository: nothing can point to the rebased objects
+    for blob_result in rebase_options.blob_merge_cache._items.values():
+        assert not isinstance(blob_result, tuple) or blob_result[0] in repo
+    for tree_id, conflicts in rebase_options.tree_merge_cache._items.values():
+        assert tree_id is None or tree_id in repo
+        assert conflicts == []
+    assert all(commit_id in repo for commit_id in rebase_options.merge_bases._commits)
@@ -0,0 +1,91 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import pygit2
+from pygit2.enums import FileMode
+
+from rebasedashdash import RebaseOptions
+from rebasedashdash import rebase
+
+from common import add_test_blob
+from common import add_test_tree
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def file_content(name, top="", bottom=""):
+    return f"{name}{top}\n" + "".join(f"line {i}\n" for i in range(10)) + bottom
+
+
+def create_tree(top="", bottom="", conflict=""):
+    # a few directories with a few files each
+    root_tree = create_test_tree()
+    for directory in ("a", "b", "c"):
+        tree = add_test_tree(root_tree, directory)
+        subtree = add_test_tree(tree, "sub")
+        for name in ("file1.txt", "file2.txt"):
+            add_test_blob(tree, name, FileMode.BLOB, file_content(name, top, bottom))
+            add_test_blob(subtree, name, FileMode.BLOB, file_content(name, top, bottom))
+    add_test_blob(
+        root_tree, "conflict.txt", FileMode.BLOB, file_content("conflict", conflict)
+    )
+    return root_tree
+
+
+def create_scenario(repo, conflict):
+    # * main: modifies the top of all files
+    # | * other: modifies the bottom of all files
+    # |/
+    # * base
+    base = create_commit(repo, create_tree(), "base")
+    main = create_commit(
+        repo,
+        create_tree(top=" main", conflict=" main" if conflict else ""),
+        "main",
+        [base],
+    )
+    other = create_commit(
+        repo,
+        create_tree(bottom="other\n", conflict=" other" if conflict else ""),
+        "other",
+        [base],
+    )
+    return repo.get(main), repo.get(other)
+
+
+def run_rebase(repo, main, other, jobs):
+    conflicts = []
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.jobs = jobs
+    return rebase(repo, rebase_options, conflicts), conflicts
+
+
+def test_parallel_blob_merges(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, False)
+
+    result, conflicts = run_rebase(repo, main, other, 1)
+    assert isinstance(result, pygit2.Commit)
+    assert conflicts == []
+    assert result.tree["b/sub/file2.txt"].data.decode() == file_content(
+        "file2.txt", " main", "other\n"
+    )
+
+    parallel_result, conflicts = run_rebase(repo, main, other, 4)
+    assert isinstance(parallel_result, pygit2.Commit)
+    assert conflicts == []
+    assert parallel_result.tree.id == result.tree.id
+
+
+def test_parallel_blob_merges_conflict(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, True)
+
+    result, conflicts = run_rebase(repo, main, other, 1)
+    assert isinstance(result, tuple)
+    assert [conflict[0] for conflict in conflicts] == ["conflict.txt"]
+
+    parallel_result, parallel_conflicts = run_rebase(repo, main, other, 4)
+    assert isinstance(parallel_result, tuple)
+    assert parallel_conflicts == conflicts
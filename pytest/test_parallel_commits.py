@@ -0,0 +1,158 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import concurrent.futures
+
+import pygit2
+from pygit2.enums import FileMode
+
+from rebasedashdash import RebaseAction
+from rebasedashdash import RebaseOptions
+from rebasedashdash import plan_rebase
+from rebasedashdash import rebase
+from rebasedashdash import rebase_iter
+
+from common import add_test_blob
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def create_tree(files):
+    root_tree = create_test_tree()
+    for name, content in files.items():
+        add_test_blob(root_tree, name, FileMode.BLOB, content)
+    return root_tree
+
+
+def create_scenario(repo, conflicts=()):
+    # * other: adds other.txt
+    # *   merge
+    # |\
+    # | * c 2
+    # | * c 1
+    # * | b 2: changes main.txt if there is a conflict on b (same for c 2)
+    # * | b 1
+    # |/
+    # | * main: changes main.txt
+    # |/
+    # * base
+    files = {"main.txt": "base\n"}
+    base = create_commit(repo, create_tree(files), "base")
+    main = create_commit(repo, create_tree({"main.txt": "main\n"}), "main", [base])
+    tips = []
+    merged_files = dict(files)
+    for branch in ("b", "c"):
+        branch_files = dict(files)
+        tip = base
+        for i in (1, 2):
+            branch_files[f"{branch}{i}.txt"] = f"{branch} {i}\n"
+            if branch in conflicts and i == 2:
+                branch_files["main.txt"] = f"{branch}\n"
+            tip = create_commit(repo, create_tree(branch_files), f"{branch} {i}", [tip])
+        merged_files.update(branch_files)
+        tips.append(tip)
+    files = merged_files
+    merge = create_commit(repo, create_tree(files), "merge", tips)
+    files["other.txt"] = "other\n"
+    other = create_commit(repo, create_tree(files), "other", [merge])
+    return repo.get(main), repo.get(other)
+
+
+def test_plan_rebase(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+    base_id = main.parents[0].id
+
+    plans = plan_rebase(repo, RebaseOptions(main, other), [other.id], [base_id], main)
+    assert len(plans) == 6
+    plans = {plan.commit.message: plan for plan in plans}
+    assert not any(plan.reuse for plan in plans.values())
+    # paths changed against each parent: c1.txt and c2.txt, b1.txt and b2.txt
+    assert plans["merge"].cost == 4
+    assert plans["b 1"].cost == 1
+    assert [parent.commit.message for parent in plans["merge"].parents] == [
+        "b 2",
+        "c 2",
+    ]
+    # b 1 => b 2 => merge => other
+    assert plans["b 1"].priority == 7
+    assert plans["other"].priority == 1
+
+    # nothing changes if the commits go on top of the same base
+    plans = plan_rebase(
+        repo, RebaseOptions(main, other), [other.id], [base_id], main.parents[0]
+    )
+    assert all(plan.reuse for plan in plans)
+
+
+def test_parallel_commits(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+
+    serial_result = rebase(repo, RebaseOptions(main, other), [])
+    assert isinstance(serial_result, pygit2.Commit)
+
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.jobs = 4
+    events = rebase_iter(repo, rebase_options, [])
+    rebased = {}
+    try:
+        while True:
+            event = next(events)
+            assert event.action == RebaseAction.REBASED
+            # parents are always rebased before their children
+            for parent in event.commit.parents:
+                if parent.id != main.parents[0].id:
+                    assert parent.id in rebased
+            rebased[event.commit.id] = event.rebased_commit
+    except StopIteration as stop:
+        result = stop.value
+    assert len(rebased) == 6
+    assert result.id == rebased[other.id].id
+    assert result.tree.id == serial_result.tree.id
+    assert [parent.id for parent in result.parents[0].parents] == [
+        rebased[parent.id].id for parent in other.parents[0].parents
+    ]
+
+
+def test_parallel_commits_conflict(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, ("b",))
+
+    conflicts = []
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.jobs = 4
+    result = rebase(repo, rebase_options, conflicts)
+    assert isinstance(result, tuple)
+    assert result[1].message == "b 2"
+    assert [conflict[0] for conflict in conflicts] == ["main.txt"]
+
+
+def test_parallel_commits_conflicts_order(tmp_path, monkeypatch):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, ("b", "c"))
+    plans = plan_rebase(
+        repo, RebaseOptions(main, other), [other.id], [main.parents[0].id], main
+    )
+    first_conflict = next(
+        plan.commit for plan in plans if plan.commit.message in ("b 2", "c 2")
+    )
+
+    # both commits with conflicts finish at the same time
+    wait = concurrent.futures.wait
+    monkeypatch.setattr(
+        concurrent.futures,
+        "wait",
+        lambda futures, return_when: wait(
+            futures, return_when=concurrent.futures.ALL_COMPLETED
+        ),
+    )
+    for _ in range(5):
+        conflicts = []
+        rebase_options = RebaseOptions(main, other)
+        rebase_options.jobs = 4
+        result = rebase(repo, rebase_options, conflicts)
+        assert isinstance(result, tuple)
+        assert result[1].id == first_conflict.id
+        assert [conflict[0] for conflict in conflicts] == ["main.txt"]
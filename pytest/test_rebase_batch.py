@@ -0,0 +1,69 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import pytest
+from pygit2.enums import FileMode
+
+from rebasedashdash import RebaseOptions
+from rebasedashdash import rebase_batch
+
+from common import add_test_blob
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def create_tree(files):
+    root_tree = create_test_tree()
+    for name, content in files.items():
+        add_test_blob(root_tree, name, FileMode.BLOB, content)
+    return root_tree
+
+
+def create_scenario(repo):
+    # main and a few branches on top of base, "conflict" changes the same file as main
+    files = {"a.txt": "base\n"}
+    base = create_commit(repo, create_tree(files), "base")
+    main = create_commit(repo, create_tree({"a.txt": "main\n"}), "main", [base])
+    repo.references.create("refs/heads/main", main)
+    for branch in ("b1", "b2", "b3"):
+        tip = create_commit(
+            repo, create_tree(dict(files, **{f"{branch}.txt": "b\n"})), branch, [base]
+        )
+        repo.references.create(f"refs/heads/{branch}", tip)
+    tip = create_commit(repo, create_tree({"a.txt": "conflict\n"}), "conflict", [base])
+    repo.references.create("refs/heads/conflict", tip)
+    return repo.get(main)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_rebase_batch(tmp_path, jobs):
+    repo = create_repository(tmp_path)
+    main = create_scenario(repo)
+
+    results = {
+        result.spec: result
+        for result in rebase_batch(
+            repo,
+            main,
+            ["b1", "b2", "b3:b1", "conflict", "missing"],
+            RebaseOptions(None, None),
+            jobs,
+        )
+    }
+    assert len(results) == 5
+    for spec in ("b1", "b2"):
+        result = results[spec]
+        assert result.reason is None
+        assert result.reference == f"refs/heads/{spec}"
+        assert result.source == repo.references[result.reference].target
+        assert repo.get(result.commit).parent_ids == [main.id]
+    result = results["b3:b1"]
+    assert result.onto == repo.references["refs/heads/b1"].target
+    assert repo.get(result.commit).parent_ids == [result.onto]
+    result = results["conflict"]
+    assert result.commit is None
+    assert result.conflicts == ["a.txt"]
+    result = results["missing"]
+    assert result.commit is None and result.source is None
+    assert result.reason.startswith("Could not find missing")
@@ -0,0 +1,108 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import os
+
+import pygit2
+from pygit2.enums import FileMode
+
+import rebasedashdash
+from rebasedashdash import RebaseCache
+from rebasedashdash import RebaseOptions
+from rebasedashdash import rebase
+
+from common import add_test_blob
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def create_tree(files):
+    root_tree = create_test_tree()
+    for name, content in files.items():
+        add_test_blob(root_tree, name, FileMode.BLOB, content)
+    return root_tree
+
+
+def create_scenario(repo):
+    # * other 3
+    # * other 2
+    # * other 1
+    # | * main: changes a.txt
+    # |/
+    # * base
+    files = {"a.txt": "base\n"}
+    base = create_commit(repo, create_tree(files), "base")
+    main = create_commit(repo, create_tree({"a.txt": "main\n"}), "main", [base])
+    other = base
+    for i in range(1, 4):
+        files[f"other{i}.txt"] = f"other {i}\n"
+        other = create_commit(repo, create_tree(files), f"other {i}", [other])
+    return repo.get(main), repo.get(other)
+
+
+def run_rebase(repo, main, other, cache, verify=False):
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.rebase_cache = cache
+    rebase_options.verify_rebase_cache = verify
+    result = rebase(repo, rebase_options, [])
+    assert isinstance(result, pygit2.Commit)
+    return result
+
+
+def test_rebase_cache(tmp_path, monkeypatch):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+    cache_path = os.path.join(repo.path, "rebase--", "cache.sqlite")
+
+    cache = RebaseCache(cache_path)
+    result = run_rebase(repo, main, other, cache)
+    assert (cache.hits, cache.misses) == (0, 3)
+    cache.close()
+
+    # nothing is merged on the second run
+    monkeypatch.setattr(rebasedashdash, "merge_trees", None)
+    cache = RebaseCache(cache_path)
+    assert len(cache) == 3
+    assert run_rebase(repo, main, other, cache).id == result.id
+    assert (cache.hits, cache.misses) == (3, 0)
+    cache.close()
+
+
+def test_rebase_cache_verify(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+    cache_path = os.path.join(tmp_path, "cache.sqlite")
+
+    cache = RebaseCache(cache_path)
+    result = run_rebase(repo, main, other, cache)
+    # a bogus entry for the first commit: it points to the last one
+    first_commit = result.parents[0].parents[0]
+    key = RebaseCache.get_key(
+        RebaseOptions(main, other),
+        other.parents[0].parents[0],
+        [main.id],
+        first_commit.committer,
+    )
+    cache.put(key, result.id)
+    cache.save()
+
+    verified_result = run_rebase(repo, main, other, cache, verify=True)
+    assert cache.mismatches == 1
+    assert verified_result.tree.id == result.tree.id
+    assert cache.get(repo, key).id == verified_result.parents[0].parents[0].id
+
+
+def test_rebase_cache_eviction(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+    cache_path = os.path.join(tmp_path, "cache.sqlite")
+
+    cache = RebaseCache(cache_path, max_entries=2)
+    run_rebase(repo, main, other, cache)
+    cache.close()
+    assert len(RebaseCache(cache_path)) == 2
+
+    cache = RebaseCache(cache_path, max_age=-1)
+    cache.close()
+    assert len(RebaseCache(cache_path)) == 0
@@ -0,0 +1,113 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import pygit2
+from pygit2.enums import FileMode
+
+from rebasedashdash import RebaseAction
+from rebasedashdash import RebaseOptions
+from rebasedashdash import rebase_iter
+
+from common import add_test_blob
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def create_tree(files):
+    root_tree = create_test_tree()
+    for name, content in files.items():
+        add_test_blob(root_tree, name, FileMode.BLOB, content)
+    return root_tree
+
+
+def create_scenario(repo, conflict=False):
+    # * main: changes a.txt
+    # | * other 3: changes a.txt if there is a conflict
+    # | * other 2
+    # | * other 1
+    # |/
+    # * base
+    files = {"a.txt": "base\n"}
+    base = create_commit(repo, create_tree(files), "base")
+    main = create_commit(repo, create_tree({"a.txt": "main\n"}), "main", [base])
+    other = base
+    for i in range(1, 4):
+        files[f"other{i}.txt"] = f"other {i}\n"
+        if conflict and i == 3:
+            files["a.txt"] = "other\n"
+        other = create_commit(repo, create_tree(files), f"other {i}", [other])
+    return repo.get(main), repo.get(other)
+
+
+def test_rebase_iter(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+
+    events = rebase_iter(repo, RebaseOptions(main, other), [])
+    # commits are rebased as they are requested
+    event = next(events)
+    assert event.action == RebaseAction.REBASED
+    assert event.commit.message == "other 1"
+    assert event.counter == 1
+    assert event.seconds >= 0
+    assert event.rebased_commit.parents[0].id == main.id
+
+    other_events = []
+    try:
+        while True:
+            other_events.append(next(events))
+    except StopIteration as stop:
+        result = stop.value
+    assert [event.counter for event in other_events] == [2, 3]
+    assert [event.commit.message for event in other_events] == ["other 2", "other 3"]
+    assert other_events[0].rebased_commit.parents[0].id == event.rebased_commit.id
+    assert isinstance(result, pygit2.Commit)
+    assert result.id == other_events[-1].rebased_commit.id
+    assert result.tree["a.txt"].data == b"main\n"
+
+
+def test_rebase_iter_conflict(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, True)
+
+    conflicts = []
+    events = list(rebase_iter(repo, RebaseOptions(main, other), conflicts))
+    assert [event.action for event in events] == [
+        RebaseAction.REBASED,
+        RebaseAction.REBASED,
+        RebaseAction.CONFLICTS,
+    ]
+    assert events[-1].commit.id == other.id
+    assert events[-1].rebased_commit is None
+    assert [conflict[0] for conflict in conflicts] == ["a.txt"]
+
+
+def test_rebase_iter_lazy_commits(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+
+    events = rebase_iter(repo, RebaseOptions(main, other), [])
+    events = list(events)
+    # rebased commits are read once the rebase is over
+    assert [event.rebased_commit_id for event in events] == [
+        event.rebased_commit.id for event in events
+    ]
+    assert events[1].rebased_commit.parents[0].id == events[0].rebased_commit_id
+
+
+def test_rebase_iter_conflict_commits_map(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo, True)
+
+    events = rebase_iter(repo, RebaseOptions(main, other), [])
+    rebased_ids = []
+    try:
+        while True:
+            rebased_ids.append(next(events).rebased_commit_id)
+    except StopIteration as stop:
+        reason, commit, commits_map = stop.value
+    assert commit.id == other.id
+    assert all(isinstance(commit, pygit2.Commit) for commit in commits_map.values())
+    rebased_ids = [main.id] + rebased_ids[:-1]  # the last one had conflicts
+    assert [commit.id for commit in commits_map.values()] == rebased_ids
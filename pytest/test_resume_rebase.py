@@ -0,0 +1,138 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import os
+
+import pygit2
+from pygit2.enums import FileMode
+
+from rebasedashdash import RebaseAction
+from rebasedashdash import RebaseOptions
+from rebasedashdash import load_rebase_state
+from rebasedashdash import rebase
+from rebasedashdash import rebase_iter
+
+from common import add_test_blob
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+from common import write_test_tree
+
+
+def create_tree(files):
+    root_tree = create_test_tree()
+    for name, content in files.items():
+        add_test_blob(root_tree, name, FileMode.BLOB, content)
+    return root_tree
+
+
+def create_scenario(repo):
+    # * other 3
+    # * other 2: changes a.txt, conflict
+    # * other 1
+    # | * main: changes a.txt
+    # |/
+    # * base
+    files = {"a.txt": "base\n"}
+    base = create_commit(repo, create_tree(files), "base")
+    main = create_commit(repo, create_tree({"a.txt": "main\n"}), "main", [base])
+    other = base
+    for i in range(1, 4):
+        files[f"other{i}.txt"] = f"other {i}\n"
+        if i == 2:
+            files["a.txt"] = "other\n"
+        other = create_commit(repo, create_tree(files), f"other {i}", [other])
+    return repo.get(main), repo.get(other)
+
+
+def test_resume_rebase(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+    state_path = os.path.join(repo.path, "rebase--", "state.json")
+
+    conflicts = []
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.state_path = state_path
+    rebase_options.state_metadata = {"arguments": ["main", "other"]}
+    result = rebase(repo, rebase_options, conflicts)
+    assert isinstance(result, tuple)
+    other_2 = result[1]
+
+    state = load_rebase_state(state_path)
+    assert state.upstream == main.id
+    assert state.source == other.id
+    assert state.conflict == other_2.id
+    assert state.metadata == {"arguments": ["main", "other"]}
+    other_1 = other_2.parents[0]
+    assert list(state.commits_map) == [other_1.id]
+    # the rebased commit is in the repository even if objects were staged
+    assert repo.get(state.commits_map[other_1.id]).parents[0].id == main.id
+
+    # solved by hand
+    resolution = write_test_tree(
+        repo,
+        create_tree(
+            {
+                "a.txt": "main\nother\n",
+                "other1.txt": "other 1\n",
+                "other2.txt": "other 2\n",
+            }
+        ),
+    )
+    rebase_options = state.get_rebase_options(repo)
+    rebase_options.state_path = state_path
+    rebase_options.resolutions = {state.conflict: resolution}
+    conflicts = []
+    events = []
+    generator = rebase_iter(repo, rebase_options, conflicts)
+    try:
+        while True:
+            events.append(next(generator))
+    except StopIteration as stop:
+        result = stop.value
+    assert isinstance(result, pygit2.Commit)
+    assert [event.action for event in events] == [
+        RebaseAction.RESUMED,
+        RebaseAction.REBASED,
+        RebaseAction.REBASED,
+    ]
+    assert events[0].rebased_commit.id == state.commits_map[other_1.id]
+    assert events[1].rebased_commit.tree.id == resolution
+    assert result.tree["a.txt"].data == b"main\nother\n"
+    # the rebase is finished
+    assert not os.path.exists(state_path)
+
+
+def test_checkpoints(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+    state_path = os.path.join(tmp_path, "state.json")
+
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.state_path = state_path
+    rebase_options.checkpoint_interval = 1
+    events = rebase_iter(repo, rebase_options, [])
+    event = next(events)
+    # saved before the event comes out
+    state = load_rebase_state(state_path)
+    assert state.conflict is None
+    assert state.commits_map == {event.commit.id: event.rebased_commit.id}
+    assert repo.get(event.rebased_commit.id) is not None
+
+
+def test_state_of_another_rebase(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+    state_path = os.path.join(tmp_path, "state.json")
+
+    # a rebase that stopped on conflicts while the other one was running
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.state_path = state_path
+    rebase_options.state_metadata = {"id": "conflicts"}
+    assert isinstance(rebase(repo, rebase_options, []), tuple)
+
+    rebase_options = RebaseOptions(main, other.parents[0].parents[0])
+    rebase_options.state_path = state_path
+    rebase_options.state_metadata = {"id": "successful"}
+    assert isinstance(rebase(repo, rebase_options, []), pygit2.Commit)
+    assert load_rebase_state(state_path).metadata == {"id": "conflicts"}
@@ -0,0 +1,75 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import pygit2
+from pygit2.enums import FileMode
+
+from rebasedashdash import RebaseOptions
+from rebasedashdash import rebase
+
+from common import add_test_blob
+from common import add_test_tree
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def create_tree(files):
+    # files: path => content
+    root_tree = create_test_tree()
+    for path, content in files.items():
+        tree = root_tree
+        *directories, name = path.split("/")
+        for directory in directories:
+            tree = tree.get(directory) or add_test_tree(tree, directory)
+        add_test_blob(tree, name, FileMode.BLOB, content)
+    return root_tree
+
+
+def test_seeded_tree_builder(tmp_path):
+    repo = create_repository(tmp_path)
+    base_files = {f"{d}/file{i}.txt": f"{d} {i}\n" for d in "abc" for i in range(5)}
+    # * main: adds c/new.txt and modifies a/file1.txt
+    # | * other: modifies a/file3.txt, deletes a/file4.txt and the c directory
+    # |/
+    # * base
+    main_files = dict(base_files)
+    main_files["c/new.txt"] = "new\n"
+    main_files["a/file1.txt"] = "main\n"
+    other_files = {
+        path: content for path, content in base_files.items() if path[0] != "c"
+    }
+    other_files["a/file3.txt"] = "other\n"
+    del other_files["a/file4.txt"]
+    base = create_commit(repo, create_tree(base_files), "base")
+    main = create_commit(repo, create_tree(main_files), "main", [base])
+    other = create_commit(repo, create_tree(other_files), "other", [base])
+
+    conflicts = []
+    rebase_options = RebaseOptions(repo.get(main), repo.get(other))
+    rebase_options.diff_trees = False  # walk over the trees
+    result = rebase(repo, rebase_options, conflicts)
+    assert isinstance(result, pygit2.Commit)
+    assert conflicts == []
+
+    expected_files = {
+        path: content for path, content in main_files.items() if path[0] != "c"
+    }
+    expected_files["a/file3.txt"] = "other\n"
+    del expected_files["a/file4.txt"]
+    # the c directory is built on top of the rebased parent: only the new file is left
+    expected_files["c/new.txt"] = "new\n"
+    assert [
+        (entry.name, [(blob.name, blob.data.decode()) for blob in entry])
+        for entry in result.tree
+    ] == [
+        (
+            directory,
+            sorted(
+                (path[2:], content)
+                for path, content in expected_files.items()
+                if path[0] == directory
+            ),
+        )
+        for directory in "abc"
+    ]
@@ -0,0 +1,36 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import os
+import subprocess
+import sys
+
+import rebasedashdash
+
+# only the paths that use them import these modules
+LAZY_MODULES = (
+    "concurrent.futures",
+    "difflib",
+    "mmap",
+    "multiprocessing",
+    "numpy",
+    "socketserver",
+    "sqlite3",
+    "tempfile",
+)
+
+
+def test_lazy_imports():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, rebasedashdash\n"
+            f"print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))",
+        ],
+        cwd=os.path.dirname(os.path.abspath(rebasedashdash.__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.split() == []
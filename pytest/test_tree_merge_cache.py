@@ -0,0 +1,69 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import pygit2
+from pygit2.enums import FileMode
+
+from rebasedashdash import LRUCache
+from rebasedashdash import RebaseOptions
+from rebasedashdash import rebase
+
+from common import add_test_blob
+from common import add_test_tree
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def create_tree(upstream=False, changed=False):
+    root_tree = create_test_tree()
+    tree = add_test_tree(add_test_tree(root_tree, "a"), "b")
+    add_test_blob(tree, "file.txt", FileMode.BLOB, "changed\n" if changed else "base\n")
+    add_test_blob(
+        tree, "other.txt", FileMode.BLOB, "upstream\n" if upstream else "base\n"
+    )
+    return root_tree
+
+
+def create_scenario(repo):
+    # * other 3: changes a/b/file.txt again
+    # * other 2: reverts other 1
+    # * other 1: changes a/b/file.txt
+    # | * main: changes a/b/other.txt
+    # |/
+    # * base
+    base = create_commit(repo, create_tree(), "base")
+    main = create_commit(repo, create_tree(upstream=True), "main", [base])
+    other = base
+    for i in range(1, 4):
+        other = create_commit(
+            repo, create_tree(changed=i % 2 == 1), f"other {i}", [other]
+        )
+    return repo.get(main), repo.get(other)
+
+
+def run_rebase(repo, main, other, tree_merge_cache):
+    conflicts = []
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.diff_trees = False  # walk over the trees
+    rebase_options.tree_merge_cache = tree_merge_cache
+    result = rebase(repo, rebase_options, conflicts)
+    assert isinstance(result, pygit2.Commit)
+    assert conflicts == []
+    return result
+
+
+def test_tree_merge_cache(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+
+    tree_merge_cache = LRUCache(1024)
+    result = run_rebase(repo, main, other, tree_merge_cache)
+    # other 3 applies the same change as other 1 on top of the same trees
+    # so its root tree is taken from the cache
+    assert tree_merge_cache.hits == 1
+    assert result.tree["a/b/file.txt"].data == b"changed\n"
+    assert result.tree["a/b/other.txt"].data == b"upstream\n"
+
+    # nothing is cached
+    assert run_rebase(repo, main, other, LRUCache(0)).tree.id == result.tree.id
@@ -0,0 +1,57 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import pygit2
+from pygit2.enums import FileMode
+
+from rebasedashdash import CommitMetadata
+from rebasedashdash import TreePathIndex
+
+from common import add_test_blob
+from common import add_test_tree
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+from common import write_test_tree
+
+
+def create_tree():
+    root_tree = create_test_tree()
+    add_test_blob(root_tree, "file.txt", FileMode.BLOB, "root\n")
+    tree = add_test_tree(add_test_tree(root_tree, "a"), "b")
+    add_test_blob(tree, "file1.txt", FileMode.BLOB, "file 1\n")
+    add_test_blob(tree, "file2.txt", FileMode.BLOB, "file 2\n")
+    return root_tree
+
+
+def test_paths(tmp_path):
+    repo = create_repository(tmp_path)
+    tree = repo.get(write_test_tree(repo, create_tree()))
+    path_index = TreePathIndex(tree)
+
+    assert path_index["file.txt"].data == b"root\n"
+    assert path_index["a/b/file1.txt"].data == b"file 1\n"
+    assert path_index["a/b/file2.txt"].data == b"file 2\n"
+    assert isinstance(path_index["a/b"], pygit2.Tree)
+    assert path_index["a/b/file3.txt"] is None
+    assert path_index["a/c/file1.txt"] is None
+    # a blob is not a directory
+    assert path_index["file.txt/file1.txt"] is None
+
+    # directories are only resolved once
+    assert path_index.subtrees["a/b"].id == tree["a/b"].id
+    assert path_index.subtrees["a/c"] is None
+    assert path_index.subtrees["file.txt"] is None
+
+
+def test_commit_metadata(tmp_path):
+    repo = create_repository(tmp_path)
+    commit = repo.get(create_commit(repo, create_tree(), "commit"))
+    commit_metadata = CommitMetadata(repo, commit, [])
+
+    assert commit_metadata.get_tree_item(commit.tree_id, "a/b/file1.txt").data == (
+        b"file 1\n"
+    )
+    assert commit_metadata.get_tree_item(commit.tree_id, "a/b/file4.txt") is None
+    assert commit_metadata.get_tree_item(None, "a/b/file1.txt") is None
+    assert list(commit_metadata._path_indexes) == [commit.tree_id]
@@ -0,0 +1,121 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+from pygit2.enums import FileMode
+
+from rebasedashdash import TreesIterator
+
+from common import add_test_blob
+from common import add_test_tree
+from common import create_repository
+from common import create_test_tree
+from common import write_test_tree
+
+
+def write_tree(repo, blobs=[], trees=[]):
+    tree = create_test_tree()
+    for name in blobs:
+        add_test_blob(tree, name, FileMode.BLOB, f"{name}\n")
+    for name in trees:
+        add_test_blob(add_test_tree(tree, name), "file.txt", FileMode.BLOB, "file\n")
+    return repo.get(write_test_tree(repo, tree))
+
+
+def iterate(trees_iterator):
+    paths = []
+    while tree_items := trees_iterator.next_tree_items():
+        path, commit_item, original_items, rebased_items = tree_items
+        paths.append(
+            (
+                path,
+                commit_item is not None,
+                [item is not None for item in original_items],
+                [item is not None for item in rebased_items],
+            )
+        )
+    return paths
+
+
+def test_paths(tmp_path):
+    repo = create_repository(tmp_path)
+    commit_tree = write_tree(repo, ["a.txt", "c"])
+    original_tree = write_tree(repo, ["b", "c"])
+    rebased_tree = write_tree(repo, ["a.txt", "d"])
+
+    assert iterate(TreesIterator(commit_tree, [original_tree], [rebased_tree])) == [
+        ("a.txt", True, [False], [True]),
+        ("b", False, [True], [False]),
+        ("c", True, [True], [False]),
+        ("d", False, [False], [True]),
+    ]
+
+
+def test_git_order(tmp_path):
+    repo = create_repository(tmp_path)
+    # git sorts the tree "a" after "a.txt"
+    commit_tree = write_tree(repo, ["a.txt"], ["a"])
+    original_tree = write_tree(repo, ["a.txt"], ["a"])
+    rebased_tree = write_tree(repo, ["a-b", "a.txt"], ["a"])
+
+    assert iterate(TreesIterator(commit_tree, [original_tree], [rebased_tree])) == [
+        ("a-b", False, [False], [True]),
+        ("a.txt", True, [True], [True]),
+        ("a", True, [True], [True]),
+    ]
+
+
+def test_blob_and_tree_with_the_same_name(tmp_path):
+    repo = create_repository(tmp_path)
+    commit_tree = write_tree(repo, ["a"])
+    original_tree = write_tree(repo, ["a"])
+    rebased_tree = write_tree(repo, [], ["a"])
+
+    # nothing in between, they are taken together
+    assert iterate(TreesIterator(commit_tree, [original_tree], [rebased_tree])) == [
+        ("a", True, [True], [True]),
+    ]
+
+
+def test_octopus(tmp_path):
+    repo = create_repository(tmp_path)
+    parents = 20
+    original_trees = [
+        write_tree(repo, ["common", f"original{i:02}"]) for i in range(parents)
+    ]
+    rebased_trees = [
+        write_tree(repo, ["common", f"rebased{i:02}"]) if i % 2 else None
+        for i in range(parents)
+    ]
+
+    paths = iterate(TreesIterator(None, original_trees, rebased_trees))
+    assert [path[0] for path in paths] == ["common"] + [
+        f"original{i:02}" for i in range(parents)
+    ] + [f"rebased{i:02}" for i in range(1, parents, 2)]
+    assert paths[0] == (
+        "common",
+        False,
+        [True] * parents,
+        [bool(i % 2) for i in range(parents)],
+    )
+    assert paths[3][2] == [i == 2 for i in range(parents)]
+
+
+def test_skip_matching(tmp_path):
+    repo = create_repository(tmp_path)
+    commit_tree = write_tree(repo, ["a.txt", "b.txt"], ["c"])
+    original_tree = write_tree(repo, ["a.txt"], ["c"])
+    rebased_tree = write_tree(repo, ["a.txt", "b.txt"], ["c", "d"])
+
+    trees_iterator = TreesIterator(
+        commit_tree, [original_tree], [rebased_tree], skip_matching=True
+    )
+    assert iterate(trees_iterator) == [
+        ("b.txt", True, [False], [True]),
+        ("d", False, [False], [True]),
+    ]
+
+    # entries are raw: (mode, name, id)
+    trees_iterator = TreesIterator(commit_tree, [original_tree], [rebased_tree])
+    path, commit_item, original_items, rebased_items = trees_iterator.next_tree_items()
+    assert commit_item == (b"100644", b"a.txt", commit_tree["a.txt"].id.raw)
+    assert original_items == rebased_items == [commit_item]
@@ -0,0 +1,111 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import pygit2
+import pytest
+from pygit2.enums import FileMode
+
+from rebasedashdash import RebaseOptions
+from rebasedashdash import find_stacked_branches
+from rebasedashdash import rebase
+from rebasedashdash import update_references
+
+from common import add_test_blob
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def create_tree(files):
+    root_tree = create_test_tree()
+    for name, content in files.items():
+        add_test_blob(root_tree, name, FileMode.BLOB, content)
+    return root_tree
+
+
+def create_scenario(repo):
+    # * b3
+    # * b2
+    # | * side
+    # |/
+    # * b1
+    # | * main
+    # |/
+    # * base
+    files = {"a.txt": "base\n"}
+    base = create_commit(repo, create_tree(files), "base")
+    main = create_commit(
+        repo, create_tree(dict(files, **{"main.txt": "main\n"})), "main", [base]
+    )
+    tip = base
+    for branch in ("b1", "b2", "b3"):
+        files[f"{branch}.txt"] = f"{branch}\n"
+        tip = create_commit(repo, create_tree(files), branch, [tip])
+        repo.references.create(f"refs/heads/{branch}", tip)
+    side_files = {"a.txt": "base\n", "b1.txt": "b1\n", "side.txt": "side\n"}
+    side = create_commit(
+        repo, create_tree(side_files), "side", [repo.references["refs/heads/b1"].target]
+    )
+    repo.references.create("refs/heads/side", side)
+    repo.references.create("refs/heads/main", main)
+    return repo.get(main), repo.get(tip)
+
+
+def test_find_stacked_branches(tmp_path):
+    repo = create_repository(tmp_path)
+    main, b3 = create_scenario(repo)
+
+    assert find_stacked_branches(repo, b3.id, main.parent_ids[0]) == {
+        f"refs/heads/{branch}": repo.references[f"refs/heads/{branch}"].target
+        for branch in ("b1", "b2", "b3")
+    }
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_update_refs(tmp_path, jobs):
+    repo = create_repository(tmp_path)
+    main, b3 = create_scenario(repo)
+    update_refs = {
+        name: repo.references[name].target
+        for name in ("refs/heads/b1", "refs/heads/b2", "refs/heads/side")
+    }
+
+    rebase_options = RebaseOptions(main, b3)
+    rebase_options.jobs = jobs
+    rebase_options.update_refs = update_refs
+    result = rebase(repo, rebase_options, [])
+    assert isinstance(result, pygit2.Commit)
+
+    rebased_refs = rebase_options.rebased_refs
+    assert set(rebased_refs) == set(update_refs)
+    assert result.parent_ids == [rebased_refs["refs/heads/b2"]]
+    # the branch that is not part of the stack is rebased in the same pass
+    side = repo.get(rebased_refs["refs/heads/side"])
+    assert side.parent_ids == [rebased_refs["refs/heads/b1"]]
+    assert side.tree["main.txt"].data == b"main\n"
+    assert repo.get(rebased_refs["refs/heads/b1"]).parent_ids == [main.id]
+
+    update_references(repo, update_refs, rebased_refs, "rebase")
+    for name, target in rebased_refs.items():
+        assert repo.references[name].target == target
+
+
+def test_update_references_moved(tmp_path):
+    repo = create_repository(tmp_path)
+    main, b3 = create_scenario(repo)
+    original_targets = {
+        name: repo.references[name].target
+        for name in ("refs/heads/b1", "refs/heads/b2")
+    }
+    repo.references["refs/heads/b2"].set_target(b3.id)
+
+    with pytest.raises(pygit2.GitError):
+        update_references(
+            repo,
+            original_targets,
+            {"refs/heads/b1": main.id, "refs/heads/b2": main.id},
+            "rebase",
+        )
+    # none of them moved
+    assert repo.references["refs/heads/b1"].target == original_targets["refs/heads/b1"]
+    assert repo.references["refs/heads/b2"].target == b3.id
@@ -0,0 +1,100 @@
+# Copyright (c) 2025 Edmundo Carmona Antoranz
+# Released under the terms of GPLv2.0
+
+import pygit2
+from pygit2.enums import FileMode
+
+from rebasedashdash import RebaseAction
+from rebasedashdash import RebaseOptions
+from rebasedashdash import find_upstream_commits
+from rebasedashdash import rebase
+from rebasedashdash import rebase_iter
+
+from common import add_test_blob
+from common import create_commit
+from common import create_repository
+from common import create_test_tree
+
+
+def create_tree(files):
+    root_tree = create_test_tree()
+    for name, content in files.items():
+        add_test_blob(root_tree, name, FileMode.BLOB, content)
+    return root_tree
+
+
+def create_scenario(repo):
+    # * main 2: cherry-pick of other 2
+    # * main 1: changes a.txt
+    # | * other 3
+    # | * other 2: changes b.txt
+    # | * other 1
+    # |/
+    # * base
+    files = {"a.txt": "base\n", "b.txt": "base\n"}
+    base = create_commit(repo, create_tree(files), "base")
+    main_files = dict(files, **{"a.txt": "main\n"})
+    main = create_commit(repo, create_tree(main_files), "main 1", [base])
+    main_files["b.txt"] = "other\n"
+    main = create_commit(repo, create_tree(main_files), "main 2", [main])
+    other = base
+    for i in range(1, 4):
+        if i == 2:
+            files["b.txt"] = "other\n"
+        else:
+            files[f"other{i}.txt"] = f"other {i}\n"
+        other = create_commit(repo, create_tree(files), f"other {i}", [other])
+    return repo.get(main), repo.get(other)
+
+
+def test_find_upstream_commits(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+    base_id = main.parents[0].parent_ids[0]
+
+    assert find_upstream_commits(repo, [other.id], main.id, [base_id]) == {
+        other.parent_ids[0]
+    }
+    assert (
+        find_upstream_commits(repo, [other.id], main.parent_ids[0], [base_id]) == set()
+    )
+
+
+def test_drop_upstream_commits(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+
+    for jobs in (1, 4):
+        rebase_options = RebaseOptions(main, other)
+        rebase_options.jobs = jobs
+        events = list(rebase_iter(repo, rebase_options, []))
+        assert [event.action for event in events] == [
+            RebaseAction.REBASED,
+            RebaseAction.DROPPED,
+            RebaseAction.REBASED,
+        ]
+        # it became its rebased parent
+        assert events[1].rebased_commit.id == events[0].rebased_commit.id
+        result = events[2].rebased_commit
+        assert [commit.message for commit in repo.walk(result.id)][:3] == [
+            "other 3",
+            "other 1",
+            "main 2",
+        ]
+        assert result.tree["b.txt"].data == b"other\n"
+
+
+def test_reapply_cherry_picks(tmp_path):
+    repo = create_repository(tmp_path)
+    main, other = create_scenario(repo)
+
+    rebase_options = RebaseOptions(main, other)
+    rebase_options.reapply_cherry_picks = True
+    result = rebase(repo, rebase_options, [])
+    assert isinstance(result, pygit2.Commit)
+    assert [commit.message for commit in repo.walk(result.id)][:4] == [
+        "other 3",
+        "other 2",
+        "other 1",
+        "main 2",
+    ]
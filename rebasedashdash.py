@@ -4,12 +4,38 @@
 # part of rebase--
 # https://github.com/eantoranz/rebase--
 
+import copy
+import heapq
+import io
+import itertools
+import json
+import operator
+import os
 import pygit2
+import re
 import sys
+import threading
+import time
 import typing
+from collections import OrderedDict
 from collections.abc import Callable
 from enum import Enum
 
+# modules that take a while to import (numpy, multiprocessing, sqlite3, concurrent.futures)
+# and the ones that only some paths need (socketserver and socket for the daemon, difflib for
+# the diff3 engine, mmap and struct for the commit-graph, tempfile to stage objects) are
+# imported when they are first needed so that starting rebase-- does not pay for them
+
+# optional, used to tokenize blobs in bulk in the python diff3 engine
+numpy = None
+_numpy_imported = False
+
+try:
+    # the high-level wrapper for file merges in pygit2 does not take options and
+    # insists on decoding the content, so we talk to libgit2 directly
+    from pygit2.ffi import ffi as _ffi, C as _C
+except ImportError:
+    _ffi, _C = None, None
 
 if not hasattr(pygit2, "enums"):
     sys.stderr.write(
@@ -25,6 +51,278 @@ class RebaseAction(Enum):
     REBASED = 1  # the commit was rebased
     REUSED = 2  # the commit was skipped
     CONFLICTS = 3  # There were conflicts dealing with this commit
+    RESUMED = 4  # the commit was rebased in a previous run
+    DROPPED = 5  # the changes of the commit are already upstream
+
+
+class CommitRecord(typing.NamedTuple):
+    """
+    What the rebase needs to know about a commit, instead of keeping a pygit2.Commit around
+    """
+
+    id: pygit2.Oid
+    tree_id: pygit2.Oid
+    parent_ids: list[pygit2.Oid]
+
+    @classmethod
+    def from_commit(cls, commit: pygit2.Commit) -> "CommitRecord":
+        return cls(commit.id, commit.tree_id, commit.parent_ids)
+
+
+class RebaseEvent:
+    """
+    What happened with a commit, as yielded by rebase_iter()
+
+    The rebased commit is only read from the repository when it is asked for. If the
+    objects are staged and the rebase fails, that has to happen while the rebase is running.
+    """
+
+    __slots__ = ("action", "commit", "counter", "seconds", "_rebased_commit", "_repo")
+
+    def __init__(
+        self,
+        action: RebaseAction,
+        commit: pygit2.Commit,  # original commit
+        rebased_commit: typing.Union[
+            pygit2.Commit, CommitRecord, None
+        ],  # None if there were conflicts
+        counter: int,  # 1 for the first commit of the rebase
+        seconds: float,  # time that it took to process the commit
+        repo: typing.Union[pygit2.Repository, None] = None,  # to read rebased_commit
+    ):
+        self.action = action
+        self.commit = commit
+        self.counter = counter
+        self.seconds = seconds
+        self._rebased_commit = rebased_commit
+        self._repo = repo
+
+    @property
+    def rebased_commit_id(self) -> typing.Union[pygit2.Oid, None]:
+        return self._rebased_commit.id if self._rebased_commit is not None else None
+
+    @property
+    def rebased_commit(self) -> typing.Union[pygit2.Commit, None]:
+        if isinstance(self._rebased_commit, CommitRecord):
+            self._rebased_commit = self._repo.get(self._rebased_commit.id)
+        return self._rebased_commit
+
+    def __repr__(self):
+        return (
+            f"RebaseEvent({self.action}, {self.commit.id}, {self.rebased_commit_id}, "
+            f"{self.counter}, {self.seconds})"
+        )
+
+
+class DiffAlgorithm(Enum):
+    MYERS = "myers"
+    MINIMAL = "minimal"
+    PATIENCE = "patience"
+    # libgit2 can't merge files with histogram, patience is used instead
+    HISTOGRAM = "histogram"
+
+
+class MergeEngine(Enum):
+    LIBGIT2 = "libgit2"  # file merges from libgit2
+    PYTHON = "python"  # Diff3Merger
+
+
+DIFF_ALGORITHM_OPTIONS = {
+    DiffAlgorithm.MYERS: pygit2.enums.DiffOption.NORMAL,
+    DiffAlgorithm.MINIMAL: pygit2.enums.DiffOption.MINIMAL,
+    DiffAlgorithm.PATIENCE: pygit2.enums.DiffOption.PATIENCE,
+    DiffAlgorithm.HISTOGRAM: pygit2.enums.DiffOption.PATIENCE,
+}
+
+DIFF_ALGORITHM_FLAGS = {
+    DiffAlgorithm.MYERS: pygit2.enums.MergeFileFlag.DEFAULT,
+    DiffAlgorithm.MINIMAL: pygit2.enums.MergeFileFlag.DIFF_MINIMAL,
+    DiffAlgorithm.PATIENCE: pygit2.enums.MergeFileFlag.DIFF_PATIENCE,
+    DiffAlgorithm.HISTOGRAM: pygit2.enums.MergeFileFlag.DIFF_PATIENCE,
+}
+
+
+class MergeStrategy(Enum):
+    TEXT = 1  # regular 3-way merge of the content
+    OURS = 2  # keep our side without looking at the content
+    THEIRS = 3  # keep their side without looking at the content
+    CONFLICT = 4  # it can't be merged
+    STREAMING = 5  # 3-way merge that works on chunks of the content, for big blobs
+
+
+LFS_POINTER_HEADER = b"version https://git-lfs.github.com/spec/v1"
+LFS_POINTER_MAX_SIZE = 1024
+BIG_FILE_THRESHOLD = 512 * 1024 * 1024  # same default as git's core.bigFileThreshold
+STREAMING_MERGE_THRESHOLD = 16 * 1024 * 1024
+STREAMING_CHUNK_SIZE = 1024 * 1024
+
+
+class LRUCache:
+    """
+    Bounded cache that drops the least recently used items first.
+    It keeps track of hits and misses so that it can be tuned.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()  # blobs can be merged in parallel
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key) -> tuple[bool, typing.Any]:
+        # values can be None so we also say if the key was found
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def clear(self):
+        # hits and misses are kept
+        with self._lock:
+            self._items.clear()
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def retain(self, keep: Callable[[typing.Any, typing.Any], bool]):
+        # drop the items for which keep(key, value) is false
+        with self._lock:
+            for key in [
+                key for key, value in self._items.items() if not keep(key, value)
+            ]:
+                del self._items[key]
+
+
+class RebaseCache:
+    """
+    Commits rebased on previous runs, kept in a sqlite database:
+    (original commit, rebased parents, engine) => rebased commit.
+    New entries are kept aside until save() is called, once the commits are in the repository.
+    Entries that have not been used for max_age seconds and the least recently used entries
+    beyond max_entries are evicted when the cache is closed.
+    """
+
+    VERSION = 1  # bump it when changes in the engine could give different results
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 100000,
+        max_age: float = 30 * 24 * 60 * 60,
+    ):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.mismatches = 0  # found when verifying
+        self._pending: dict[str, str] = {}
+        self._lock = threading.Lock()  # commits can be rebased in parallel
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "create table if not exists commits "
+            "(key text primary key, commit_id text not null, used real not null)"
+        )
+        self._connection.execute(
+            "create index if not exists commits_used on commits (used)"
+        )
+        self._connection.commit()
+
+    @classmethod
+    def get_key(
+        cls,
+        rebase_options: "RebaseOptions",
+        commit: pygit2.Commit,
+        rebased_parent_ids: list[pygit2.Oid],
+        signature: pygit2.Signature,
+    ) -> str:
+        # options that can change the resulting trees and the committer are part of the key
+        return ":".join(
+            [
+                str(cls.VERSION),
+                rebase_options.merge_engine.value,
+                rebase_options.diff_algorithm.value,
+                signature.name,
+                signature.email,
+                str(commit.id),
+                ",".join(str(parent_id) for parent_id in rebased_parent_ids),
+            ]
+        )
+
+    def get(
+        self, repo: pygit2.Repository, key: str
+    ) -> typing.Union[pygit2.Commit, None]:
+        with self._lock:
+            row = self._connection.execute(
+                "select commit_id from commits where key = ?", (key,)
+            ).fetchone()
+            commit = repo.get(row[0]) if row is not None else None
+            if commit is None:
+                # the commit could have been garbage-collected
+                self.misses += 1
+                return None
+            self._connection.execute(
+                "update commits set used = ? where key = ?", (time.time(), key)
+            )
+            self.hits += 1
+            return commit
+
+    def put(self, key: str, commit_id: pygit2.Oid):
+        with self._lock:
+            self._pending[key] = str(commit_id)
+
+    def save(self):
+        with self._lock:
+            now = time.time()
+            self._connection.executemany(
+                "insert or replace into commits (key, commit_id, used) values (?, ?, ?)",
+                ((key, commit_id, now) for key, commit_id in self._pending.items()),
+            )
+            self._connection.commit()
+            self._pending.clear()
+
+    def discard(self):
+        # the commits of the new entries are gone
+        with self._lock:
+            self._pending.clear()
+
+    def evict(self):
+        with self._lock:
+            self._connection.execute(
+                "delete from commits where used < ?", (time.time() - self.max_age,)
+            )
+            self._connection.execute(
+                "delete from commits where key in "
+                "(select key from commits order by used desc limit -1 offset ?)",
+                (self.max_entries,),
+            )
+            self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("select count(*) from commits").fetchone()[
+                0
+            ]
+
+    def close(self):
+        # entries that were not saved are dropped
+        self.evict()
+        self._connection.close()
 
 
 class RebaseOptions:
@@ -43,6 +341,94 @@ class RebaseOptions:
     """
     debug: bool = False
     debug_paths: list[str] = []
+    diff_algorithm: DiffAlgorithm = DiffAlgorithm.MYERS
+    big_file_threshold: typing.Union[int, None] = BIG_FILE_THRESHOLD
+    """
+    Blobs bigger than this (in bytes) are not merged line by line. None means no limit.
+    """
+    streaming_merge_threshold: typing.Union[int, None] = STREAMING_MERGE_THRESHOLD
+    """
+    Blobs bigger than this (in bytes) are merged in chunks to keep memory usage in check.
+    """
+    merge_engine: MergeEngine = MergeEngine.LIBGIT2
+    diff3_merger: typing.Union["Diff3Merger", None] = None
+    """
+    Used when merge_engine is PYTHON. rebase() creates it if it is not set.
+    """
+    jobs: int = (
+        1  # commits (and blob merges of a commit) that can be rebased at the same time
+    )
+    diff_trees: bool = True
+    """
+    Only look at the paths that changed between the original and the rebased parents
+    (using libgit2 tree diffs) instead of walking over the trees.
+    """
+    stage_objects: bool = True
+    """
+    Keep the objects created during the rebase out of the repository. Only the objects
+    reachable from the final commit are written (in a single pack) if the rebase is successful.
+    """
+    compose_blob_merges: bool = True
+    """
+    Apply all the changes needed to rebase a blob of a merge commit in a single pass
+    instead of chaining 3-way merges, if the changes do not overlap.
+    """
+    blob_merge_cache_size: int = 4096
+    blob_merge_cache: typing.Union[LRUCache, None] = None
+    """
+    3-way blob merges that have already been calculated. rebase() creates it if it is not set.
+    """
+    tree_merge_cache_size: int = 65536
+    tree_merge_cache: typing.Union[LRUCache, None] = None
+    """
+    Results of merge_trees on subtrees of single-parent commits (tree id and conflicts)
+    so that the same subtrees in the following commits are not merged again.
+    rebase() creates it if it is not set.
+    """
+    state_path: typing.Union[str, None] = None
+    """
+    File where the progress of the rebase is saved (see RebaseState) every checkpoint_interval
+    commits and when there are conflicts so that it can be continued later on.
+    It is removed when the rebase is successful.
+    """
+    checkpoint_interval: int = 100
+    state_metadata: dict = {}  # saved along the state (it has to be JSON-serializable)
+    commits_map: typing.Union[dict[pygit2.Oid, pygit2.Oid], None] = None
+    """
+    Commits that were rebased on a previous run of the rebase (original id => rebased id).
+    """
+    resolutions: typing.Union[dict[pygit2.Oid, pygit2.Oid], None] = None
+    """
+    Trees to use as the result of rebasing some commits instead of merging them
+    (commit id => tree id), like when a conflict was solved by hand.
+    """
+    reapply_cherry_picks: bool = False
+    upstream_commits: typing.Union[set[pygit2.Oid], None] = None
+    """
+    Commits being rebased whose changes are already upstream (they have the same patch id
+    as an upstream commit) so they are dropped. rebase() finds them if they are not set,
+    unless reapply_cherry_picks is set.
+    """
+    merge_bases: typing.Union["MergeBases", None] = None
+    """
+    Merge bases of the parents of merge commits. rebase() creates it if it is not set
+    (using the commit-graph of the repository if there is one).
+    """
+    update_refs: typing.Union[dict[str, pygit2.Oid], None] = None
+    """
+    References to rebase along with the source, like the branches of a stack (name => commit
+    they point to). The union of their ranges is rebased in a single pass. They are not moved:
+    when the rebase is successful, rebased_refs tells where they should point to.
+    """
+    rebased_refs: typing.Union[dict[str, pygit2.Oid], None] = None
+    rebase_cache: typing.Union[RebaseCache, None] = None
+    """
+    Commits rebased on previous runs. They are used instead of rebasing the commits again.
+    """
+    verify_rebase_cache: bool = False
+    """
+    Rebase the commits even if they are in rebase_cache and check that the results match.
+    """
 
     def __init__(
         self,
@@ -61,7 +447,46 @@ def log(message: str, rebase_options: typing.Union[RebaseOptions, None] = None):
         sys.stderr.flush()
 
 
+TreeEntry = tuple[bytes, bytes, bytes]
+"""
+An entry of a tree the way it is stored in the tree object: (mode in octal, name, raw id)
+"""
+
+_TREE_ENTRY_PATTERN = re.compile(rb"(\d+) ([^\0]*)\0(.{20})", re.DOTALL)
+_TREE_MODE = b"40000"
+_BLOB_MODES = (b"100644", b"100755", b"120000")
+
+
+def read_tree_entries(tree: pygit2.Tree) -> list[TreeEntry]:
+    # all the entries of the tree in one go, no objects are created for them
+    return _TREE_ENTRY_PATTERN.findall(tree.read_raw())
+
+
+def _tree_entry_key(entry: TreeEntry) -> bytes:
+    # git sorts tree entries as if trees had a trailing slash
+    return entry[1] + b"/" if entry[0] == _TREE_MODE else entry[1]
+
+
+def _is_tree_entry(entry: typing.Union[TreeEntry, None]) -> bool:
+    return entry is None or entry[0] == _TREE_MODE
+
+
+def _is_blob_entry(entry: typing.Union[TreeEntry, None]) -> bool:
+    return entry is None or entry[0] in _BLOB_MODES
+
+
 class TreesIterator:
+    """
+    Walks over the entries of the tree of the commit and the trees of its original/rebased
+    parents at the same time, in the order that git uses for trees, one path at a time.
+
+    Entries are raw TreeEntry tuples, pygit2 objects are not created for them.
+    Each tree has a slot (0 is the commit tree, then original parents, then rebased parents)
+    that holds its current entry. Slots are grouped by the key of their current entry and
+    a heap keeps the keys sorted so that each step only touches the trees that have the path.
+
+    With skip_matching, entries that are exactly the same in all the trees are left out.
+    """
 
     def next_tree_item(self, tree_iterator):  # TODO what is the type of an interator?
         if tree_iterator is None:
@@ -76,98 +501,76 @@ class TreesIterator:
         original_tree: pygit2.Tree,
         original_parent_trees: list[pygit2.Tree],
         rebased_parent_trees: list[pygit2.Tree],
+        skip_matching: bool = False,
     ):
         self.original_tree = original_tree
         self.original_parent_trees = original_parent_trees
         self.rebased_parent_trees = rebased_parent_trees
+        self.parents_count = len(original_parent_trees)
 
-        self.original_tree_iterator = (
-            original_tree.__iter__() if original_tree else None
-        )
-        self.original_parent_iterators = list(
-            (parent.__iter__() if parent else None) for parent in original_parent_trees
-        )
-        self.rebased_parent_iterators = list(
-            (parent.__iter__() if parent else None) for parent in rebased_parent_trees
-        )
-
-        self.original_tree_item = self.next_tree_item(self.original_tree_iterator)
-        self.original_parent_tree_items = list(
-            self.next_tree_item(parent_tree_iterator)
-            for parent_tree_iterator in self.original_parent_iterators
-        )
-        self.rebased_parent_tree_items = list(
-            self.next_tree_item(parent_tree_iterator)
-            for parent_tree_iterator in self.rebased_parent_iterators
-        )
+        entries = [
+            read_tree_entries(tree) if tree else None
+            for tree in [original_tree, *original_parent_trees, *rebased_parent_trees]
+        ]
+        if skip_matching and all(tree_entries is not None for tree_entries in entries):
+            matching = set(entries[0]).intersection(*entries[1:])
+            if matching:
+                entries = [
+                    [entry for entry in tree_entries if entry not in matching]
+                    for tree_entries in entries
+                ]
+        self.iterators = [
+            tree_entries.__iter__() if tree_entries is not None else None
+            for tree_entries in entries
+        ]
+        self.items = [self.next_tree_item(iterator) for iterator in self.iterators]
+        self.slots: dict[bytes, list[int]] = {}  # key of the entry => slots
+        self.keys: list[bytes] = []  # heap
+        for slot, item in enumerate(self.items):
+            if item is not None:
+                self._add_slot(slot, item)
 
-    def _get_next_path(self) -> typing.Union[str, None]:
-        # Will return None if there are no more paths
-        next_path = None
-        items = list()
-        if self.original_tree_item:
-            items.append(self.original_tree_item)
-        items.extend(item for item in self.original_parent_tree_items if item)
-        items.extend(item for item in self.rebased_parent_tree_items if item)
-        for item in items:
-            if next_path is None:
-                next_path = item.name
-            else:
-                if item.name < next_path:
-                    next_path = item.name
-        return next_path
-
-    def _move_items_forward(self, path: str):
-        if self.original_tree_item and self.original_tree_item.name == path:
-            self.original_tree_item = self.next_tree_item(self.original_tree_iterator)
-        for i in range(len(self.original_parent_tree_items)):
-            item = self.original_parent_tree_items[i]
-            if item and item.name == path:
-                self.original_parent_tree_items[i] = self.next_tree_item(
-                    self.original_parent_iterators[i]
-                )
-            item = self.rebased_parent_tree_items[i]
-            if item and item.name == path:
-                self.rebased_parent_tree_items[i] = self.next_tree_item(
-                    self.rebased_parent_iterators[i]
-                )
+    def _add_slot(self, slot: int, item: TreeEntry):
+        key = _tree_entry_key(item)
+        slots = self.slots.get(key)
+        if slots is None:
+            self.slots[key] = [slot]
+            heapq.heappush(self.keys, key)
+        else:
+            slots.append(slot)
 
     def next_tree_items(
         self,
     ) -> typing.Union[
         tuple[
             str,
-            typing.Union[pygit2.Object, None],
-            list[typing.Union[pygit2.Object, None]],
-            list[typing.Union[pygit2.Object, None]],
+            typing.Union[TreeEntry, None],
+            list[typing.Union[TreeEntry, None]],
+            list[typing.Union[TreeEntry, None]],
         ],
         None,
     ]:
-        next_path = self._get_next_path()
-        if next_path is None:
+        if not self.keys:
             # we are finished
             return None
-        original_tree_item = (
-            self.original_tree_item
-            if self.original_tree_item and self.original_tree_item.name == next_path
-            else None
-        )
-        original_parent_tree_items = list(
-            (parent_item if parent_item and parent_item.name == next_path else None)
-            for parent_item in self.original_parent_tree_items
-        )
-        rebased_parent_tree_items = list(
-            (parent_item if parent_item and parent_item.name == next_path else None)
-            for parent_item in self.rebased_parent_tree_items
-        )
+        slots = self.slots.pop(heapq.heappop(self.keys))
+        next_name = self.items[slots[0]][1]
+        if self.keys and self.keys[0] == next_name + b"/":
+            # a blob and a tree with the same name are taken together if there is nothing in between
+            slots.extend(self.slots.pop(heapq.heappop(self.keys)))
 
-        # get next item for the trees that matched the path
-        self._move_items_forward(next_path)
+        next_items = [None] * len(self.items)
+        for slot in slots:
+            next_items[slot] = self.items[slot]
+            # get next item for the trees that matched the path
+            item = self.items[slot] = next(self.iterators[slot], None)
+            if item is not None:
+                self._add_slot(slot, item)
         return (
-            next_path,
-            original_tree_item,
-            original_parent_tree_items,
-            rebased_parent_tree_items,
+            os.fsdecode(next_name),
+            next_items[0],
+            next_items[1 : 1 + self.parents_count],
+            next_items[1 + self.parents_count :],
         )
 
 
@@ -191,9 +594,10 @@ def easy_merge(
     commit_item: typing.Union[pygit2.Object, None],
     original_item: typing.Union[pygit2.Object, None],
     rebased_item: typing.Union[pygit2.Object, None],
+    items_match: Callable = objects_match,  # operator.eq for TreeEntry items
 ) -> tuple[bool, typing.Union[pygit2.Object, None]]:
 
-    if objects_match(original_item, rebased_item):
+    if items_match(original_item, rebased_item):
         # straight one
         return True, commit_item
 
@@ -213,14 +617,14 @@ def easy_merge(
         # we know that original/rebased parents are not the same
         if original_item is None:
             # rebased parent must set
-            if objects_match(rebased_item, commit_item):
+            if items_match(rebased_item, commit_item):
                 solved, item_to_commit = True, commit_item
             else:
                 # no easy resolution
                 pass
         else:
             # original parent is set
-            if objects_match(commit_item, original_item):
+            if items_match(commit_item, original_item):
                 # we can use the rebased parent item
                 solved, item_to_commit = True, rebased_item
             else:
@@ -229,7 +633,7 @@ def easy_merge(
                     pass
                 else:
                     # rebased parent item is set
-                    if objects_match(rebased_item, commit_item):
+                    if items_match(rebased_item, commit_item):
                         # the change has already been applied on rebased_parent_item
                         solved, item_to_commit = True, rebased_item
                     else:
@@ -239,153 +643,1455 @@ def easy_merge(
     return solved, item_to_commit
 
 
-def merge_blobs_3way(
-    repo: pygit2.Repository,
+def _merge_values_3way(ancestor, ours, theirs) -> tuple[bool, typing.Any]:
+    # used to merge ids or file modes without looking at any content
+    if ours == theirs or theirs == ancestor:
+        return True, ours
+    if ours == ancestor:
+        return True, theirs
+    return False, None
+
+
+def _conflict_index(
     ancestor: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
     ours: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
     theirs: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
-    debug: bool = False,
-) -> typing.Union[
-    tuple[pygit2.Oid, pygit2.enums.FileMode], pygit2.Index, None
-]:  # returning the index means there was a conflict, tuple[Blob, filemode], None means that the file was deleted
-    # deal with the easy ones first
-    if debug:
-        log(
-            f"[merge_blobs_3way] - ancestor: {(ancestor[0], ancestor[1]) if ancestor else '-'}"
+) -> pygit2.Index:
+    # in-memory index that describes a conflict the same way merge_trees would do it
+    index = pygit2.Index()
+    index.add_conflict(
+        *(
+            pygit2.IndexEntry("a", item[0], item[1]) if item else None
+            for item in (ancestor, ours, theirs)
         )
-        log(f"[merge_blobs_3way] - ours: {(ours[0], ours[1]) if ours else '-'}")
-        log(f"[merge_blobs_3way] - theirs: {(theirs[0], theirs[1]) if theirs else '-'}")
-    if ours == theirs:
-        if debug:
-            log(
-                '[merge_blobs_3way] - there is no change between ours/theirs. Taking "ours".'
-            )
-        return ours
-    elif theirs == ancestor:
-        if debug:
-            log(
-                '[merge_blobs_3way] - there is no change between ancestor/theirs. Taking "ours".'
-            )
-        return ours
-    if ours == ancestor:
-        if debug:
-            log(
-                '[merge_blobs_3way] - there is no change between ancestor/ours. Taking "theirs".'
-            )
-        return theirs
+    )
+    return index
 
-    if debug:
-        if ancestor is None or theirs is None:
-            log(
-                "[merge_blobs_3way] - There is a tree conflict because either ancestor or theirs is missing "
-                "and the other item is different from ours"
-            )
-        else:
-            if ancestor[0] == theirs[0]:
-                log(
-                    "[merge_blobs_3way] - There is not difference in content between ancestor/theirs"
-                )
-            else:
-                log(
-                    f"[merge_blobs_3way] - Will apply this content change on OURS: {repo.get(ancestor[0]).diff(repo.get(theirs[0])).data.decode()}"
-                )
-            if ancestor[1] != theirs[1]:
-                log(
-                    f"[merge_blobs_3way] - Will apply the following change in file mode: {ancestor[1]} => {theirs[1]}"
-                )
 
-    # FIXME Ugh... I hate creating trees just for this but I see no support for 3-way merges of blobs in pygit2 so....
+def _merge_blobs_3way_trees(
+    repo: pygit2.Repository,
+    ancestor: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    ours: tuple[pygit2.Oid, pygit2.enums.FileMode],
+    theirs: tuple[pygit2.Oid, pygit2.enums.FileMode],
+    diff_algorithm: DiffAlgorithm,
+) -> pygit2.Index:
+    # Fallback for versions of pygit2 that do not let us reach libgit2 file merges.
+    # It writes 3 scratch trees into the object database.
     tree_builder_p1 = repo.TreeBuilder()
-    if ours:
-        tree_builder_p1.insert("a", ours[0], ours[1])
+    tree_builder_p1.insert("a", ours[0], ours[1])
 
     tree_builder_p2 = repo.TreeBuilder()
-    if theirs:
-        tree_builder_p2.insert("a", theirs[0], theirs[1])
+    tree_builder_p2.insert("a", theirs[0], theirs[1])
 
     tree_builder_a = repo.TreeBuilder()
     if ancestor:
         tree_builder_a.insert("a", ancestor[0], ancestor[1])
 
-    merge_result = repo.merge_trees(
-        tree_builder_a.write(), tree_builder_p1.write(), tree_builder_p2.write()
+    return repo.merge_trees(
+        tree_builder_a.write(),
+        tree_builder_p1.write(),
+        tree_builder_p2.write(),
+        file_flags=DIFF_ALGORITHM_FLAGS[diff_algorithm],
     )
 
-    if merge_result.conflicts:
-        if debug:
-            log("[merge_blobs_3way] - there were conflicts in the 3-way merge")
-        return merge_result
 
-    result_index_item = merge_result["a"]
-    if result_index_item is None:
-        if debug:
-            log("[merge_blobs_3way] - File is deleted as a result")
-        return None
+class BlobMergePolicy(typing.NamedTuple):
+    """
+    Decides what to do with blobs that were changed on both sides
+    before trying to merge them line by line.
+    """
 
-    # TODO Try to get the value of the mode in the resulting blob so that we do not have to deal with it separately
-    if debug:
-        log(
-            f"[merge_blobs_3way] - Got a successful merge. {result_index_item.id}, {result_index_item.mode}"
-        )
-    return result_index_item.id, result_index_item.mode
+    strategy: typing.Union[MergeStrategy, None] = None  # from .gitattributes
+    big_file_threshold: typing.Union[int, None] = BIG_FILE_THRESHOLD
+    streaming_threshold: typing.Union[int, None] = STREAMING_MERGE_THRESHOLD
 
+    def is_streamable(self, size: int) -> bool:
+        return self.streaming_threshold is not None and size > self.streaming_threshold
 
-class CommitMetadata:
-    repo: pygit2.Repository
-    commit: pygit2.Commit
-    _merge_base: typing.Union[
-        pygit2.Commit, None, bool
-    ]  # False if it hasn't been set yet, None if there is no merge base
-    rebased_parents: list[pygit2.Commit]
-    _rebased_merge_base: typing.Union[
-        pygit2.Commit, None, bool
-    ]  # False if it hasn't been set yet, None if there is no merge base
+    def get_blob_strategy(
+        self, repo: pygit2.Repository, blob_id: pygit2.Oid
+    ) -> MergeStrategy:
+        """
+        Strategy for a blob based on its header (type and size). Only blobs that are small
+        enough to be LFS pointers are loaded. Other binary blobs are not detected here:
+        the merges check the content they load anyway and report them as conflicts.
+        """
+        _, size = repo.odb.read_header(blob_id)
+        if self.big_file_threshold is not None and size > self.big_file_threshold:
+            return MergeStrategy.CONFLICT
+        if self.strategy is None and size <= LFS_POINTER_MAX_SIZE:
+            # no attributes, we need to check the content
+            blob = repo.get(blob_id)
+            if blob.data.startswith(LFS_POINTER_HEADER) or blob.is_binary:
+                return MergeStrategy.CONFLICT
+        if self.is_streamable(size):
+            return MergeStrategy.STREAMING
+        return MergeStrategy.TEXT
 
-    def __init__(
+    def get_strategy(
         self,
         repo: pygit2.Repository,
-        commit: pygit2.Commit,
-        rebased_parents: list[pygit2.Commit],
-    ):
-        self.repo = repo
-        self.commit = commit
-        self.rebased_parents = rebased_parents
-        self._rebased_merge_base = False
-        self._merge_base = False
-        assert len(self.commit.parents) == len(rebased_parents)
-
-    def _get_merge_bases(self):
-        if self._merge_base == False:
-            if len(self.rebased_parents) == 0:
-                self._merge_base = None
-                self._rebased_merge_base = None
-            elif len(self.rebased_parents) == 1:
-                self._merge_base = self.commit.parents[0]
-                self._rebased_merge_base = self.rebased_parents[0]
-            else:
-                self._merge_base = self.repo.merge_base_many(
-                    [parent.id for parent in self.commit.parents]
-                )
-                if self._merge_base is not None:
-                    self._merge_base = self.repo.get(self._merge_base)
-                self._rebased_merge_base = self.repo.merge_base_many(
-                    [parent.id for parent in self.rebased_parents]
-                )
-                if self._rebased_merge_base is not None:
-                    self._rebased_merge_base = self.repo.get(self._rebased_merge_base)
+        ancestor: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+        ours: tuple[pygit2.Oid, pygit2.enums.FileMode],
+        theirs: tuple[pygit2.Oid, pygit2.enums.FileMode],
+    ) -> MergeStrategy:
+        if self.strategy not in (None, MergeStrategy.TEXT):
+            return self.strategy
+        strategy = MergeStrategy.TEXT
+        for item in (ancestor, ours, theirs):
+            if item is None:
+                continue
+            blob_strategy = self.get_blob_strategy(repo, item[0])
+            if blob_strategy == MergeStrategy.CONFLICT:
+                return blob_strategy
+            if blob_strategy == MergeStrategy.STREAMING:
+                strategy = blob_strategy
+        return strategy
 
-    @property
-    def merge_base(self) -> typing.Union[pygit2.Commit, None]:
-        self._get_merge_bases()
-        return self._merge_base
 
-    @property
-    def rebased_merge_base(self) -> typing.Union[pygit2.Commit, None]:
-        self._get_merge_bases()
-        return self._rebased_merge_base
+def get_merge_policy(
+    repo: pygit2.Repository,
+    path: str,
+    commit: typing.Union[pygit2.Commit, CommitRecord, None],
+    big_file_threshold: typing.Union[int, None] = BIG_FILE_THRESHOLD,
+    streaming_threshold: typing.Union[int, None] = STREAMING_MERGE_THRESHOLD,
+) -> BlobMergePolicy:
+    """
+    Get the merge policy of a path from the .gitattributes of a commit.
+    """
+    strategy = None
+    if commit is not None:
+        flags = (
+            pygit2.enums.AttrCheck.INDEX_ONLY | pygit2.enums.AttrCheck.INCLUDE_COMMIT
+        )
+        merge = repo.get_attr(path, "merge", flags, commit.id)
+        if merge is False or merge == "binary":
+            # -merge, merge=binary or the binary macro
+            strategy = MergeStrategy.CONFLICT
+        elif merge == "ours":
+            strategy = MergeStrategy.OURS
+        elif merge == "theirs":
+            strategy = MergeStrategy.THEIRS
+        elif merge is None:
+            if (
+                repo.get_attr(path, "diff", flags, commit.id) is False
+                or repo.get_attr(path, "filter", flags, commit.id) == "lfs"
+            ):
+                strategy = MergeStrategy.CONFLICT
+        else:
+            # merge is set or it uses a driver that we do not know about
+            strategy = MergeStrategy.TEXT
+    return BlobMergePolicy(strategy, big_file_threshold, streaming_threshold)
 
 
-def merge_blobs(
+def merge_blob_contents(
+    repo: pygit2.Repository,
+    ancestor: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    ours: tuple[pygit2.Oid, pygit2.enums.FileMode],
+    theirs: tuple[pygit2.Oid, pygit2.enums.FileMode],
+    diff_algorithm: DiffAlgorithm = DiffAlgorithm.MYERS,
+) -> typing.Union[pygit2.Oid, None]:
+    """
+    Merge the content of 3 blobs in memory with libgit2.
+    Only the resulting blob is written into the object database.
+    None is returned if there is a conflict.
+    """
+    c_ancestor, ancestor_path = (
+        pygit2.IndexEntry("a", ancestor[0], ancestor[1])._to_c()
+        if ancestor
+        else (_ffi.NULL, None)
+    )
+    c_ours, ours_path = pygit2.IndexEntry("a", ours[0], ours[1])._to_c()
+    c_theirs, theirs_path = pygit2.IndexEntry("a", theirs[0], theirs[1])._to_c()
+
+    c_options = _ffi.new("git_merge_file_options *")
+    c_options.version = 1
+    c_options.flags = int(DIFF_ALGORITHM_FLAGS[diff_algorithm])
+
+    c_result = _ffi.new("git_merge_file_result *")
+    error = _C.git_merge_file_from_index(
+        c_result, repo._repo, c_ancestor, c_ours, c_theirs, c_options
+    )
+    if error:
+        raise pygit2.GitError(f"Could not merge blobs {ours[0]} and {theirs[0]}")
+    try:
+        if not c_result.automergeable:
+            return None
+        return repo.create_blob(_ffi.buffer(c_result.ptr, c_result.len)[:])
+    finally:
+        _C.git_merge_file_result_free(c_result)
+
+
+class _ChunksReader(io.RawIOBase):
+    """
+    File-like object on top of an iterator of chunks of bytes
+    so that they can be streamed into the object database.
+    """
+
+    def __init__(self, chunks: typing.Iterator[bytes]):
+        self._chunks = chunks
+        self._pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class _LinesCursor:
+    """
+    Walks forward over the lines of a buffer without splitting it.
+    Only one chunk of the buffer is copied at a time to look for line breaks.
+    """
+
+    def __init__(self, buffer: memoryview, chunk_size: int):
+        self.buffer = buffer
+        self.chunk_size = chunk_size
+        self.line = 0
+        self.offset = 0
+
+    def _move_to(self, line: int) -> int:
+        # move to the beginning of the line (0-based) and return its offset
+        while self.line < line and self.offset < len(self.buffer):
+            chunk = bytes(self.buffer[self.offset : self.offset + self.chunk_size])
+            breaks = chunk.count(b"\n")
+            if self.line + breaks < line:
+                self.line += breaks
+                self.offset += len(chunk)
+                continue
+            position = -1
+            for _ in range(line - self.line):
+                position = chunk.find(b"\n", position + 1)
+            self.offset += position + 1
+            self.line = line
+        self.line = line
+        return self.offset
+
+    def copy_to(self, line: typing.Union[int, None]) -> typing.Iterator[memoryview]:
+        # provide the content from the current line up to the beginning of the line
+        start = self.offset
+        end = len(self.buffer) if line is None else self._move_to(line)
+        for offset in range(start, end, self.chunk_size):
+            yield self.buffer[offset : min(offset + self.chunk_size, end)]
+
+    def skip_to(self, line: int):
+        self._move_to(line)
+
+
+def _get_line_end(buffer: memoryview, offset: int) -> int:
+    # offset of the beginning of the line after the one where offset is
+    position = offset
+    while position < len(buffer):
+        chunk = bytes(buffer[position : position + STREAMING_CHUNK_SIZE])
+        line_break = chunk.find(b"\n")
+        if line_break != -1:
+            return position + line_break + 1
+        position += len(chunk)
+    return len(buffer)
+
+
+def _get_line_offsets(content: bytes) -> list[int]:
+    # offset where each line starts (and where the content ends)
+    offsets = [0]
+    position = content.find(b"\n")
+    while position != -1:
+        offsets.append(position + 1)
+        position = content.find(b"\n", position + 1)
+    if offsets[-1] != len(content):
+        offsets.append(len(content))
+    return offsets
+
+
+def _get_edits(
+    old: memoryview,
+    new: memoryview,
+    diff_algorithm: DiffAlgorithm,
+    side: int,
+    chunk_size: int = STREAMING_CHUNK_SIZE,
+) -> list[tuple[int, int, list[bytes], int]]:
+    """
+    (first line, line after the last line, new lines, side) of each change to go from old
+    to new, lines are 0-based.
+
+    The content that both have in common is skipped a chunk at a time. When they differ,
+    windows of both (starting at the same line) are diffed and the changes are taken up to
+    the last lines that both windows have in common. Windows get bigger if there are none,
+    so only the changes (and a window around them) are held in memory, besides the content.
+    """
+    edits = []
+    old_offset, new_offset, old_line = 0, 0, 0  # always at the beginning of a line
+    window_size = chunk_size
+    while old_offset < len(old) or new_offset < len(new):
+        old_chunk = bytes(old[old_offset : old_offset + chunk_size])
+        if old_chunk and old_chunk == bytes(new[new_offset : new_offset + chunk_size]):
+            # nothing changed, move to the last line that starts in the chunk
+            line_break = old_chunk.rfind(b"\n")
+            if line_break != -1:
+                old_offset += line_break + 1
+                new_offset += line_break + 1
+                old_line += old_chunk.count(b"\n")
+                continue
+
+        old_window = bytes(
+            old[old_offset : _get_line_end(old, old_offset + window_size - 1)]
+        )
+        new_window = bytes(
+            new[new_offset : _get_line_end(new, new_offset + window_size - 1)]
+        )
+        old_offsets = _get_line_offsets(old_window)
+        new_offsets = _get_line_offsets(new_window)
+        at_the_end = old_offset + len(old_window) == len(old) and new_offset + len(
+            new_window
+        ) == len(new)
+        patch = pygit2.Patch.create_from(
+            old_window,
+            new_window,
+            flag=pygit2.enums.DiffOption.FORCE_TEXT
+            | DIFF_ALGORITHM_OPTIONS[diff_algorithm],
+            context_lines=0,
+        )
+        # (old start, old end, new start, new end, new lines) of each hunk, relative to the windows
+        hunks = []
+        for hunk in patch.hunks:
+            # pure additions point to the line _after_ which the lines are added
+            old_start = hunk.old_start if hunk.old_lines == 0 else hunk.old_start - 1
+            new_start = hunk.new_start if hunk.new_lines == 0 else hunk.new_start - 1
+            hunks.append(
+                (
+                    old_start,
+                    old_start + hunk.old_lines,
+                    new_start,
+                    new_start + hunk.new_lines,
+                    [line.raw_content for line in hunk.lines if line.origin == "+"],
+                )
+            )
+        # the end of the windows could be in the middle of a change so changes are only
+        # taken up to the last lines that both windows have in common
+        old_lines, new_lines = len(old_offsets) - 1, len(new_offsets) - 1
+        sync = None  # (old line, new line) where the following diff starts
+        if at_the_end:
+            sync = (old_lines, new_lines)
+        elif not hunks:
+            sync = (old_lines, new_lines)
+        else:
+            for index in range(len(hunks) - 1, -1, -1):
+                _, old_end, _, new_end, _ = hunks[index]
+                if old_end < old_lines and new_end < new_lines:
+                    # the lines after the hunk are the same on both windows
+                    following = hunks[index + 1] if index + 1 < len(hunks) else None
+                    sync = (
+                        (following[0], following[2])
+                        if following
+                        else (old_lines, new_lines)
+                    )
+                    hunks = hunks[: index + 1]
+                    break
+            else:
+                if hunks[0][0] > 0 and hunks[0][2] > 0:
+                    # at least, the lines before the first change are the same
+                    sync = (hunks[0][0], hunks[0][2])
+                hunks = []
+        if sync is None:
+            # the change does not fit in the windows
+            window_size *= 2
+            continue
+        window_size = chunk_size
+        for old_start, old_end, _, _, lines in hunks:
+            edits.append((old_line + old_start, old_line + old_end, lines, side))
+        old_offset += old_offsets[sync[0]]
+        new_offset += new_offsets[sync[1]]
+        old_line += sync[0]
+    return edits
+
+
+def _merge_edits(edits: list[tuple]) -> typing.Union[list[tuple], None]:
+    """
+    Put together the edits (first line, line after the last line, new content, side)
+    done by both sides on the ancestor. Edits from both sides that overlap or touch
+    each other are a conflict (None is returned) unless they are the same change.
+    """
+    edits = sorted(edits, key=lambda edit: (edit[0], edit[1]))
+    merged_edits = []
+    end = -1  # last line touched by an edit so far
+    for edit in edits:
+        if merged_edits and edit[0] <= end and edit[3] != merged_edits[-1][3]:
+            if edit[:3] == merged_edits[-1][:3]:
+                # the same change was applied on both sides
+                continue
+            return None
+        merged_edits.append(edit)
+        end = max(end, edit[1])
+    return merged_edits
+
+
+def merge_blob_contents_streaming(
+    repo: pygit2.Repository,
+    ancestor: tuple[pygit2.Oid, pygit2.enums.FileMode],
+    ours: tuple[pygit2.Oid, pygit2.enums.FileMode],
+    theirs: tuple[pygit2.Oid, pygit2.enums.FileMode],
+    diff_algorithm: DiffAlgorithm = DiffAlgorithm.MYERS,
+    chunk_size: int = STREAMING_CHUNK_SIZE,
+) -> typing.Union[pygit2.Oid, None]:
+    """
+    Merge the content of 3 big blobs keeping memory usage in check.
+    The content of the blobs is read in place (ours and theirs, one at a time) and, besides
+    it, only the changed lines (and the windows that are diffed around them, see _get_edits)
+    are kept in memory. The result is streamed into the object database.
+    None is returned if there is a conflict (or if one of the blobs is binary).
+
+    Changes from both sides that overlap or touch each other are considered
+    a conflict unless they are the same change.
+    """
+    ancestor_blob = repo.get(ancestor[0])
+    if ancestor_blob.is_binary:
+        return None
+    ancestor_buffer = memoryview(ancestor_blob)
+    edits = []
+    for side, item in enumerate((ours, theirs)):
+        # one side at a time, its content is not needed once it is diffed
+        blob = repo.get(item[0])
+        if blob.is_binary:
+            return None
+        edits.extend(
+            _get_edits(
+                ancestor_buffer, memoryview(blob), diff_algorithm, side, chunk_size
+            )
+        )
+        del blob
+    merged_edits = _merge_edits(edits)
+    if merged_edits is None:
+        return None
+
+    def chunks() -> typing.Iterator[typing.Union[bytes, memoryview]]:
+        cursor = _LinesCursor(ancestor_buffer, chunk_size)
+        for start, end, lines, _ in merged_edits:
+            yield from cursor.copy_to(start)
+            yield from lines
+            cursor.skip_to(end)
+        yield from cursor.copy_to(None)
+
+    return repo.create_blob_fromiobase(_ChunksReader(chunks()))
+
+
+def _import_numpy():
+    global numpy, _numpy_imported
+    if _numpy_imported:
+        return
+    _numpy_imported = True
+    try:
+        import numpy as module
+    except ImportError:
+        return
+    numpy = module
+
+
+_LINE_BREAK_PATTERN = re.compile(b"\n")
+
+# with numpy, lines get polynomial hashes (mod 2**64) that are calculated over chunks of
+# the content, in place, without creating an object for each line
+LINE_HASH_CHUNK_SIZE = 64 * 1024
+_LINE_HASH_BASE = 0x100000001B3  # odd so that it has an inverse
+_line_hash_powers = None
+
+
+def _get_line_hash_powers() -> tuple:
+    # powers of the base and of its inverse for the positions of a chunk
+    # and for the size of a chunk
+    global _line_hash_powers
+    if _line_hash_powers is None:
+        inverse = pow(_LINE_HASH_BASE, -1, 1 << 64)
+        powers = []
+        for base in (_LINE_HASH_BASE, inverse):
+            chunk_powers = numpy.ones(LINE_HASH_CHUNK_SIZE, dtype=numpy.uint64)
+            chunk_powers[1:] = numpy.cumprod(
+                numpy.full(LINE_HASH_CHUNK_SIZE - 1, base, dtype=numpy.uint64)
+            )
+            powers.append(chunk_powers)
+            powers.append(pow(base, LINE_HASH_CHUNK_SIZE, 1 << 64))
+        _line_hash_powers = tuple(powers)
+    return _line_hash_powers
+
+
+def _hash_lines(buffer: memoryview, offsets) -> "numpy.ndarray":
+    """
+    Hashes of the lines of a buffer, given the offsets where they start (and its size).
+    The hash of the content up to each offset is calculated one chunk at a time,
+    the hash of a line comes from the hashes at its start and at its end.
+    """
+    powers, chunk_power, inverse_powers, chunk_inverse = _get_line_hash_powers()
+    mask = (1 << 64) - 1
+    data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    prefixes = numpy.zeros(len(offsets), dtype=numpy.uint64)
+    inverses = numpy.zeros(len(offsets), dtype=numpy.uint64)
+    prefix = 0
+    power = 1
+    inverse = 1
+    for chunk_start in range(0, len(data) + 1, LINE_HASH_CHUNK_SIZE):
+        chunk = data[chunk_start : chunk_start + LINE_HASH_CHUNK_SIZE]
+        sums = numpy.zeros(len(chunk) + 1, dtype=numpy.uint64)
+        # bytes go from 1 to 256 so that NUL bytes count
+        numpy.cumsum((chunk + numpy.uint64(1)) * powers[: len(chunk)], out=sums[1:])
+        first, last = numpy.searchsorted(
+            offsets, (chunk_start, chunk_start + LINE_HASH_CHUNK_SIZE)
+        )
+        positions = offsets[first:last] - chunk_start
+        prefixes[first:last] = sums[positions] * numpy.uint64(power) + numpy.uint64(
+            prefix
+        )
+        inverses[first:last] = inverse_powers[positions] * numpy.uint64(inverse)
+        prefix = (prefix + int(sums[-1]) * power) & mask
+        power = power * chunk_power & mask
+        inverse = inverse * chunk_inverse & mask
+    hashes = (prefixes[1:] - prefixes[:-1]) * inverses[:-1]
+    # lines with a different length are different
+    return (hashes ^ numpy.diff(offsets).astype(numpy.uint64)).view(numpy.int64)
+
+
+class LineTokens:
+    """
+    Lines of a blob: the offset where each line starts and a hash for each line.
+    Lines are read in place from the blob, the content is not copied.
+    """
+
+    __slots__ = ("blob", "buffer", "offsets", "hashes", "binary")
+
+    def __init__(self, blob: typing.Union[pygit2.Blob, bytes]):
+        _import_numpy()
+        self.blob = blob  # keep the content alive
+        self.buffer = memoryview(blob)
+        # same check as libgit2 (and git) on the content that is already loaded
+        self.binary = (
+            blob.is_binary if isinstance(blob, pygit2.Blob) else b"\0" in blob[:8000]
+        )
+        size = len(self.buffer)
+        # line breaks are found and lines are hashed in place by C code (numpy or re, map)
+        # instead of going over the lines one by one in python
+        if numpy is not None:
+            offsets = numpy.flatnonzero(
+                numpy.frombuffer(self.buffer, dtype=numpy.uint8) == 10
+            )
+            offsets = numpy.concatenate(([0], offsets + 1))
+            if offsets[-1] != size:
+                # last line does not have a line break
+                offsets = numpy.append(offsets, size)
+            self.hashes = _hash_lines(self.buffer, offsets)
+            self.offsets = offsets.tolist()
+            return
+        self.offsets = [0] + list(
+            map(operator.methodcaller("end"), _LINE_BREAK_PATTERN.finditer(self.buffer))
+        )
+        if self.offsets[-1] != size:
+            # last line does not have a line break
+            self.offsets.append(size)
+        # hashing a slice of a read-only memoryview does not copy the content
+        self.hashes = list(
+            map(
+                hash,
+                map(
+                    self.buffer.__getitem__,
+                    map(slice, self.offsets, self.offsets[1:]),
+                ),
+            )
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def content(self, start: int, end: int) -> memoryview:
+        # content of the lines [start, end)
+        return self.buffer[self.offsets[start] : self.offsets[end]]
+
+
+class Diff3Merger:
+    """
+    diff3 written in python. Blobs are split into lines once and the result is kept in
+    a cache so that the following merges that involve the same blobs (very common when the
+    same file is modified along a series of commits) can use them straight away.
+    Lines that are the same at the beginning and at the end of the blobs are trimmed
+    (in bulk, with numpy, if it is available) before diffing what is left in the middle.
+    """
+
+    def __init__(self, tokens_cache_size: int = 256):
+        self.tokens_cache = LRUCache(tokens_cache_size)
+        self.empty_tokens = LineTokens(b"")
+
+    def get_tokens(self, repo: pygit2.Repository, blob_id: pygit2.Oid) -> LineTokens:
+        found, tokens = self.tokens_cache.get(blob_id)
+        if not found:
+            tokens = LineTokens(repo.get(blob_id))
+            self.tokens_cache.put(blob_id, tokens)
+        return tokens
+
+    @staticmethod
+    def _common_prefix(old_hashes, new_hashes) -> int:
+        size = min(len(old_hashes), len(new_hashes))
+        if numpy is not None:
+            matches = old_hashes[:size] == new_hashes[:size]
+            return size if matches.all() else int(numpy.argmin(matches))
+        prefix = 0
+        while prefix < size and old_hashes[prefix] == new_hashes[prefix]:
+            prefix += 1
+        return prefix
+
+    def diff(
+        self, old: LineTokens, new: LineTokens, side: int
+    ) -> list[tuple[int, int, memoryview, int]]:
+        import difflib
+
+        prefix = self._common_prefix(old.hashes, new.hashes)
+        if old.content(0, prefix) != new.content(0, prefix):
+            prefix = 0  # collision of hashes, can't trust them
+        suffix = self._common_prefix(old.hashes[::-1], new.hashes[::-1])
+        suffix = min(suffix, len(old) - prefix, len(new) - prefix)
+        if old.content(len(old) - suffix, len(old)) != new.content(
+            len(new) - suffix, len(new)
+        ):
+            suffix = 0
+
+        # lines in the middle are compared by their hashes...
+        old_lines = old.hashes[prefix : len(old) - suffix]
+        new_lines = new.hashes[prefix : len(new) - suffix]
+        if numpy is not None:
+            old_lines = old_lines.tolist()
+            new_lines = new_lines.tolist()
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+        # ... and the lines that match are checked by content
+        if not all(
+            old.content(prefix + old_start, prefix + old_start + size)
+            == new.content(prefix + new_start, prefix + new_start + size)
+            for old_start, new_start, size in matcher.get_matching_blocks()
+        ):
+            # collision of hashes, lines are compared by content
+            tokens = {}
+            old_lines = [
+                tokens.setdefault(old.content(line, line + 1), len(tokens))
+                for line in range(prefix, len(old) - suffix)
+            ]
+            new_lines = [
+                tokens.setdefault(new.content(line, line + 1), len(tokens))
+                for line in range(prefix, len(new) - suffix)
+            ]
+            matcher = difflib.SequenceMatcher(
+                None, old_lines, new_lines, autojunk=False
+            )
+        return [
+            (
+                prefix + old_start,
+                prefix + old_end,
+                new.content(prefix + new_start, prefix + new_end),
+                side,
+            )
+            for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes()
+            if tag != "equal"
+        ]
+
+    def merge(
+        self,
+        repo: pygit2.Repository,
+        ancestor: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+        ours: tuple[pygit2.Oid, pygit2.enums.FileMode],
+        theirs: tuple[pygit2.Oid, pygit2.enums.FileMode],
+    ) -> typing.Union[pygit2.Oid, None]:
+        """
+        Merge the content of 3 blobs. None is returned if there is a conflict
+        (or if one of the blobs is binary).
+        """
+        ancestor_tokens = (
+            self.get_tokens(repo, ancestor[0]) if ancestor else self.empty_tokens
+        )
+        ours_tokens = self.get_tokens(repo, ours[0])
+        theirs_tokens = self.get_tokens(repo, theirs[0])
+        if ancestor_tokens.binary or ours_tokens.binary or theirs_tokens.binary:
+            return None
+        edits = self.diff(ancestor_tokens, ours_tokens, 0)
+        edits.extend(self.diff(ancestor_tokens, theirs_tokens, 1))
+        edits = _merge_edits(edits)
+        if edits is None:
+            return None
+        content = []
+        line = 0
+        for start, end, new_content, _ in edits:
+            content.append(ancestor_tokens.content(line, start))
+            content.append(new_content)
+            line = end
+        content.append(ancestor_tokens.content(line, len(ancestor_tokens)))
+        return repo.create_blob(b"".join(content))
+
+
+def merge_blobs_3way(
+    repo: pygit2.Repository,
+    ancestor: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    ours: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    theirs: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    debug: bool = False,
+    diff_algorithm: DiffAlgorithm = DiffAlgorithm.MYERS,
+    cache: typing.Union[LRUCache, None] = None,
+    merge_policy: BlobMergePolicy = BlobMergePolicy(),
+    diff3_merger: typing.Union[Diff3Merger, None] = None,
+) -> typing.Union[
+    tuple[pygit2.Oid, pygit2.enums.FileMode], pygit2.Index, None
+]:  # returning the index means there was a conflict, tuple[Blob, filemode], None means that the file was deleted
+    if cache is None:
+        return _merge_blobs_3way(
+            repo,
+            ancestor,
+            ours,
+            theirs,
+            debug,
+            diff_algorithm,
+            merge_policy,
+            diff3_merger,
+        )
+
+    key = (
+        ancestor,
+        ours,
+        theirs,
+        diff_algorithm,
+        merge_policy,
+        diff3_merger is not None,
+    )
+    found, result = cache.get(key)
+    if found:
+        if debug:
+            log(f"[merge_blobs_3way] - Using cached result: {result}")
+        if result is False:
+            return _conflict_index(ancestor, ours, theirs)
+        return result
+
+    result = _merge_blobs_3way(
+        repo,
+        ancestor,
+        ours,
+        theirs,
+        debug,
+        diff_algorithm,
+        merge_policy,
+        diff3_merger,
+    )
+    # conflicts are saved as False so that we do not hold on to the index
+    cache.put(key, False if isinstance(result, pygit2.Index) else result)
+    return result
+
+
+def _merge_blobs_3way(
+    repo: pygit2.Repository,
+    ancestor: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    ours: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    theirs: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    debug: bool,
+    diff_algorithm: DiffAlgorithm,
+    merge_policy: BlobMergePolicy,
+    diff3_merger: typing.Union[Diff3Merger, None],
+) -> typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], pygit2.Index, None]:
+    # deal with the easy ones first
+    if debug:
+        log(
+            f"[merge_blobs_3way] - ancestor: {(ancestor[0], ancestor[1]) if ancestor else '-'}"
+        )
+        log(f"[merge_blobs_3way] - ours: {(ours[0], ours[1]) if ours else '-'}")
+        log(f"[merge_blobs_3way] - theirs: {(theirs[0], theirs[1]) if theirs else '-'}")
+    if ours == theirs:
+        if debug:
+            log(
+                '[merge_blobs_3way] - there is no change between ours/theirs. Taking "ours".'
+            )
+        return ours
+    elif theirs == ancestor:
+        if debug:
+            log(
+                '[merge_blobs_3way] - there is no change between ancestor/theirs. Taking "ours".'
+            )
+        return ours
+    if ours == ancestor:
+        if debug:
+            log(
+                '[merge_blobs_3way] - there is no change between ancestor/ours. Taking "theirs".'
+            )
+        return theirs
+
+    if debug:
+        if ancestor is None or theirs is None:
+            log(
+                "[merge_blobs_3way] - There is a tree conflict because either ancestor or theirs is missing "
+                "and the other item is different from ours"
+            )
+        else:
+            if ancestor[0] == theirs[0]:
+                log(
+                    "[merge_blobs_3way] - There is not difference in content between ancestor/theirs"
+                )
+            elif merge_policy.is_streamable(
+                max(repo.odb.read_header(item[0])[1] for item in (ancestor, theirs))
+            ):
+                log(
+                    "[merge_blobs_3way] - Content changes between ancestor/theirs are too big to show"
+                )
+            else:
+                log(
+                    f"[merge_blobs_3way] - Will apply this content change on OURS: {repo.get(ancestor[0]).diff(repo.get(theirs[0])).data.decode()}"
+                )
+            if ancestor[1] != theirs[1]:
+                log(
+                    f"[merge_blobs_3way] - Will apply the following change in file mode: {ancestor[1]} => {theirs[1]}"
+                )
+
+    if ours is None or theirs is None:
+        # one side deleted the file while the other one modified it (or brought it back)
+        if debug:
+            log("[merge_blobs_3way] - there is a tree conflict (modified/deleted)")
+        return _conflict_index(ancestor, ours, theirs)
+
+    ancestor_id, ancestor_mode = ancestor if ancestor else (None, None)
+
+    # content and file mode can be resolved separately when their ids allow it
+    mode_solved, mode = _merge_values_3way(ancestor_mode, ours[1], theirs[1])
+    if not mode_solved:
+        if debug:
+            log("[merge_blobs_3way] - there is a conflict in the file mode")
+        return _conflict_index(ancestor, ours, theirs)
+    content_solved, content_id = _merge_values_3way(ancestor_id, ours[0], theirs[0])
+    if content_solved:
+        if debug:
+            log(
+                f"[merge_blobs_3way] - Content ids agree. Only the file mode had to be merged. {content_id}, {mode}"
+            )
+        return content_id, mode
+
+    if not all(
+        item[1] in (pygit2.enums.FileMode.BLOB, pygit2.enums.FileMode.BLOB_EXECUTABLE)
+        for item in (ancestor, ours, theirs)
+        if item
+    ):
+        # symlinks/submodules can't be merged line by line
+        if debug:
+            log(
+                "[merge_blobs_3way] - there is a content conflict on a non-regular file"
+            )
+        return _conflict_index(ancestor, ours, theirs)
+
+    strategy = merge_policy.get_strategy(repo, ancestor, ours, theirs)
+    if strategy == MergeStrategy.OURS:
+        if debug:
+            log('[merge_blobs_3way] - Merge policy says to take "ours".')
+        return ours[0], mode
+    if strategy == MergeStrategy.THEIRS:
+        if debug:
+            log('[merge_blobs_3way] - Merge policy says to take "theirs".')
+        return theirs[0], mode
+    if strategy == MergeStrategy.CONFLICT:
+        if debug:
+            log(
+                "[merge_blobs_3way] - Merge policy says the content can't be merged (binary, LFS or too big)"
+            )
+        return _conflict_index(ancestor, ours, theirs)
+
+    if strategy == MergeStrategy.STREAMING and ancestor is not None:
+        if debug:
+            log("[merge_blobs_3way] - Merging big blobs in chunks")
+        content_id = merge_blob_contents_streaming(
+            repo, ancestor, ours, theirs, diff_algorithm
+        )
+        if content_id is None:
+            if debug:
+                log("[merge_blobs_3way] - there were conflicts in the 3-way merge")
+            return _conflict_index(ancestor, ours, theirs)
+    elif diff3_merger is not None:
+        content_id = diff3_merger.merge(repo, ancestor, ours, theirs)
+        if content_id is None:
+            if debug:
+                log("[merge_blobs_3way] - there were conflicts in the 3-way merge")
+            return _conflict_index(ancestor, ours, theirs)
+    elif _C is None:
+        merge_result = _merge_blobs_3way_trees(
+            repo, ancestor, ours, theirs, diff_algorithm
+        )
+        if merge_result.conflicts:
+            if debug:
+                log("[merge_blobs_3way] - there were conflicts in the 3-way merge")
+            return merge_result
+        result_index_item = merge_result["a"]
+        content_id = result_index_item.id
+    else:
+        content_id = merge_blob_contents(repo, ancestor, ours, theirs, diff_algorithm)
+        if content_id is None:
+            if debug:
+                log("[merge_blobs_3way] - there were conflicts in the 3-way merge")
+            return _conflict_index(ancestor, ours, theirs)
+
+    if debug:
+        log(f"[merge_blobs_3way] - Got a successful merge. {content_id}, {mode}")
+    return content_id, mode
+
+
+class TreePathIndex:
+    """
+    Resolves paths in a tree. Subtrees are kept as they are resolved so that looking up
+    paths that share directories does not start from the root every time.
+    """
+
+    __slots__ = ("subtrees",)
+
+    def __init__(self, tree: pygit2.Tree):
+        self.subtrees: dict[str, typing.Union[pygit2.Tree, None]] = {"": tree}
+
+    def get_tree(self, path: str) -> typing.Union[pygit2.Tree, None]:
+        try:
+            return self.subtrees[path]
+        except KeyError:
+            pass
+        directory, _, name = path.rpartition("/")
+        tree = self.get(directory, name)
+        self.subtrees[path] = tree if isinstance(tree, pygit2.Tree) else None
+        return self.subtrees[path]
+
+    def get(self, directory: str, name: str) -> typing.Union[pygit2.Object, None]:
+        tree = self.get_tree(directory)
+        if tree is None:
+            return None
+        try:
+            return tree[name]
+        except KeyError:
+            return None
+
+    def __getitem__(self, path: str) -> typing.Union[pygit2.Object, None]:
+        # None if the path does not exist
+        directory, _, name = path.rpartition("/")
+        return self.get(directory, name)
+
+
+COMMIT_GRAPH_NO_PARENT = 0x70000000
+COMMIT_GRAPH_EXTRA_EDGES = 0x80000000
+
+
+class CommitGraph:
+    """
+    Read-only view of the commit-graph file of a repository (as written by
+    git commit-graph write) to get the parents, commit times and generation numbers
+    of commits without reading them from the object database.
+
+    Split commit-graphs (commit-graph chains) are not supported.
+    """
+
+    def __init__(self, path: str):
+        import mmap
+        import struct
+
+        with open(path, "rb") as graph_file:
+            self._data = mmap.mmap(graph_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._unpack_position = struct.Struct(">I").unpack_from
+        self._unpack_commit = struct.Struct(">IIQ").unpack_from
+        signature, version, hash_version, chunks_count, base_graphs = (
+            struct.unpack_from(">4sBBBB", self._data)
+        )
+        if signature != b"CGPH" or version != 1 or hash_version != 1 or base_graphs:
+            raise ValueError(f"Unsupported commit-graph file {path}")
+        chunks = {}
+        for chunk in range(chunks_count):
+            chunk_id, offset = struct.unpack_from(">4sQ", self._data, 8 + 12 * chunk)
+            chunks[chunk_id] = offset
+        try:
+            self._fanout = chunks[b"OIDF"]
+            self._lookup = chunks[b"OIDL"]
+            self._commit_data = chunks[b"CDAT"]
+        except KeyError:
+            raise ValueError(f"Missing chunks in commit-graph file {path}")
+        self._extra_edges = chunks.get(b"EDGE")
+        self.commits_count = self._get_fanout(255)
+
+    @classmethod
+    def open(cls, repo: pygit2.Repository) -> typing.Union["CommitGraph", None]:
+        # None if the repository has no (usable) commit-graph
+        import struct
+
+        path = repo.path
+        commondir_path = os.path.join(path, "commondir")  # worktrees
+        if os.path.isfile(commondir_path):
+            with open(commondir_path) as commondir_file:
+                path = os.path.join(path, commondir_file.read().strip())
+        try:
+            return cls(os.path.join(path, "objects", "info", "commit-graph"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            log(f"Could not read the commit-graph: {e}")
+            return None
+
+    def _get_fanout(self, byte: int) -> int:
+        return self._unpack_position(self._data, self._fanout + 4 * byte)[0]
+
+    def _get_id(self, position: int) -> pygit2.Oid:
+        offset = self._lookup + 20 * position
+        return pygit2.Oid(raw=self._data[offset : offset + 20])
+
+    def _get_position(self, commit_id: pygit2.Oid) -> typing.Union[int, None]:
+        raw = commit_id.raw
+        low = self._get_fanout(raw[0] - 1) if raw[0] else 0
+        high = self._get_fanout(raw[0])
+        while low < high:
+            middle = (low + high) // 2
+            offset = self._lookup + 20 * middle
+            current = self._data[offset : offset + 20]
+            if current < raw:
+                low = middle + 1
+            elif current > raw:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def get(
+        self, commit_id: pygit2.Oid
+    ) -> typing.Union[tuple[int, int, list[pygit2.Oid]], None]:
+        """
+        Generation number, commit time and parents of a commit. None if it is not in the graph.
+        """
+        position = self._get_position(commit_id)
+        if position is None:
+            return None
+        parent1, parent2, generation_time = self._unpack_commit(
+            self._data, self._commit_data + 36 * position + 20
+        )
+        parent_ids = []
+        if parent1 != COMMIT_GRAPH_NO_PARENT:
+            parent_ids.append(self._get_id(parent1))
+        if parent2 & COMMIT_GRAPH_EXTRA_EDGES:
+            # octopus merge, the other parents are in the list of extra edges
+            edge = parent2 & ~COMMIT_GRAPH_EXTRA_EDGES
+            while True:
+                (parent,) = self._unpack_position(
+                    self._data, self._extra_edges + 4 * edge
+                )
+                parent_ids.append(self._get_id(parent & ~COMMIT_GRAPH_EXTRA_EDGES))
+                if parent & COMMIT_GRAPH_EXTRA_EDGES:
+                    break
+                edge += 1
+        elif parent2 != COMMIT_GRAPH_NO_PARENT:
+            parent_ids.append(self._get_id(parent2))
+        # 30 bits for the generation number, 34 bits for the commit time
+        return generation_time >> 34, generation_time & ((1 << 34) - 1), parent_ids
+
+
+_PARENT1 = 1
+_PARENT2 = 2
+_STALE = 4
+_RESULT = 8
+
+
+class MergeBases:
+    """
+    Merge bases of sets of commits, cached for the whole rebase (keyed by the sorted ids).
+
+    The merge base of two commits is calculated by painting down from both of them (like git
+    does), visiting the commits in order of generation number so that the walk stops early.
+    Generation numbers come from the commit-graph of the repository when there is one.
+    Otherwise, the commits being rebased (and the rebased commits) get them as they are
+    rebased (see add_commit) and the other commits are visited by commit time.
+
+    Octopus merges and criss-cross merges (more than one merge base) are left to libgit2.
+    """
+
+    def __init__(self, commit_graph: typing.Union[CommitGraph, None] = None):
+        self.commit_graph = commit_graph
+        self.hits = 0
+        self.misses = 0
+        self._merge_bases: dict[
+            tuple[pygit2.Oid, ...], typing.Union[pygit2.Oid, None]
+        ] = {}
+        # commit id => generation number (0 if it is not known), commit time, parents
+        self._commits: dict[pygit2.Oid, tuple[int, int, list[pygit2.Oid]]] = {}
+        self._lock = threading.Lock()  # commits can be rebased in parallel
+
+    def __len__(self):
+        return len(self._merge_bases)
+
+    def clear(self):
+        # hits and misses are kept
+        with self._lock:
+            self._merge_bases.clear()
+            self._commits.clear()
+
+    def retain(self, keep: Callable[[pygit2.Oid], bool]):
+        """
+        Drop the merge bases and the commits that involve commits for which keep() is false.
+        """
+        with self._lock:
+            self._merge_bases = {
+                key: merge_base
+                for key, merge_base in self._merge_bases.items()
+                if all(map(keep, key)) and (merge_base is None or keep(merge_base))
+            }
+            self._commits = {
+                commit_id: info
+                for commit_id, info in self._commits.items()
+                if keep(commit_id)
+            }
+
+    def add_commit(
+        self,
+        repo: pygit2.Repository,
+        commit_id: pygit2.Oid,
+        commit_time: int,
+        parent_ids: list[pygit2.Oid],
+    ):
+        """
+        Set the generation number of a commit based on the generation numbers of its parents.
+        """
+        with self._lock:
+            if commit_id in self._commits:
+                return
+            generation = max(
+                (self._get_commit(repo, parent_id)[0] for parent_id in parent_ids),
+                default=0,
+            )
+            self._commits[commit_id] = (generation + 1, commit_time, parent_ids)
+
+    def _get_commit(
+        self, repo: pygit2.Repository, commit_id: pygit2.Oid
+    ) -> tuple[int, int, list[pygit2.Oid]]:
+        info = self._commits.get(commit_id)
+        if info is not None:
+            return info
+        if self.commit_graph is None:
+            commit = repo.get(commit_id)
+            info = self._commits[commit_id] = (0, commit.commit_time, commit.parent_ids)
+            return info
+        # commits that are not in the graph (newer than the graph) get their generation
+        # numbers from their parents
+        pending = [commit_id]
+        while pending:
+            current_id = pending[-1]
+            if current_id in self._commits:
+                pending.pop()
+                continue
+            info = self.commit_graph.get(current_id)
+            if info is not None:
+                self._commits[current_id] = info
+                pending.pop()
+                continue
+            commit = repo.get(current_id)
+            missing_ids = [
+                parent_id
+                for parent_id in commit.parent_ids
+                if parent_id not in self._commits
+            ]
+            if missing_ids:
+                pending.extend(missing_ids)
+                continue
+            generation = max(
+                (self._commits[parent_id][0] for parent_id in commit.parent_ids),
+                default=0,
+            )
+            self._commits[current_id] = (
+                generation + 1,
+                commit.commit_time,
+                commit.parent_ids,
+            )
+            pending.pop()
+        return self._commits[commit_id]
+
+    def _paint_down_to_common(
+        self, repo: pygit2.Repository, one: pygit2.Oid, two: pygit2.Oid
+    ) -> list[pygit2.Oid]:
+        # common ancestors of both commits that are not reachable from other common ancestors
+        flags = {one: _PARENT1, two: _PARENT2}
+        queue = []
+        counter = itertools.count()  # first in, first out for the same priority
+
+        def push(commit_id: pygit2.Oid):
+            generation, commit_time, _ = self._get_commit(repo, commit_id)
+            heapq.heappush(queue, (-generation, -commit_time, next(counter), commit_id))
+
+        push(one)
+        push(two)
+        results = []
+        while any(not flags[item[3]] & _STALE for item in queue):
+            commit_id = heapq.heappop(queue)[3]
+            commit_flags = flags[commit_id] & (_PARENT1 | _PARENT2 | _STALE)
+            if commit_flags == _PARENT1 | _PARENT2:
+                if not flags[commit_id] & _RESULT:
+                    flags[commit_id] |= _RESULT
+                    results.append(commit_id)
+                # its ancestors are not the best common ancestors
+                commit_flags |= _STALE
+            for parent_id in self._get_commit(repo, commit_id)[2]:
+                parent_flags = flags.get(parent_id, 0)
+                if parent_flags & commit_flags == commit_flags:
+                    continue
+                flags[parent_id] = parent_flags | commit_flags
+                push(parent_id)
+        return [commit_id for commit_id in results if not flags[commit_id] & _STALE]
+
+    def get(
+        self, repo: pygit2.Repository, commit_ids: list[pygit2.Oid]
+    ) -> typing.Union[pygit2.Oid, None]:
+        """
+        Same as repo.merge_base_many(commit_ids)
+        """
+        key = tuple(sorted(commit_ids))
+        with self._lock:
+            if key in self._merge_bases:
+                self.hits += 1
+                return self._merge_bases[key]
+            self.misses += 1
+            merge_bases = None
+            if len(key) == 1:
+                merge_bases = list(key)
+            elif len(key) == 2:
+                merge_bases = self._paint_down_to_common(repo, *key)
+            if merge_bases is not None and len(merge_bases) <= 1:
+                merge_base = merge_bases[0] if merge_bases else None
+            else:
+                merge_base = repo.merge_base_many(list(commit_ids))
+            self._merge_bases[key] = merge_base
+            return merge_base
+
+
+class CommitMetadata:
+    repo: pygit2.Repository
+    commit: pygit2.Commit
+    _merge_base: typing.Union[
+        pygit2.Commit, None, bool
+    ]  # False if it hasn't been set yet, None if there is no merge base
+    rebased_parents: list[CommitRecord]
+    _rebased_merge_base: typing.Union[
+        pygit2.Commit, CommitRecord, None, bool
+    ]  # False if it hasn't been set yet, None if there is no merge base
+    pool: typing.Union[
+        "concurrent.futures.Executor", None
+    ]  # to merge blobs in parallel
+    merge_bases: typing.Union[
+        MergeBases, None
+    ]  # if not set, libgit2 is used every time
+    _path_indexes: dict[pygit2.Oid, TreePathIndex]  # trees where paths were looked up
+
+    def __init__(
+        self,
+        repo: pygit2.Repository,
+        commit: pygit2.Commit,
+        rebased_parents: list[CommitRecord],
+        pool: typing.Union["concurrent.futures.Executor", None] = None,
+        merge_bases: typing.Union[MergeBases, None] = None,
+    ):
+        self.repo = repo
+        self.commit = commit
+        self.rebased_parents = rebased_parents
+        self.pool = pool
+        self.merge_bases = merge_bases
+        self._path_indexes = {}
+        self._rebased_merge_base = False
+        self._merge_base = False
+        assert len(self.commit.parent_ids) == len(rebased_parents)
+
+    def _merge_base_many(
+        self, commit_ids: list[pygit2.Oid]
+    ) -> typing.Union[pygit2.Oid, None]:
+        if self.merge_bases is None:
+            return self.repo.merge_base_many(commit_ids)
+        return self.merge_bases.get(self.repo, commit_ids)
+
+    def _get_merge_bases(self):
+        if self._merge_base == False:
+            if len(self.rebased_parents) == 0:
+                self._merge_base = None
+                self._rebased_merge_base = None
+            elif len(self.rebased_parents) == 1:
+                self._merge_base = self.commit.parents[0]
+                self._rebased_merge_base = self.rebased_parents[0]
+            else:
+                self._merge_base = self._merge_base_many(self.commit.parent_ids)
+                if self._merge_base is not None:
+                    self._merge_base = self.repo.get(self._merge_base)
+                self._rebased_merge_base = self._merge_base_many(
+                    [parent.id for parent in self.rebased_parents]
+                )
+                if self._rebased_merge_base is not None:
+                    self._rebased_merge_base = self.repo.get(self._rebased_merge_base)
+
+    def get_tree_item(
+        self, tree_id: typing.Union[pygit2.Oid, None], path: str
+    ) -> typing.Union[pygit2.Object, None]:
+        """
+        Get the item of a tree in a path (None if it does not exist).
+        """
+        if tree_id is None:
+            return None
+        path_index = self._path_indexes.get(tree_id)
+        if path_index is None:
+            path_index = self._path_indexes[tree_id] = TreePathIndex(
+                self.repo.get(tree_id)
+            )
+        return path_index[path]
+
+    @property
+    def merge_base(self) -> typing.Union[pygit2.Commit, None]:
+        self._get_merge_bases()
+        return self._merge_base
+
+    @property
+    def rebased_merge_base(self) -> typing.Union[pygit2.Commit, CommitRecord, None]:
+        self._get_merge_bases()
+        return self._rebased_merge_base
+
+
+def _count_lines(content: bytes) -> int:
+    if not content:
+        return 0
+    return content.count(b"\n") + (0 if content.endswith(b"\n") else 1)
+
+
+def _map_edits(
+    base_edits: list[tuple[int, int, bytes, int]],
+    edits: list[tuple[int, int, bytes, int]],
+) -> typing.Union[list[tuple[int, int, bytes, int]], None]:
+    """
+    base_edits turn the ancestor into another blob and edits are done on that blob.
+    Move edits to the lines of the ancestor. None is returned if an edit overlaps
+    or touches a line changed by base_edits.
+    """
+    mapped_edits = []
+    for start, end, content, side in edits:
+        offset = 0  # lines added (or removed) by base_edits before the edit
+        for base_start, base_end, base_content, _ in base_edits:
+            changed_start = base_start + offset
+            changed_end = changed_start + _count_lines(base_content)
+            if end < changed_start:
+                break
+            if start <= changed_end:
+                return None
+            offset += _count_lines(base_content) - (base_end - base_start)
+        mapped_edits.append((start - offset, end - offset, content, side))
+    return mapped_edits
+
+
+def merge_blob_deltas(
+    repo: pygit2.Repository,
+    commit: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    old_base: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    parents: list[typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None]],
+    new_base: typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None],
+    rebased_parents: list[typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None]],
+    diff_algorithm: DiffAlgorithm = DiffAlgorithm.MYERS,
+    merge_policy: BlobMergePolicy = BlobMergePolicy(),
+    diff3_merger: typing.Union[Diff3Merger, None] = None,
+) -> typing.Union[tuple[pygit2.Oid, pygit2.enums.FileMode], None]:
+    """
+    Apply the changes between the old and the new merge bases and the changes between each
+    parent (updated with the change between bases) and its rebased counterpart on the content
+    of the commit in a single pass. All the changes are moved to the lines of the old merge base
+    and they are applied at the same time, only the result is written into the object database.
+
+    This is the same thing that merge_blobs does chaining 3-way merges. None is returned if the
+    changes overlap or touch each other (or if the blobs can't be merged line by line) so that
+    merge_blobs takes care of it.
+    """
+    items = [commit, old_base, new_base, *parents, *rebased_parents]
+    if not all(
+        item is not None
+        and item[1]
+        in (pygit2.enums.FileMode.BLOB, pygit2.enums.FileMode.BLOB_EXECUTABLE)
+        for item in items
+    ):
+        return None
+    if merge_policy.strategy not in (None, MergeStrategy.TEXT) or any(
+        merge_policy.get_blob_strategy(repo, blob_id) != MergeStrategy.TEXT
+        for blob_id in {item[0] for item in items}
+    ):
+        return None
+
+    # file modes go through the same 3-way merges that merge_blobs would do
+    solved, mode = _merge_values_3way(old_base[1], commit[1], new_base[1])
+    for parent, rebased_parent in zip(parents, rebased_parents):
+        if not solved:
+            return None
+        solved, parent_mode = _merge_values_3way(old_base[1], parent[1], new_base[1])
+        if solved:
+            solved, mode = _merge_values_3way(parent_mode, mode, rebased_parent[1])
+    if not solved:
+        return None
+
+    def diff(
+        old, new, side: int
+    ) -> typing.Union[list[tuple[int, int, bytes, int]], None]:
+        # None if one of the blobs is binary
+        if old[0] == new[0]:
+            return []
+        if diff3_merger is not None:
+            old_tokens = diff3_merger.get_tokens(repo, old[0])
+            new_tokens = diff3_merger.get_tokens(repo, new[0])
+            if old_tokens.binary or new_tokens.binary:
+                return None
+            edits = diff3_merger.diff(old_tokens, new_tokens, side)
+        else:
+            old_blob = repo.get(old[0])
+            new_blob = repo.get(new[0])
+            if old_blob.is_binary or new_blob.is_binary:
+                return None
+            edits = _get_edits(
+                memoryview(old_blob), memoryview(new_blob), diff_algorithm, side
+            )
+        return [
+            (
+                start,
+                end,
+                b"".join(content) if isinstance(content, list) else bytes(content),
+                side,
+            )
+            for start, end, content, side in edits
+        ]
+
+    base_edits = diff(old_base, new_base, 1)
+    commit_edits = diff(old_base, commit, 0)
+    if base_edits is None or commit_edits is None:
+        return None
+    edits = commit_edits + base_edits
+    for side, (parent, rebased_parent) in enumerate(zip(parents, rebased_parents), 2):
+        if old_base == new_base and parent == rebased_parent:
+            continue
+        parent_edits = diff(old_base, parent, side)
+        rebased_parent_edits = diff(parent, rebased_parent, side)
+        if parent_edits is None or rebased_parent_edits is None:
+            return None
+        parent_edits = _map_edits(parent_edits, rebased_parent_edits)
+        if parent_edits is None:
+            return None
+        # the rebased parent already has the changes between bases. Whatever is left
+        # is what has to be applied on the commit
+        for start, end, content, _ in base_edits:
+            try:
+                parent_edits.remove((start, end, content, side))
+            except ValueError:
+                return None
+        edits.extend(parent_edits)
+
+    edits = _merge_edits(edits)
+    if edits is None:
+        return None
+    base_tokens = (
+        diff3_merger.get_tokens(repo, old_base[0])
+        if diff3_merger is not None
+        else LineTokens(repo.get(old_base[0]))
+    )
+    content = []
+    line = 0
+    for start, end, new_content, _ in edits:
+        content.append(base_tokens.content(line, start))
+        content.append(new_content)
+        line = end
+    content.append(base_tokens.content(line, len(base_tokens)))
+    return repo.create_blob(b"".join(content)), mode
+
+
+def merge_blobs(
     repo: pygit2.Repository,
     commit_blob: typing.Union[pygit2.Blob, None],
     merge_base_blob: typing.Union[pygit2.Blob, None],
@@ -393,147 +2099,1430 @@ def merge_blobs(
     rebased_merge_base_blob: typing.Union[pygit2.Blob, None],
     rebased_parent_blobs: list[typing.Union[pygit2.Blob, None]],
     debug: bool = False,
+    diff_algorithm: DiffAlgorithm = DiffAlgorithm.MYERS,
+    cache: typing.Union[LRUCache, None] = None,
+    merge_policy: BlobMergePolicy = BlobMergePolicy(),
+    diff3_merger: typing.Union[Diff3Merger, None] = None,
+    compose: bool = True,
+) -> typing.Union[
+    tuple[pygit2.Oid, int], None, bool
+]:  # None means a deleted Blob, False means there was a conflict, tuple[Blob, filemode]
+    assert commit_blob is None or isinstance(commit_blob, pygit2.Blob)
+    assert len(parent_blobs) == len(rebased_parent_blobs)
+    assert all(
+        parent is None or isinstance(parent, pygit2.Blob) for parent in parent_blobs
+    )
+    assert all(
+        parent is None or isinstance(parent, pygit2.Blob)
+        for parent in rebased_parent_blobs
+    )
+    assert merge_base_blob is None or isinstance(merge_base_blob, pygit2.Blob)
+    assert rebased_merge_base_blob is None or isinstance(
+        rebased_merge_base_blob, pygit2.Blob
+    )
+
+    if debug:
+        log("[merge_blobs] Original commit blob content:")
+        if commit_blob:
+            if merge_policy.is_streamable(commit_blob.size):
+                log("[merge_blobs_easy] Content is too big to show")
+            else:
+                log(commit_blob.data.decode())
+            log(f"[merge_blobs_easy] Blob id: {commit_blob.id}")
+            log(f"[merge_blobs_easy] File Mode: {commit_blob.filemode}")
+        else:
+            log("[merge_blobs_easy] File does not exist in this commit")
+
+    current_result = (commit_blob.id, commit_blob.filemode) if commit_blob else None
+
+    # are the 2 bases (old/new) the same?
+    old_base = (
+        (merge_base_blob.id, merge_base_blob.filemode) if merge_base_blob else None
+    )
+    new_base = (
+        (rebased_merge_base_blob.id, rebased_merge_base_blob.filemode)
+        if rebased_merge_base_blob
+        else None
+    )
+
+    if compose and len(parent_blobs) > 1:
+        # a merge commit: instead of chaining 3-way merges, try to apply all changes at once
+        composed_result = merge_blob_deltas(
+            repo,
+            current_result,
+            old_base,
+            [(blob.id, blob.filemode) if blob else None for blob in parent_blobs],
+            new_base,
+            [
+                (blob.id, blob.filemode) if blob else None
+                for blob in rebased_parent_blobs
+            ],
+            diff_algorithm,
+            merge_policy,
+            diff3_merger,
+        )
+        if composed_result is not None:
+            if debug:
+                log(f"Changes were applied in a single pass: {composed_result}")
+            return composed_result
+        if debug:
+            log("Changes can't be applied in a single pass, they will be chained")
+
+    if old_base == new_base:
+        # we can apply the differences between the old/new merge bases
+        if debug:
+            log(f"Merge bases are the same ({old_base} => {new_base})")
+
+        # now we apply the changes introduced by each parent
+        if debug:
+            log("Introducing changes produced by each parent")
+        for parent_blob, rebased_parent_blob in zip(parent_blobs, rebased_parent_blobs):
+            parent = (parent_blob.id, parent_blob.filemode) if parent_blob else None
+            rebased_parent = (
+                (rebased_parent_blob.id, rebased_parent_blob.filemode)
+                if rebased_parent_blob
+                else None
+            )
+            if debug:
+                log(f"Applying changes between parents: {parent}, {rebased_parent}")
+            if parent == rebased_parent:
+                if debug:
+                    log(
+                        "Rebased parent is the same as the rebased parent. No change to apply."
+                    )
+                    continue
+            current_result = merge_blobs_3way(
+                repo,
+                parent,
+                current_result,
+                rebased_parent,
+                debug,
+                diff_algorithm,
+                cache,
+                merge_policy,
+                diff3_merger,
+            )
+            if isinstance(current_result, pygit2.Index):
+                if debug:
+                    log("Could not apply change between parent and rebased parent")
+                return False
+            if debug:
+                log("Updated content: {current_result}")
+    else:
+        # we apply the differences between the old/new bases onto the original content
+        # then we apply the same change on the _old_ bases
+        # then we apply the differences between ths _updated_ bases and the new bases
+        if debug:
+            log(f"Merge bases are different ({old_base} => {new_base})")
+        current_result = merge_blobs_3way(
+            repo,
+            old_base,
+            current_result,
+            new_base,
+            debug,
+            diff_algorithm,
+            cache,
+            merge_policy,
+            diff3_merger,
+        )
+
+        if isinstance(current_result, pygit2.Index):
+            if debug:
+                log(
+                    "Could not apply changes between old base and new base on the original commit content"
+                )
+            return False
+
+        # now we apply the changes introduced by each parent
+        if debug:
+            log("Applying changes introduced by each parent")
+        for parent_blob, rebased_parent_blob in zip(parent_blobs, rebased_parent_blobs):
+            parent = (parent_blob.id, parent_blob.filemode) if parent_blob else None
+            rebased_parent = (
+                (rebased_parent_blob.id, rebased_parent_blob.filemode)
+                if rebased_parent_blob
+                else None
+            )
+            if debug:
+                log("Applying changes between parents: {parent}, {rebased_parent}")
+            updated_parent = merge_blobs_3way(
+                repo,
+                old_base,
+                parent,
+                new_base,
+                debug,
+                diff_algorithm,
+                cache,
+                merge_policy,
+                diff3_merger,
+            )
+            if isinstance(updated_parent, pygit2.Index):
+                if debug:
+                    log("Could not apply change between bases on the original parent")
+                return False
+            if updated_parent == rebased_parent:
+                if debug:
+                    log(
+                        "Updated parent is the same as the rebased parent. No change to apply."
+                    )
+                    continue
+            if debug:
+                log(
+                    "Applying change {updated_parent} => {rebased_parent} on top of current content ({current_result})"
+                )
+            current_result = merge_blobs_3way(
+                repo,
+                updated_parent,
+                current_result,
+                rebased_parent,
+                debug,
+                diff_algorithm,
+                cache,
+                merge_policy,
+                diff3_merger,
+            )
+            if isinstance(current_result, pygit2.Index):
+                if debug:
+                    log(
+                        "Could not apply change between updated parent and rebased parent"
+                    )
+                return False
+            if debug:
+                log("Updated content: {current_result}")
+
+    if debug:
+        log("Rebase of merge was successful")
+    return current_result
+
+
+class StagingRepository(pygit2.Repository):
+    """
+    Repository whose new objects are written into a separate (scratch) directory of loose objects.
+    Objects are read from the repository as usual. The objects that are needed can be moved into
+    the repository with flush(), the rest of them are gone when the directory is removed.
+
+    Objects are not fsynced nor compressed too hard as they are short lived.
+    pygit2 does not let us use libgit2's in-memory backend and backends written in python
+    can't be called from libgit2 calls that release the GIL so we stick to a loose backend.
+    """
+
+    objects_path: str
+    staged_objects: pygit2.OdbBackendLoose
+    flushed_objects: set[pygit2.Oid]
+
+    def __init__(self, path: str, objects_path: str):
+        super().__init__(path)
+        self.objects_path = objects_path
+        self.staged_objects = pygit2.OdbBackendLoose(objects_path, 1, False)
+        # the highest priority gets the writes
+        self.odb.add_backend(self.staged_objects, 1000)
+        self.flushed_objects = set()
+
+    def flush(self, *commit_ids: pygit2.Oid) -> int:
+        """
+        Write the staged objects that are reachable from the commits into a pack in the repository.
+        Returns the number of objects that were written.
+        """
+        object_ids = []
+        pending = list(commit_ids)
+        visited = self.flushed_objects
+        while pending:
+            object_id = pending.pop()
+            if object_id in visited or not self.staged_objects.exists(object_id):
+                # objects that are not staged can't point to staged objects
+                # and what is reachable from flushed objects is flushed too
+                continue
+            visited.add(object_id)
+            object_ids.append(object_id)
+            item = self.get(object_id)
+            if isinstance(item, pygit2.Commit):
+                pending.append(item.tree_id)
+                pending.extend(item.parent_ids)
+            elif isinstance(item, pygit2.Tree):
+                pending.extend(entry.id for entry in item)
+        if not object_ids:
+            return 0
+
+        def add_objects(pack_builder: pygit2.PackBuilder):
+            for object_id in object_ids:
+                pack_builder.add(object_id)
+
+        return self.pack(pack_delegate=add_objects)
+
+
+_worker_repositories = threading.local()
+
+
+def _get_worker_repository(
+    repo_path: str, objects_path: typing.Union[str, None]
+) -> pygit2.Repository:
+    # each thread of a pool works with its own repository
+    repositories = _worker_repositories.__dict__.setdefault("repositories", {})
+    repo = repositories.get((repo_path, objects_path))
+    if repo is None:
+        repo = repositories[(repo_path, objects_path)] = (
+            StagingRepository(repo_path, objects_path)
+            if objects_path is not None
+            else pygit2.Repository(repo_path)
+        )
+    return repo
+
+
+def _get_objects_path(repo: pygit2.Repository) -> typing.Union[str, None]:
+    # where workers find the objects that are staged, if they are
+    return repo.objects_path if isinstance(repo, StagingRepository) else None
+
+
+def _merge_blobs_in_worker(
+    repo_path: str, objects_path: typing.Union[str, None], *args
+) -> typing.Union[tuple[pygit2.Oid, int], None, bool]:
+    return merge_blobs(_get_worker_repository(repo_path, objects_path), *args)
+
+
+class PendingTree:
+    """
+    Tree that can't be written yet because some of its blobs are being merged in the pool.
+    Items are kept in the order of the tree so that the result (and the conflicts) are
+    the same that we would get merging the blobs one at a time.
+    """
+
+    def __init__(self, tree_builder: pygit2.TreeBuilder):
+        self.tree_builder = tree_builder
+        # (path, future/pending tree/None, conflict to report if the merge fails)
+        self.items: list[tuple[str, typing.Any, typing.Union[tuple, None]]] = []
+        # where to save the result when it is written
+        self.cache: typing.Union[LRUCache, None] = None
+        self.cache_key: typing.Any = None
+
+    def write(
+        self,
+        conflicts: list[
+            tuple[
+                str,
+                typing.Union[pygit2.Object, None],
+                list[typing.Union[pygit2.Object, None]],
+                list[typing.Union[pygit2.Object, None]],
+            ]
+        ],
+    ) -> typing.Union[pygit2.Oid, None]:
+        conflicts_count = len(conflicts)
+        for path, item, conflict in self.items:
+            if isinstance(item, PendingTree):
+                tree_id = item.write(conflicts)
+                if tree_id is not None:
+                    self.tree_builder.insert(path, tree_id, pygit2.enums.FileMode.TREE)
+                continue
+            blob_result = item.result() if item is not None else False
+            if isinstance(blob_result, tuple):
+                self.tree_builder.insert(path, blob_result[0], blob_result[1])
+            elif blob_result is False:
+                conflicts.append(conflict)
+        tree_id = self.tree_builder.write() if len(self.tree_builder) else None
+        if self.cache is not None:
+            self.cache.put(self.cache_key, (tree_id, conflicts[conflicts_count:]))
+        return tree_id
+
+
+def _set_tree_entry(
+    tree_builder: pygit2.TreeBuilder,
+    name: str,
+    seed_item: typing.Union[TreeEntry, None],
+    item: typing.Union[TreeEntry, None],
+) -> None:
+    """
+    Set an entry of a tree builder that was seeded with a tree that has seed_item as the entry.
+    The builder is only touched if the entry differs.
+    """
+    if item is None:
+        _remove_tree_entry(tree_builder, name, seed_item)
+    elif item != seed_item:
+        tree_builder.insert(name, pygit2.Oid(raw=item[2]), int(item[0], 8))
+
+
+def _remove_tree_entry(
+    tree_builder: pygit2.TreeBuilder,
+    name: str,
+    seed_item: typing.Union[TreeEntry, None],
+) -> None:
+    if seed_item is not None:
+        tree_builder.remove(name)
+
+
+def _get_entry_object(
+    repo: pygit2.Repository, entry: typing.Union[TreeEntry, None]
+) -> typing.Union[pygit2.Object, None]:
+    return repo.get(pygit2.Oid(raw=entry[2])) if entry is not None else None
+
+
+def _is_debug_path(rebase_options: RebaseOptions, fullpath: str) -> bool:
+    return rebase_options.debug and (
+        not rebase_options.debug_paths
+        or any(
+            fullpath.startswith(debug_path) for debug_path in rebase_options.debug_paths
+        )
+    )
+
+
+def _get_tree_item(
+    tree: typing.Union[pygit2.Tree, None], path: str
+) -> typing.Union[pygit2.Object, None]:
+    if tree is None:
+        return None
+    try:
+        return tree[path]
+    except KeyError:
+        return None
+
+
+def _get_blob_merge(
+    rebase_options: RebaseOptions,
+    commit_metadata: CommitMetadata,
+    commit_blob: typing.Union[pygit2.Blob, None],
+    fullpath: str,
+    debug: bool,
+) -> tuple:
+    # arguments for merge_blobs (after the repository) to rebase a blob of the commit
+
+    # parent blobs, we need them _all_
+    parent_blobs = [
+        commit_metadata.get_tree_item(parent.tree_id, fullpath)
+        for parent in commit_metadata.commit.parents
+    ]
+    rebased_parent_blobs = [
+        commit_metadata.get_tree_item(parent.tree_id, fullpath)
+        for parent in commit_metadata.rebased_parents
+    ]
+
+    # merge base blobs
+    merge_base_blob = commit_metadata.get_tree_item(
+        commit_metadata.merge_base.tree_id if commit_metadata.merge_base else None,
+        fullpath,
+    )
+    rebased_merge_base_blob = commit_metadata.get_tree_item(
+        (
+            commit_metadata.rebased_merge_base.tree_id
+            if commit_metadata.rebased_merge_base
+            else None
+        ),
+        fullpath,
+    )
+
+    return (
+        commit_blob,
+        merge_base_blob,
+        parent_blobs,
+        rebased_merge_base_blob,
+        rebased_parent_blobs,
+        debug,
+        rebase_options.diff_algorithm,
+        rebase_options.blob_merge_cache,
+        get_merge_policy(
+            commit_metadata.repo,
+            fullpath,
+            (
+                commit_metadata.rebased_parents[0]
+                if commit_metadata.rebased_parents
+                else None
+            ),
+            rebase_options.big_file_threshold,
+            rebase_options.streaming_merge_threshold,
+        ),
+        rebase_options.diff3_merger,
+        rebase_options.compose_blob_merges,
+    )
+
+
+def _submit_blob_merge(
+    commit_metadata: CommitMetadata, blob_merge: tuple
+) -> "concurrent.futures.Future":
+    return commit_metadata.pool.submit(
+        _merge_blobs_in_worker,
+        commit_metadata.repo.path,
+        _get_objects_path(commit_metadata.repo),
+        *blob_merge,
+    )
+
+
+def _patch_tree(
+    repo: pygit2.Repository,
+    tree: typing.Union[pygit2.Tree, None],
+    changes: dict[str, typing.Union[tuple[pygit2.Oid, int], None]],
+) -> typing.Union[pygit2.Oid, None]:
+    """
+    Write a tree that has the changes (relative path => (id, filemode) or None if deleted)
+    on top of the tree. None is returned if the tree ends up being empty.
+    """
+    tree_builder = repo.TreeBuilder(tree.id) if tree is not None else repo.TreeBuilder()
+    subtree_changes = {}
+    for path, item in changes.items():
+        name, _, subpath = path.partition("/")
+        if subpath:
+            subtree_changes.setdefault(name, {})[subpath] = item
+        elif item is None:
+            if tree_builder.get(name) is not None:
+                tree_builder.remove(name)
+        else:
+            tree_builder.insert(name, item[0], item[1])
+    for name, changes in subtree_changes.items():
+        subtree_id = _patch_tree(repo, _get_tree_item(tree, name), changes)
+        if subtree_id is None:
+            if tree_builder.get(name) is not None:
+                tree_builder.remove(name)
+        else:
+            tree_builder.insert(name, subtree_id, pygit2.enums.FileMode.TREE)
+    if len(tree_builder):
+        return tree_builder.write()
+    return None
+
+
+def merge_trees_by_diff(
+    rebase_options: RebaseOptions,
+    commit_metadata: CommitMetadata,
+    commit_tree: pygit2.Tree,
+    orig_parent_trees: list[pygit2.Tree],
+    rebased_parent_trees: list[pygit2.Tree],
+    conflicts: list[
+        tuple[
+            str,
+            typing.Union[pygit2.Object, None],
+            list[typing.Union[pygit2.Object, None]],
+            list[typing.Union[pygit2.Object, None]],
+        ]
+    ],
+) -> tuple[bool, typing.Union[pygit2.Oid, None]]:
+    """
+    Rebase the root tree of a commit looking only at the paths that changed between the original
+    and the rebased parent trees (libgit2 diffs the trees). Each path is solved the same way that
+    merge_trees does it and the changes are written on top of the tree of the commit.
+
+    The first item of the result says if it could be done. Paths that are trees on one side and
+    blobs on the other (or submodules) are left for merge_trees to walk over the trees.
+    """
+    changed_paths = set()
+    for orig_parent_tree, rebased_parent_tree in zip(
+        orig_parent_trees, rebased_parent_trees
+    ):
+        if orig_parent_tree is None or rebased_parent_tree is None:
+            return False, None
+        if orig_parent_tree.id == rebased_parent_tree.id:
+            continue
+        for delta in orig_parent_tree.diff_to_tree(rebased_parent_tree).deltas:
+            if pygit2.enums.FileMode.COMMIT in (
+                delta.old_file.mode,
+                delta.new_file.mode,
+            ):
+                return False, None
+            changed_paths.add(delta.old_file.path)
+            changed_paths.add(delta.new_file.path)
+
+    merges = []  # (path, result/future, conflict)
+    for fullpath in sorted(changed_paths):
+        commit_item = commit_metadata.get_tree_item(commit_tree.id, fullpath)
+        original_parent_items = [
+            commit_metadata.get_tree_item(tree.id, fullpath)
+            for tree in orig_parent_trees
+        ]
+        rebased_parent_items = [
+            commit_metadata.get_tree_item(tree.id, fullpath)
+            for tree in rebased_parent_trees
+        ]
+        if not all(
+            item is None or isinstance(item, pygit2.Blob)
+            for item in (commit_item, *original_parent_items, *rebased_parent_items)
+        ):
+            return False, None
+        if commit_item is None and any(
+            isinstance(
+                commit_metadata.get_tree_item(commit_tree.id, fullpath[:position]),
+                pygit2.Blob,
+            )
+            for position, character in enumerate(fullpath)
+            if character == "/"
+        ):
+            # the commit has a blob where the path needs a tree
+            return False, None
+
+        differing_parents = set()  # each item is a tuple (original item, rebased item)
+        for original_parent_item, rebased_parent_item in zip(
+            original_parent_items, rebased_parent_items
+        ):
+            # objects are equal if their ids are, but a change of mode is a change too
+            if not objects_match(original_parent_item, rebased_parent_item):
+                differing_parents.add((original_parent_item, rebased_parent_item))
+        if not differing_parents:
+            # the commit already has what it needs
+            continue
+
+        if len(differing_parents) == 1:
+            original_parent_item, rebased_parent_item = list(differing_parents)[0]
+            solved, item_to_commit = easy_merge(
+                commit_item, original_parent_item, rebased_parent_item
+            )
+            if solved:
+                merges.append(
+                    (
+                        fullpath,
+                        (
+                            (item_to_commit.id, item_to_commit.filemode)
+                            if item_to_commit is not None
+                            else None
+                        ),
+                        None,
+                    )
+                )
+                continue
+
+        debug_file = _is_debug_path(rebase_options, fullpath)
+        if debug_file:
+            log(
+                f"Will call merge_blobs_easy on commit {commit_metadata.commit.id} - {fullpath}"
+            )
+        blob_merge = _get_blob_merge(
+            rebase_options, commit_metadata, commit_item, fullpath, debug_file
+        )
+        conflict = (fullpath, commit_item, original_parent_items, rebased_parent_items)
+        if commit_metadata.pool:
+            merges.append(
+                (fullpath, _submit_blob_merge(commit_metadata, blob_merge), conflict)
+            )
+        else:
+            merges.append(
+                (fullpath, merge_blobs(commit_metadata.repo, *blob_merge), conflict)
+            )
+
+    changes = {}
+    for fullpath, result, conflict in merges:
+        if hasattr(result, "result"):
+            # a future of the pool
+            result = result.result()
+        if result is False:
+            conflicts.append(conflict)
+        else:
+            changes[fullpath] = result
+    return True, _patch_tree(commit_metadata.repo, commit_tree, changes)
+
+
+def _get_tree_merge_key(
+    commit_metadata: CommitMetadata,
+    commit_tree: typing.Union[pygit2.Tree, None],
+    orig_parent_trees: list[typing.Union[pygit2.Tree, None]],
+    rebased_parent_trees: list[typing.Union[pygit2.Tree, None]],
+    paths: list[str],
+) -> typing.Union[tuple, None]:
+    # only single-parent commits: on merge commits, blobs are merged with all the parents
+    # and the merge bases so the subtrees are not enough to know what the result would be
+    if len(commit_metadata.commit.parent_ids) != 1 or len(orig_parent_trees) != 1:
+        return None
+    # attributes that apply to the blobs come from the .gitattributes of the rebased parent
+    rebased_parent_tree_id = commit_metadata.rebased_parents[0].tree_id
+    attributes = (
+        commit_metadata.get_tree_item(
+            rebased_parent_tree_id, "/".join(paths[:depth] + [".gitattributes"])
+        )
+        for depth in range(len(paths))
+    )
+    return (
+        "/".join(paths),
+        commit_tree.id if commit_tree else None,
+        orig_parent_trees[0].id if orig_parent_trees[0] else None,
+        rebased_parent_trees[0].id if rebased_parent_trees[0] else None,
+        tuple(item.id if item else None for item in attributes),
+    )
+
+
+def merge_trees(
+    rebase_options: RebaseOptions,
+    commit_metadata: CommitMetadata,
+    commit_tree: typing.Union[pygit2.Tree, None],
+    orig_parent_trees: list[typing.Union[pygit2.Tree, None]],
+    rebased_parent_trees: list[typing.Union[pygit2.Tree, None]],
+    conflicts: list[
+        tuple[
+            str,
+            typing.Union[pygit2.Object, None],
+            list[typing.Union[pygit2.Object, None]],
+            list[typing.Union[pygit2.Object, None]],
+        ]
+    ],
+    paths: list[str] = [],
 ) -> typing.Union[
-    tuple[pygit2.Oid, int], None, bool
-]:  # None means a deleted Blob, False means there was a conflict, tuple[Blob, filemode]
-    assert commit_blob is None or isinstance(commit_blob, pygit2.Blob)
-    assert len(parent_blobs) == len(rebased_parent_blobs)
+    pygit2.Oid, None, bool, PendingTree
+]:  # None if the result is an empty/deleted tree, False if we have a tree conflict, PendingTree if blobs are being merged in parallel
+    cache = rebase_options.tree_merge_cache
+    key = (
+        _get_tree_merge_key(
+            commit_metadata, commit_tree, orig_parent_trees, rebased_parent_trees, paths
+        )
+        if cache is not None
+        else None
+    )
+    if key is None:
+        return _merge_trees(
+            rebase_options,
+            commit_metadata,
+            commit_tree,
+            orig_parent_trees,
+            rebased_parent_trees,
+            conflicts,
+            paths,
+        )
+
+    found, cached_result = cache.get(key)
+    if found:
+        log(f"merge trees using cached result for paths: {paths}", rebase_options)
+        result, cached_conflicts = cached_result
+        conflicts.extend(cached_conflicts)
+        return result
+
+    conflicts_count = len(conflicts)
+    result = _merge_trees(
+        rebase_options,
+        commit_metadata,
+        commit_tree,
+        orig_parent_trees,
+        rebased_parent_trees,
+        conflicts,
+        paths,
+    )
+    if isinstance(result, PendingTree):
+        # it will be saved when it is written
+        result.cache, result.cache_key = cache, key
+    else:
+        cache.put(key, (result, conflicts[conflicts_count:]))
+    return result
+
+
+# TODO is it ok to only consider _differing_ parents? (trees, blobs)
+# I have a hunch this is way too optimistic.
+def _merge_trees(
+    rebase_options: RebaseOptions,
+    commit_metadata: CommitMetadata,
+    commit_tree: typing.Union[
+        pygit2.Tree, None
+    ],  # TODO not necessarily a root tree so maybe a better name would clear it up
+    orig_parent_trees: list[typing.Union[pygit2.Tree, None]],
+    rebased_parent_trees: list[typing.Union[pygit2.Tree, None]],
+    conflicts: list[
+        tuple[
+            str,
+            typing.Union[pygit2.Object, None],
+            list[typing.Union[pygit2.Object, None]],
+            list[typing.Union[pygit2.Object, None]],
+        ]
+    ],
+    paths: list[str] = [],
+) -> typing.Union[
+    pygit2.Oid, None, bool, PendingTree
+]:  # None if the result is an empty/deleted tree, False if we have a tree conflict, PendingTree if blobs are being merged in parallel
+    log(f"merge trees using these paths: {paths}", rebase_options)
+    assert commit_tree is None or isinstance(commit_tree, pygit2.Tree)
+    assert len(orig_parent_trees) == len(rebased_parent_trees)
     assert all(
-        parent is None or isinstance(parent, pygit2.Blob) for parent in parent_blobs
+        (parent is None or isinstance(parent, pygit2.Tree))
+        for parent in orig_parent_trees
     )
     assert all(
-        parent is None or isinstance(parent, pygit2.Blob)
-        for parent in rebased_parent_blobs
+        (parent is None or isinstance(parent, pygit2.Tree))
+        for parent in rebased_parent_trees
     )
-    assert merge_base_blob is None or isinstance(merge_base_blob, pygit2.Blob)
-    assert rebased_merge_base_blob is None or isinstance(
-        rebased_merge_base_blob, pygit2.Blob
+
+    # the following sanity check has to be carried out on a root tree
+    # if we are working on a recursive call, this check has already been carried out
+    if not paths:
+        differing_parents = set()  # each item is a tuple (original tree, rebased tree)
+        for orig_parent_tree, rebased_parent_tree in zip(
+            orig_parent_trees, rebased_parent_trees
+        ):
+            if orig_parent_tree == rebased_parent_tree:
+                # also works for None
+                continue
+            if (
+                orig_parent_tree is None
+                or rebased_parent_tree is None
+                or orig_parent_tree.id != rebased_parent_tree.id
+            ):
+                differing_parents.add((orig_parent_tree, rebased_parent_tree))
+        if not differing_parents:
+            # we can take the original tree as a whole
+            return commit_tree.id
+
+        # if dealing with single "differing" parent commits, there are a few other possibilities using the rebased parent tree
+        if len(differing_parents) == 1:
+            orig_parent_tree, rebased_parent_tree = list(differing_parents)[0]
+            easy_solution = easy_merge(
+                commit_tree, orig_parent_tree, rebased_parent_tree
+            )
+            if easy_solution[0]:
+                # it was solved
+                return easy_solution[1].id
+
+        if rebase_options.diff_trees:
+            solved, result = merge_trees_by_diff(
+                rebase_options,
+                commit_metadata,
+                commit_tree,
+                orig_parent_trees,
+                rebased_parent_trees,
+                conflicts,
+            )
+            if solved:
+                return result
+
+    # not everything in the trees matches.... can we solve this puzzle?
+    # We need to walk over the items in the trees, both sets of parents and commit_tree.
+    # If we are lucky, we will be able to find correct resolutions for all the
+    # separate items in the trees.
+    # entries that are the same in all the trees are already in the seed tree
+    trees_iterator = TreesIterator(
+        commit_tree, orig_parent_trees, rebased_parent_trees, skip_matching=True
+    )
+    # the tree is built on top of the commit tree (or the rebased parent tree if the
+    # commit does not have it) so only the entries that differ from it are touched
+    seed_tree, seed_slot = commit_tree, None
+    if seed_tree is None and len(rebased_parent_trees) == 1:
+        seed_tree, seed_slot = rebased_parent_trees[0], 0
+    tree_builder = (
+        commit_metadata.repo.TreeBuilder(seed_tree.id)
+        if seed_tree is not None
+        else commit_metadata.repo.TreeBuilder()
+    )
+    # if blobs are merged in parallel, the tree is written when the merges are finished
+    pending_tree = PendingTree(tree_builder) if commit_metadata.pool else None
+    while tree_items := trees_iterator.next_tree_items():
+        path, commit_tree_item, original_parent_items, rebased_parent_items = tree_items
+        seed_item = (
+            commit_tree_item if seed_slot is None else rebased_parent_items[seed_slot]
+        )
+        differing_parents = set()  # each item is a tuple (original item, rebased item)
+        for original_parent_item, rebased_parent_item in zip(
+            original_parent_items, rebased_parent_items
+        ):
+            if original_parent_item != rebased_parent_item:
+                differing_parents.add((original_parent_item, rebased_parent_item))
+
+        if not differing_parents:
+            _set_tree_entry(tree_builder, path, seed_item, commit_tree_item)
+            continue
+
+        # not everything matches
+
+        if len(differing_parents) == 1:
+            differing_parents = list(differing_parents)
+            # Is it still possible to use an easy conflict resolution?
+            original_parent_item, rebased_parent_item = list(differing_parents)[0]
+            solved, item_to_commit = easy_merge(
+                commit_tree_item, original_parent_item, rebased_parent_item, operator.eq
+            )
+
+            if solved:
+                _set_tree_entry(tree_builder, path, seed_item, item_to_commit)
+                continue
+
+        # if we are wondering around here we have like a _real_ conflict of some kind
+
+        if _is_tree_entry(commit_tree_item) and all(
+            _is_tree_entry(orig_parent) and _is_tree_entry(rebased_parent)
+            for orig_parent, rebased_parent in differing_parents
+        ):
+            # we we are dealing with trees, we can recurse into them
+            original_differing_parent_items, rebased_differing_parent_items = zip(
+                *differing_parents
+            )
+            paths.append(path)
+            recursive_result = merge_trees(
+                rebase_options,
+                commit_metadata,
+                _get_entry_object(commit_metadata.repo, commit_tree_item),
+                [
+                    _get_entry_object(commit_metadata.repo, item)
+                    for item in original_differing_parent_items
+                ],
+                [
+                    _get_entry_object(commit_metadata.repo, item)
+                    for item in rebased_differing_parent_items
+                ],
+                conflicts,
+                paths,
+            )
+            del paths[-1]
+            if isinstance(recursive_result, PendingTree):
+                _remove_tree_entry(tree_builder, path, seed_item)
+                pending_tree.items.append((path, recursive_result, None))
+                continue
+            # a non-empty tree, a deleted tree (None) or a conflict
+            # if there is a conflict, it has been taken care of at the "leaves" (blobs) level
+            if recursive_result:
+                # a non-empty tree
+                tree_builder.insert(path, recursive_result, pygit2.enums.FileMode.TREE)
+            else:
+                _remove_tree_entry(tree_builder, path, seed_item)
+            continue  # go to the next tree item
+
+        # pygit2 objects are only needed from here on
+        paths.append(path)
+        fullpath = "/".join(paths)
+        del paths[-1]
+        conflict = (
+            fullpath,
+            _get_tree_item(commit_tree, path),
+            [_get_tree_item(tree, path) for tree in orig_parent_trees],
+            [_get_tree_item(tree, path) for tree in rebased_parent_trees],
+        )
+
+        if _is_blob_entry(commit_tree_item) and all(
+            _is_blob_entry(orig_parent) and _is_blob_entry(rebased_parent)
+            for orig_parent, rebased_parent in differing_parents
+        ):
+            # we are dealing with blobs, we can try to find a way to merge them
+            debug_file = _is_debug_path(rebase_options, fullpath)
+            if debug_file:
+                log(
+                    f"Will call merge_blobs_easy on commit {commit_metadata.commit.id} - {fullpath}"
+                )
+            blob_merge = _get_blob_merge(
+                rebase_options, commit_metadata, conflict[1], fullpath, debug_file
+            )
+            if pending_tree is not None:
+                future = _submit_blob_merge(commit_metadata, blob_merge)
+                _remove_tree_entry(tree_builder, path, seed_item)
+                pending_tree.items.append((path, future, conflict))
+                continue
+            blob_result = merge_blobs(commit_metadata.repo, *blob_merge)
+            if isinstance(blob_result, tuple):
+                # we were able to solve it
+                tree_builder.insert(path, blob_result[0], blob_result[1])
+            else:
+                _remove_tree_entry(tree_builder, path, seed_item)
+                if blob_result is not None:
+                    conflicts.append(conflict)
+            continue
+
+        # if we are wondering around here we have like a _real_ conflict that we could not solve
+        _remove_tree_entry(tree_builder, path, seed_item)
+        if pending_tree is not None:
+            pending_tree.items.append((path, None, conflict))
+        else:
+            conflicts.append(conflict)
+        continue
+
+    if pending_tree is not None and pending_tree.items:
+        return pending_tree
+    if len(tree_builder):
+        return tree_builder.write()
+    return None
+
+
+class RebaseState(typing.NamedTuple):
+    """
+    Progress of a rebase, as it is saved in the state file
+    """
+
+    upstream: pygit2.Oid
+    source: pygit2.Oid
+    onto: typing.Union[pygit2.Oid, None]
+    commits_map: dict[pygit2.Oid, pygit2.Oid]  # original id => rebased id
+    conflict: typing.Union[pygit2.Oid, None]  # commit that had conflicts
+    metadata: dict
+
+    def get_rebase_options(self, repo: pygit2.Repository) -> RebaseOptions:
+        """
+        Options to continue the rebase. Resolutions for the conflict can be added to them.
+        """
+        rebase_options = RebaseOptions(
+            repo.get(self.upstream),
+            repo.get(self.source),
+            repo.get(self.onto) if self.onto is not None else None,
+        )
+        rebase_options.commits_map = dict(self.commits_map)
+        rebase_options.state_metadata = self.metadata
+        return rebase_options
+
+
+def save_rebase_state(path: str, state: RebaseState) -> None:
+    data = {
+        "upstream": str(state.upstream),
+        "source": str(state.source),
+        "onto": str(state.onto) if state.onto is not None else None,
+        "commits": {
+            str(original): str(rebased)
+            for original, rebased in state.commits_map.items()
+        },
+        "conflict": str(state.conflict) if state.conflict is not None else None,
+        "metadata": state.metadata,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # a crash while writing it can't leave a broken state behind
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as state_file:
+        json.dump(data, state_file)
+    os.replace(temp_path, path)
+
+
+def load_rebase_state(path: str) -> typing.Union[RebaseState, None]:
+    # None if there is no saved state
+    try:
+        with open(path) as state_file:
+            data = json.load(state_file)
+    except FileNotFoundError:
+        return None
+    return RebaseState(
+        pygit2.Oid(hex=data["upstream"]),
+        pygit2.Oid(hex=data["source"]),
+        pygit2.Oid(hex=data["onto"]) if data["onto"] is not None else None,
+        {
+            pygit2.Oid(hex=original): pygit2.Oid(hex=rebased)
+            for original, rebased in data["commits"].items()
+        },
+        pygit2.Oid(hex=data["conflict"]) if data["conflict"] is not None else None,
+        data["metadata"],
+    )
+
+
+def _save_checkpoint(
+    repo: pygit2.Repository,
+    rebase_options: RebaseOptions,
+    commits_map: dict[pygit2.Oid, pygit2.Oid],
+    conflict: typing.Union[pygit2.Oid, None],
+) -> None:
+    if isinstance(repo, StagingRepository):
+        # the commits have to be in the repository to continue from them
+        repo.flush(*commits_map.values())
+    if rebase_options.rebase_cache is not None:
+        rebase_options.rebase_cache.save()
+    save_rebase_state(
+        rebase_options.state_path,
+        RebaseState(
+            rebase_options.upstream.id,
+            rebase_options.source.id,
+            rebase_options.onto.id if rebase_options.onto is not None else None,
+            commits_map,
+            conflict,
+            rebase_options.state_metadata,
+        ),
+    )
+
+
+def find_stacked_branches(
+    repo: pygit2.Repository, source_id: pygit2.Oid, merge_base_id: pygit2.Oid
+) -> dict[str, pygit2.Oid]:
+    """
+    Local branches that point to commits in merge_base..source (name => commit), like
+    the branches of a stack that source is on top of.
+    """
+    branches: dict[pygit2.Oid, list[str]] = {}  # commit => names
+    for name in repo.references:
+        if not name.startswith("refs/heads/"):
+            continue
+        reference = repo.references[name]
+        if reference.type == pygit2.enums.ReferenceType.DIRECT:
+            branches.setdefault(reference.target, []).append(name)
+    stacked_branches = {}
+    if branches:
+        for commit in _walk_commits_to_rebase(repo, [source_id], [merge_base_id]):
+            for name in branches.get(commit.id, ()):
+                stacked_branches[name] = commit.id
+    return stacked_branches
+
+
+def update_references(
+    repo: pygit2.Repository,
+    original_targets: dict[str, pygit2.Oid],
+    targets: dict[str, pygit2.Oid],
+    message: str,
+) -> None:
+    """
+    Move references in a single transaction: either all of them are moved or none is.
+    It fails if any of them does not point to its original target anymore.
+    """
+    with repo.transaction() as transaction:
+        for name in targets:
+            transaction.lock_ref(name)
+        for name, target in targets.items():
+            current_target = repo.references[name].target
+            if current_target != original_targets[name]:
+                raise pygit2.GitError(
+                    f"Reference {name} moved from {original_targets[name]} "
+                    f"to {current_target} during the rebase"
+                )
+            transaction.set_target(name, target, message=message)
+
+
+class BatchResult(typing.NamedTuple):
+    """
+    What happened with one of the sources of rebase_batch()
+    """
+
+    spec: str  # source[:onto], as it was provided
+    reference: typing.Union[str, None]  # local branch of the source, if it is one
+    source: typing.Union[pygit2.Oid, None]
+    onto: typing.Union[pygit2.Oid, None]
+    commit: typing.Union[pygit2.Oid, None]  # None if the rebase failed
+    reason: typing.Union[str, None]  # why it failed
+    conflicts: list[str]  # paths with conflicts
+    seconds: float
+
+
+def _get_fork_context():
+    # rebase-- has no __main__ guard so pools can't spawn processes, they fork
+    import multiprocessing
+
+    return multiprocessing.get_context("fork")
+
+
+_batch_commit_graphs: dict[str, typing.Union[CommitGraph, None]] = {}
+
+
+def _rebase_in_batch(
+    repo_path: str,
+    rebase_options: RebaseOptions,
+    upstream_id: str,
+    source_id: str,
+    onto_id: str,
+) -> tuple[typing.Union[str, None], typing.Union[str, None], list[str], float]:
+    # rebased commit, reason if it failed, paths with conflicts and the time it took
+    # (ids go between processes as hex strings, oids can't be pickled)
+    start = time.perf_counter()
+    # the repository (and the objects it has read from the onto side) is kept by the worker
+    repo = _get_worker_repository(repo_path, None)
+    if repo_path not in _batch_commit_graphs:
+        _batch_commit_graphs[repo_path] = CommitGraph.open(repo)
+    rebase_options = copy.copy(rebase_options)
+    rebase_options.upstream = repo.get(upstream_id)
+    rebase_options.source = repo.get(source_id)
+    rebase_options.onto = repo.get(onto_id)
+    rebase_options.merge_bases = MergeBases(_batch_commit_graphs[repo_path])
+    conflicts = []
+    try:
+        result = rebase(repo, rebase_options, conflicts)
+    except Exception as e:
+        # a branch that can't be rebased does not stop the others
+        return None, f"{type(e).__name__}: {e}", [], time.perf_counter() - start
+    seconds = time.perf_counter() - start
+    if isinstance(result, pygit2.Commit):
+        return str(result.id), None, [], seconds
+    reason, commit, _ = result
+    if commit is not None:
+        reason = f"{reason} on commit {commit.id}"
+    return None, reason, [conflict[0] for conflict in conflicts], seconds
+
+
+def rebase_batch(
+    repo: pygit2.Repository,
+    upstream: pygit2.Commit,
+    specs: typing.Iterable[str],
+    rebase_options: RebaseOptions,
+    jobs: int = 1,
+) -> typing.Iterator[BatchResult]:
+    """
+    Rebase many sources onto the same upstream, each one of them described by a spec
+    like source[:onto] (onto is upstream if it is not provided). Results are yielded as
+    the rebases finish.
+
+    Specs are parsed here (revisions that repeat are only looked up once) and the rebases
+    run on a pool of `jobs` processes, each one of them with its own repository that
+    is reused for all the rebases that it runs.
+    rebase_options is a template: upstream, source and onto are set for every rebase
+    and it can't have a progress_hook.
+    """
+    import concurrent.futures
+
+    revisions: dict[str, typing.Union[pygit2.Commit, str]] = {}  # commit or an error
+
+    def get_commit(revision: str) -> typing.Union[pygit2.Commit, str]:
+        commit = revisions.get(revision)
+        if commit is None:
+            try:
+                commit = repo.revparse_single(revision).peel(pygit2.Commit)
+            except (KeyError, ValueError, pygit2.GitError) as e:
+                commit = f"Could not find {revision}: {e}"
+            revisions[revision] = commit
+        return commit
+
+    template = copy.copy(rebase_options)
+    template.upstream, template.source, template.onto = None, None, None
+    pool = (
+        concurrent.futures.ProcessPoolExecutor(jobs, mp_context=_get_fork_context())
+        if jobs > 1
+        else None
+    )
+    try:
+        running: dict[concurrent.futures.Future, BatchResult] = {}
+        for spec in specs:
+            source_name, _, onto_name = spec.partition(":")
+            reference = None
+            try:
+                reference = repo.lookup_reference_dwim(source_name).name
+            except (KeyError, pygit2.InvalidSpecError):
+                pass
+            result = BatchResult(
+                spec,
+                (
+                    reference
+                    if reference and reference.startswith("refs/heads/")
+                    else None
+                ),
+                None,
+                None,
+                None,
+                None,
+                [],
+                0.0,
+            )
+            source = get_commit(source_name)
+            onto = get_commit(onto_name) if onto_name else upstream
+            for commit in (source, onto):
+                if isinstance(commit, str):
+                    result = result._replace(reason=commit)
+                    break
+            if result.reason is not None:
+                yield result
+                continue
+            result = result._replace(source=source.id, onto=onto.id)
+            arguments = (
+                repo.path,
+                template,
+                str(upstream.id),
+                str(source.id),
+                str(onto.id),
+            )
+            if pool is None:
+                yield _get_batch_result(result, _rebase_in_batch(*arguments))
+            else:
+                running[pool.submit(_rebase_in_batch, *arguments)] = result
+        for future in concurrent.futures.as_completed(running):
+            try:
+                outcome = future.result()
+            except Exception as e:
+                # like a worker that died
+                outcome = None, f"{type(e).__name__}: {e}", [], 0.0
+            yield _get_batch_result(running[future], outcome)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def _get_batch_result(result: BatchResult, outcome: tuple) -> BatchResult:
+    commit, reason, conflicts, seconds = outcome
+    return result._replace(
+        commit=pygit2.Oid(hex=commit) if commit is not None else None,
+        reason=reason,
+        conflicts=conflicts,
+        seconds=seconds,
     )
 
-    if debug:
-        log("[merge_blobs] Original commit blob content:")
-        if commit_blob:
-            log(commit_blob.data.decode())
-            log(f"[merge_blobs_easy] Blob id: {commit_blob.id}")
-            log(f"[merge_blobs_easy] File Mode: {commit_blob.filemode}")
-        else:
-            log("[merge_blobs_easy] File does not exist in this commit")
 
-    current_result = (commit_blob.id, commit_blob.filemode) if commit_blob else None
+class WarmRepository:
+    """
+    A repository that is kept open by a worker of the daemon (see create_daemon) along with
+    what can be reused from one rebase to the next one: the commit-graph, the merge bases
+    and the merge caches.
 
-    # are the 2 bases (old/new) the same?
-    old_base = (
-        (merge_base_blob.id, merge_base_blob.filemode) if merge_base_blob else None
-    )
-    new_base = (
-        (rebased_merge_base_blob.id, rebased_merge_base_blob.filemode)
-        if rebased_merge_base_blob
-        else None
-    )
+    The merge caches are only reused by rebases with the same merge options. When objects
+    are staged, rebase() drops what points to objects that were not written into the
+    repository when it finishes.
+    """
 
-    if old_base == new_base:
-        # we can apply the differences between the old/new merge bases
-        if debug:
-            log(f"Merge bases are the same ({old_base} => {new_base})")
+    def __init__(self, path: str):
+        self.repo = pygit2.Repository(path)
+        self.merge_bases: typing.Union[MergeBases, None] = None
+        self.diff3_merger = Diff3Merger()  # tokens of blobs, by id
+        self.blob_merge_cache: typing.Union[LRUCache, None] = None
+        self.tree_merge_cache: typing.Union[LRUCache, None] = None
+        self._commit_graph_stat = None
+        self._merge_options = None
 
-        # now we apply the changes introduced by each parent
-        if debug:
-            log("Introducing changes produced by each parent")
-        for parent_blob, rebased_parent_blob in zip(parent_blobs, rebased_parent_blobs):
-            parent = (parent_blob.id, parent_blob.filemode) if parent_blob else None
-            rebased_parent = (
-                (rebased_parent_blob.id, rebased_parent_blob.filemode)
-                if rebased_parent_blob
-                else None
-            )
-            if debug:
-                log(f"Applying changes between parents: {parent}, {rebased_parent}")
-            if parent == rebased_parent:
-                if debug:
-                    log(
-                        "Rebased parent is the same as the rebased parent. No change to apply."
-                    )
-                    continue
-            current_result = merge_blobs_3way(
-                repo, parent, current_result, rebased_parent, debug
+    def _get_commit_graph_stat(self) -> typing.Union[tuple, None]:
+        try:
+            stat = os.stat(
+                os.path.join(self.repo.path, "objects", "info", "commit-graph")
             )
-            if isinstance(current_result, pygit2.Index):
-                if debug:
-                    log("Could not apply change between parent and rebased parent")
-                return False
-            if debug:
-                log("Updated content: {current_result}")
-    else:
-        # we apply the differences between the old/new bases onto the original content
-        # then we apply the same change on the _old_ bases
-        # then we apply the differences between ths _updated_ bases and the new bases
-        if debug:
-            log(f"Merge bases are different ({old_base} => {new_base})")
-        current_result = merge_blobs_3way(
-            repo, old_base, current_result, new_base, debug
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def warm_up(self, rebase_options: RebaseOptions):
+        # a new commit-graph is written when the repository is maintained
+        commit_graph_stat = self._get_commit_graph_stat()
+        if self.merge_bases is None or commit_graph_stat != self._commit_graph_stat:
+            self.merge_bases = MergeBases(CommitGraph.open(self.repo))
+            self._commit_graph_stat = commit_graph_stat
+        rebase_options.merge_bases = self.merge_bases
+
+        # cached tree merges do not say what options were used to merge the blobs
+        merge_options = (
+            rebase_options.diff_algorithm,
+            rebase_options.merge_engine,
+            rebase_options.compose_blob_merges,
+            rebase_options.big_file_threshold,
+            rebase_options.streaming_merge_threshold,
+            rebase_options.blob_merge_cache_size,
+            rebase_options.tree_merge_cache_size,
         )
+        if merge_options != self._merge_options:
+            self.blob_merge_cache = LRUCache(rebase_options.blob_merge_cache_size)
+            self.tree_merge_cache = LRUCache(rebase_options.tree_merge_cache_size)
+            self._merge_options = merge_options
+        rebase_options.blob_merge_cache = self.blob_merge_cache
+        rebase_options.tree_merge_cache = self.tree_merge_cache
+        if rebase_options.merge_engine == MergeEngine.PYTHON:
+            rebase_options.diff3_merger = self.diff3_merger
 
-        if isinstance(current_result, pygit2.Index):
-            if debug:
-                log(
-                    "Could not apply changes between old base and new base on the original commit content"
+
+# only set in the workers of the daemon: path of the repository => WarmRepository
+_warm_repositories: typing.Union[dict[str, WarmRepository], None] = None
+
+
+def _start_daemon_worker():
+    global _warm_repositories
+    _warm_repositories = {}
+
+
+def open_repository(path: str = ".") -> pygit2.Repository:
+    """
+    Open the repository that path belongs to. On the workers of the daemon, the repository
+    is kept open to be used by the following requests (see warm_up).
+    """
+    if _warm_repositories is None:
+        return pygit2.Repository(path)
+    repo_path = pygit2.discover_repository(path)
+    if repo_path is None:
+        return pygit2.Repository(path)  # so that it fails like it normally would
+    warm_repository = _warm_repositories.get(repo_path)
+    if warm_repository is None:
+        warm_repository = _warm_repositories[repo_path] = WarmRepository(repo_path)
+    return warm_repository.repo
+
+
+def warm_up(repo: pygit2.Repository, rebase_options: RebaseOptions) -> bool:
+    """
+    Use the caches that the daemon keeps for repo (if it was opened with open_repository
+    on a worker of the daemon). Returns whether they were set.
+    """
+    if _warm_repositories is None:
+        return False
+    warm_repository = _warm_repositories.get(repo.path)
+    if warm_repository is None or warm_repository.repo is not repo:
+        return False
+    warm_repository.warm_up(rebase_options)
+    return True
+
+
+_daemon_class = None
+
+
+def _get_daemon_class() -> type:
+    # built the first time that it is needed: only the daemon imports socketserver
+    global _daemon_class
+    if _daemon_class is not None:
+        return _daemon_class
+    import concurrent.futures
+    import socket
+    import socketserver
+
+    class DaemonRequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            # a request is a JSON line: cwd, arguments and stdin (optional)
+            # the response is a JSON object: exit_code, stdout and stderr
+            try:
+                request = json.loads(self.rfile.readline())
+                response = self.server.run(
+                    request["cwd"], request["arguments"], request.get("stdin")
                 )
-            return False
+            except (ValueError, KeyError, TypeError) as e:
+                response = {
+                    "exit_code": 1,
+                    "stdout": "",
+                    "stderr": f"Bad request: {e}\n",
+                }
+            self.wfile.write(json.dumps(response).encode())
 
-        # now we apply the changes introduced by each parent
-        if debug:
-            log("Applying changes introduced by each parent")
-        for parent_blob, rebased_parent_blob in zip(parent_blobs, rebased_parent_blobs):
-            parent = (parent_blob.id, parent_blob.filemode) if parent_blob else None
-            rebased_parent = (
-                (rebased_parent_blob.id, rebased_parent_blob.filemode)
-                if rebased_parent_blob
-                else None
-            )
-            if debug:
-                log("Applying changes between parents: {parent}, {rebased_parent}")
-            updated_parent = merge_blobs_3way(repo, old_base, parent, new_base, debug)
-            if isinstance(updated_parent, pygit2.Index):
-                if debug:
-                    log("Could not apply change between bases on the original parent")
-                return False
-            if updated_parent == rebased_parent:
-                if debug:
-                    log(
-                        "Updated parent is the same as the rebased parent. No change to apply."
+    class RebaseDaemon(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, socket_path: str, handler: Callable, jobs: int = 1):
+            self.handler = handler
+            self.jobs = jobs
+            self.requests = 0
+            self._pool = None
+            self._pool_lock = threading.Lock()
+            if os.path.exists(socket_path):
+                # left behind by a daemon that did not finish cleanly?
+                with socket.socket(socket.AF_UNIX) as client:
+                    try:
+                        client.connect(socket_path)
+                    except OSError:
+                        os.remove(socket_path)
+                    else:
+                        raise OSError(f"There is a daemon running on {socket_path}")
+            # only the owner can talk to the daemon
+            umask = os.umask(0o077)
+            try:
+                super().__init__(socket_path, DaemonRequestHandler)
+            finally:
+                os.umask(umask)
+
+        def _get_pool(self) -> "concurrent.futures.Executor":
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = concurrent.futures.ProcessPoolExecutor(
+                        self.jobs,
+                        mp_context=_get_fork_context(),
+                        initializer=_start_daemon_worker,
                     )
-                    continue
-            if debug:
-                log(
-                    "Applying change {updated_parent} => {rebased_parent} on top of current content ({current_result})"
+                return self._pool
+
+        def run(
+            self, cwd: str, arguments: list[str], stdin: typing.Union[str, None]
+        ) -> dict:
+            pool = self._get_pool()
+            with self._pool_lock:
+                self.requests += 1
+            try:
+                exit_code, stdout, stderr = pool.submit(
+                    self.handler, cwd, arguments, stdin
+                ).result()
+            except concurrent.futures.process.BrokenProcessPool as e:
+                # a worker died, the following requests get a new pool
+                with self._pool_lock:
+                    if self._pool is pool:
+                        self._pool = None
+                pool.shutdown(wait=False)
+                exit_code, stdout, stderr = (
+                    1,
+                    "",
+                    f"The worker of the daemon died: {e}\n",
                 )
-            current_result = merge_blobs_3way(
-                repo, updated_parent, current_result, rebased_parent, debug
-            )
-            if isinstance(current_result, pygit2.Index):
-                if debug:
-                    log(
-                        "Could not apply change between updated parent and rebased parent"
-                    )
-                return False
-            if debug:
-                log("Updated content: {current_result}")
+            return {"exit_code": exit_code, "stdout": stdout, "stderr": stderr}
 
-    if debug:
-        log("Rebase of merge was successful")
-    return current_result
+        def server_close(self):
+            super().server_close()
+            with self._pool_lock:
+                if self._pool is not None:
+                    self._pool.shutdown(cancel_futures=True)
+                    self._pool = None
+            if os.path.exists(self.server_address):
+                os.remove(self.server_address)
 
+    _daemon_class = RebaseDaemon
+    return _daemon_class
 
-# TODO is it ok to only consider _differing_ parents? (trees, blobs)
-# I have a hunch this is way too optimistic.
-def merge_trees(
+
+def create_daemon(socket_path: str, handler: Callable, jobs: int = 1):
+    """
+    Server listening on a Unix socket for requests to run rebase-- (the arguments, the
+    working directory and the input of the client). Call serve_forever() on it.
+
+    Requests are run by handler(cwd, arguments, stdin) -> (exit code, stdout, stderr) on
+    a pool of `jobs` processes. Each worker keeps the repositories that it has opened
+    with open_repository (and their caches, see warm_up) for the following requests.
+    OSError is raised if there is a daemon listening on the socket already.
+    """
+    return _get_daemon_class()(socket_path, handler, jobs)
+
+
+def rebase(
+    repo: pygit2.Repository,
     rebase_options: RebaseOptions,
-    commit_metadata: CommitMetadata,
-    commit_tree: typing.Union[
-        pygit2.Tree, None
-    ],  # TODO not necessarily a root tree so maybe a better name would clear it up
-    orig_parent_trees: list[typing.Union[pygit2.Tree, None]],
-    rebased_parent_trees: list[typing.Union[pygit2.Tree, None]],
     conflicts: list[
         tuple[
             str,
@@ -542,234 +3531,244 @@ def merge_trees(
             list[typing.Union[pygit2.Object, None]],
         ]
     ],
-    paths: list[str] = [],
 ) -> typing.Union[
-    pygit2.Oid, None, bool
-]:  # None if the result is an empty/deleted tree, False if we have a tree conflict
-    log(f"merge trees using these paths: {paths}", rebase_options)
-    assert commit_tree is None or isinstance(commit_tree, pygit2.Tree)
-    assert len(orig_parent_trees) == len(rebased_parent_trees)
-    assert all(
-        (parent is None or isinstance(parent, pygit2.Tree))
-        for parent in orig_parent_trees
-    )
-    assert all(
-        (parent is None or isinstance(parent, pygit2.Tree))
-        for parent in rebased_parent_trees
-    )
+    pygit2.Commit, tuple[str, pygit2.Commit, dict[pygit2.Oid, pygit2.Commit]]
+]:  # tuple if there is a problem, indicate the reason, the commit, and the current mapping of commits
+    events = rebase_iter(repo, rebase_options, conflicts)
+    while True:
+        try:
+            next(events)
+        except StopIteration as stop:
+            return stop.value
 
-    # the following sanity check has to be carried out on a root tree
-    # if we are working on a recursive call, this check has already been carried out
-    if not paths:
-        differing_parents = set()  # each item is a tuple (original tree, rebased tree)
-        for orig_parent_tree, rebased_parent_tree in zip(
-            orig_parent_trees, rebased_parent_trees
-        ):
-            if orig_parent_tree == rebased_parent_tree:
-                # also works for None
-                continue
-            if (
-                orig_parent_tree is None
-                or rebased_parent_tree is None
-                or orig_parent_tree.id != rebased_parent_tree.id
-            ):
-                differing_parents.add((orig_parent_tree, rebased_parent_tree))
-        if not differing_parents:
-            # we can take the original tree as a whole
-            return commit_tree.id
 
-        # if dealing with single "differing" parent commits, there are a few other possibilities using the rebased parent tree
-        if len(differing_parents) == 1:
-            orig_parent_tree, rebased_parent_tree = list(differing_parents)[0]
-            easy_solution = easy_merge(
-                commit_tree, orig_parent_tree, rebased_parent_tree
+def rebase_iter(
+    repo: pygit2.Repository,
+    rebase_options: RebaseOptions,
+    conflicts: list[
+        tuple[
+            str,
+            typing.Union[pygit2.Object, None],
+            list[typing.Union[pygit2.Object, None]],
+            list[typing.Union[pygit2.Object, None]],
+        ]
+    ],
+) -> typing.Generator[
+    RebaseEvent,
+    None,
+    typing.Union[
+        pygit2.Commit, tuple[str, pygit2.Commit, dict[pygit2.Oid, pygit2.Commit]]
+    ],
+]:
+    """
+    Rebase one commit at a time, yielding a RebaseEvent for each one of them as soon as it
+    is processed. The value of the generator (StopIteration.value) is what rebase() returns.
+
+    When objects are staged, rebased commits can be read while the rebase is running but
+    they are only written into the repository once the whole rebase has succeeded.
+    """
+    if not rebase_options.stage_objects:
+        try:
+            return (
+                yield from _rebase_with_checkpoints(repo, rebase_options, conflicts)
             )
-            if easy_solution[0]:
-                # it was solved
-                return easy_solution[1].id
+        finally:
+            if rebase_options.rebase_cache is not None:
+                rebase_options.rebase_cache.save()
 
-    # not everything in the trees matches.... can we solve this puzzle?
-    # We need to walk over the items in the trees, both sets of parents and commit_tree.
-    # If we are lucky, we will be able to find correct resolutions for all the
-    # separate items in the trees.
-    trees_iterator = TreesIterator(commit_tree, orig_parent_trees, rebased_parent_trees)
-    tree_builder = commit_metadata.repo.TreeBuilder()
-    while tree_items := trees_iterator.next_tree_items():
-        path, commit_tree_item, original_parent_items, rebased_parent_items = tree_items
-        differing_parents = set()  # each item is a tuple (original item, rebased item)
-        for original_parent_item, rebased_parent_item in zip(
-            original_parent_items, rebased_parent_items
-        ):
-            if original_parent_item == rebased_parent_item:
-                continue
-            if (
-                original_parent_item is None
-                or rebased_parent_item is None
-                or (original_parent_item.id != rebased_parent_item.id)
-            ):
-                differing_parents.add((original_parent_item, rebased_parent_item))
+    import tempfile
 
-        if not differing_parents:
-            if commit_tree_item:
-                tree_builder.insert(
-                    path, commit_tree_item.id, commit_tree_item.filemode
+    with tempfile.TemporaryDirectory(prefix="rebase--objects-") as objects_path:
+        staging_repo = StagingRepository(repo.path, objects_path)
+        result = None
+        try:
+            result = yield from _rebase_with_checkpoints(
+                staging_repo, rebase_options, conflicts
+            )
+            if isinstance(result, pygit2.Commit):
+                staging_repo.flush(
+                    result.id, *(rebase_options.rebased_refs or {}).values()
                 )
-            continue
+                result = repo.get(result.id)
+                if rebase_options.rebase_cache is not None:
+                    rebase_options.rebase_cache.save()
+        finally:
+            # objects that were not flushed will be gone: only what points to objects in
+            # the repository is kept (the daemon keeps the caches for the next rebases)
+            if rebase_options.blob_merge_cache is not None:
+                rebase_options.blob_merge_cache.retain(
+                    lambda key, result: not isinstance(result, tuple)
+                    or result[0] in repo
+                )
+            if rebase_options.tree_merge_cache is not None:
+                # conflicts hold objects of the staging repository
+                rebase_options.tree_merge_cache.retain(
+                    lambda key, result: not result[1]
+                    and (not isinstance(result[0], pygit2.Oid) or result[0] in repo)
+                )
+            if rebase_options.merge_bases is not None:
+                rebase_options.merge_bases.retain(repo.__contains__)
+            if rebase_options.rebase_cache is not None:
+                rebase_options.rebase_cache.discard()
+        # if there was a problem, nothing is written into the repository
+        return result
 
-        # not everything matches
 
-        if len(differing_parents) == 1:
-            differing_parents = list(differing_parents)
-            # Is it still possible to use an easy conflict resolution?
-            original_parent_item, rebased_parent_item = list(differing_parents)[0]
-            solved, item_to_commit = easy_merge(
-                commit_tree_item, original_parent_item, rebased_parent_item
-            )
+def _rebase_with_checkpoints(
+    repo: pygit2.Repository,
+    rebase_options: RebaseOptions,
+    conflicts: list[
+        tuple[
+            str,
+            typing.Union[pygit2.Object, None],
+            list[typing.Union[pygit2.Object, None]],
+            list[typing.Union[pygit2.Object, None]],
+        ]
+    ],
+) -> typing.Generator[
+    RebaseEvent,
+    None,
+    typing.Union[
+        pygit2.Commit, tuple[str, pygit2.Commit, dict[pygit2.Oid, pygit2.Commit]]
+    ],
+]:
+    events = _rebase_in_pool(repo, rebase_options, conflicts)
+    if rebase_options.state_path is None:
+        return (yield from events)
+
+    commits_map = dict(rebase_options.commits_map or {})
+    since_checkpoint = 0
+    while True:
+        try:
+            event = next(events)
+        except StopIteration as stop:
+            result = stop.value
+            break
+        if event.rebased_commit_id is not None:
+            commits_map[event.commit.id] = event.rebased_commit_id
+            since_checkpoint += 1
+            if since_checkpoint >= rebase_options.checkpoint_interval:
+                _save_checkpoint(repo, rebase_options, commits_map, None)
+                since_checkpoint = 0
+        yield event
+
+    if isinstance(result, pygit2.Commit):
+        # the state of another rebase (started while this one was running) is left alone
+        state = load_rebase_state(rebase_options.state_path)
+        if state is not None and state.metadata == rebase_options.state_metadata:
+            os.remove(rebase_options.state_path)
+    elif result[1] is not None:
+        # the rebase can be continued from the commit that failed
+        _save_checkpoint(repo, rebase_options, commits_map, result[1].id)
+    return result
+
+
+def _rebase_in_pool(
+    repo: pygit2.Repository,
+    rebase_options: RebaseOptions,
+    conflicts: list[
+        tuple[
+            str,
+            typing.Union[pygit2.Object, None],
+            list[typing.Union[pygit2.Object, None]],
+            list[typing.Union[pygit2.Object, None]],
+        ]
+    ],
+) -> typing.Generator[
+    RebaseEvent,
+    None,
+    typing.Union[
+        pygit2.Commit, tuple[str, pygit2.Commit, dict[pygit2.Oid, pygit2.Commit]]
+    ],
+]:
+    if rebase_options.jobs > 1:
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(rebase_options.jobs) as pool:
+            return (yield from _rebase(repo, rebase_options, conflicts, pool))
+    return (yield from _rebase(repo, rebase_options, conflicts, None))
+
+
+def _walk_commits_to_rebase(
+    repo: pygit2.Repository,
+    source_ids: list[pygit2.Oid],
+    merge_base_ids: list[pygit2.Oid],
+) -> pygit2.Walker:
+    rebase_walker = repo.walk(
+        source_ids[0], pygit2.enums.SortMode.TOPOLOGICAL | pygit2.enums.SortMode.REVERSE
+    )
+    for source_id in source_ids[1:]:
+        rebase_walker.push(source_id)
+    for merge_base_id in merge_base_ids:
+        rebase_walker.hide(merge_base_id)
+    return rebase_walker
+
 
-            if solved:
-                if item_to_commit is not None:
-                    tree_builder.insert(
-                        path,
-                        item_to_commit.id,
-                        item_to_commit.filemode,
-                    )
-                continue
+def _get_commit_diff(
+    repo: pygit2.Repository, commit: pygit2.Commit
+) -> typing.Union[pygit2.Diff, None]:
+    # only for commits with a single parent
+    if len(commit.parent_ids) != 1:
+        return None
+    return repo.diff(commit.parents[0].tree, commit.tree)
 
-        # if we are wondering around here we have like a _real_ conflict of some kind
 
-        if (
-            commit_tree_item is None or isinstance(commit_tree_item, pygit2.Tree)
-        ) and all(
-            (orig_parent is None or isinstance(orig_parent, pygit2.Tree))
-            and (rebased_parent is None or isinstance(rebased_parent, pygit2.Tree))
-            for orig_parent, rebased_parent in differing_parents
-        ):
-            # we we are dealing with trees, we can recurse into them
-            original_differing_parent_items, rebased_differing_parent_items = zip(
-                *differing_parents
-            )
-            paths.append(path)
-            recursive_result = merge_trees(
-                rebase_options,
-                commit_metadata,
-                commit_tree_item,
-                original_differing_parent_items,
-                rebased_differing_parent_items,
-                conflicts,
-                paths,
-            )
-            del paths[-1]
-            if (
-                recursive_result is None
-                or isinstance(recursive_result, pygit2.Tree)
-                and len(recursive_result) == 0
-            ):
-                # tree was deleted
-                continue
-            # a non-empty real tree or a conflict
-            # if there is a conflict, it has been taken care of at the "leaves" (blobs) level
-            if recursive_result:
-                # a non-empty tree
-                tree_builder.insert(path, recursive_result, pygit2.enums.FileMode.TREE)
-            continue  # go to the next tree item
+def _get_changed_paths(diff: pygit2.Diff) -> frozenset[str]:
+    return frozenset(
+        path
+        for delta in diff.deltas
+        for path in (delta.old_file.path, delta.new_file.path)
+    )
 
-        if (
-            commit_tree_item is None or isinstance(commit_tree_item, pygit2.Blob)
-        ) and all(
-            (orig_parent is None or isinstance(orig_parent, pygit2.Blob))
-            and (rebased_parent is None or isinstance(rebased_parent, pygit2.Blob))
-            for orig_parent, rebased_parent in differing_parents
-        ):
-            # we are dealing with blobs, we can try to find a way to merge them
-            original_differing_parent_items, rebased_differing_parent_items = zip(
-                *differing_parents
-            )
-            paths.append(path)
-            fullpath = "/".join(paths)
-            debug_file = rebase_options.debug and (
-                not rebase_options.debug_paths
-                or any(
-                    fullpath.startswith(debug_path)
-                    for debug_path in rebase_options.debug_paths
-                )
-            )
 
-            # parent blobs, we need them _all_
-            parent_blobs = []
-            rebased_parent_blobs = []
-            for parent in commit_metadata.commit.parents:
-                try:
-                    parent_blob = parent.tree[fullpath]
-                except KeyError:
-                    parent_blob = None
-                parent_blobs.append(parent_blob)
-            for parent in commit_metadata.rebased_parents:
-                try:
-                    parent_blob = parent.tree[fullpath]
-                except KeyError:
-                    parent_blob = None
-                rebased_parent_blobs.append(parent_blob)
-
-            # merge base blobs
-            try:
-                merge_base_blob = commit_metadata.merge_base.tree[fullpath]
-            except KeyError:
-                merge_base_blob = None
-            try:
-                rebased_merge_base_blob = commit_metadata.rebased_merge_base.tree[
-                    fullpath
-                ]
-            except KeyError:
-                rebased_merge_base_blob = None
+def find_upstream_commits(
+    repo: pygit2.Repository,
+    source_ids: list[pygit2.Oid],
+    upstream_id: pygit2.Oid,
+    merge_base_ids: list[pygit2.Oid],
+) -> set[pygit2.Oid]:
+    """
+    Non-merge commits in merge_base..source whose patch id matches the patch id of
+    a commit in merge_base..upstream (like cherry-picks that already landed upstream).
+    There can be more than one source (and their merge bases).
 
-            if debug_file:
-                log(
-                    f"Will call merge_blobs_easy on commit {commit_metadata.commit.id} - {fullpath}"
-                )
-            blob_result = merge_blobs(
-                commit_metadata.repo,
-                commit_tree_item,
-                merge_base_blob,
-                parent_blobs,
-                rebased_merge_base_blob,
-                rebased_parent_blobs,
-                debug_file,
-            )
-            del paths[-1]
-            if blob_result is None or isinstance(blob_result, tuple):
-                # we were able to solve it
-                if blob_result is not None:
-                    tree_builder.insert(
-                        path,
-                        blob_result[0],
-                        blob_result[1],
-                    )
-            else:
-                conflicts.append(
-                    (
-                        fullpath,
-                        commit_tree_item,
-                        original_parent_items,
-                        rebased_parent_items,
-                    )
-                )
+    Patch ids need the content of the diffs so they are only calculated for commits
+    that changed the same paths as a commit from the other side, once per commit.
+    """
+    # paths changed by the commits being rebased => commits
+    candidates: dict[frozenset[str], list[tuple[pygit2.Oid, pygit2.Diff]]] = {}
+    for commit in _walk_commits_to_rebase(repo, source_ids, merge_base_ids):
+        diff = _get_commit_diff(repo, commit)
+        if diff is None:
             continue
+        changed_paths = _get_changed_paths(diff)
+        if changed_paths:
+            candidates.setdefault(changed_paths, []).append((commit.id, diff))
+    if not candidates:
+        return set()
 
-        # if we are wondering around here we have like a _real_ conflict that we could not solve
-        paths.append(path)
-        fullpath = "/".join(paths)
-        del paths[-1]
-        conflicts.append(
-            (fullpath, commit_tree_item, original_parent_items, rebased_parent_items)
-        )
-        continue
-
-    if len(tree_builder):
-        return tree_builder.write()
-    return None
+    patch_ids: dict[pygit2.Oid, list[pygit2.Oid]] = {}  # patch id => commits
+    hashed_paths = set()  # candidates whose patch ids were calculated already
+    upstream_commits = set()
+    upstream_walker = repo.walk(upstream_id)
+    for merge_base_id in merge_base_ids:
+        upstream_walker.hide(merge_base_id)
+    for upstream_commit in upstream_walker:
+        diff = _get_commit_diff(repo, upstream_commit)
+        if diff is None:
+            continue
+        changed_paths = _get_changed_paths(diff)
+        if changed_paths not in candidates:
+            continue
+        if changed_paths not in hashed_paths:
+            hashed_paths.add(changed_paths)
+            for commit_id, commit_diff in candidates[changed_paths]:
+                patch_ids.setdefault(commit_diff.patchid, []).append(commit_id)
+        upstream_commits.update(patch_ids.get(diff.patchid, ()))
+    return upstream_commits
 
 
-def rebase(
+def _rebase(
     repo: pygit2.Repository,
     rebase_options: RebaseOptions,
     conflicts: list[
@@ -780,10 +3779,14 @@ def rebase(
             list[typing.Union[pygit2.Object, None]],
         ]
     ],
-) -> typing.Union[
-    pygit2.Commit, tuple[str, pygit2.Commit, dict[pygit2.Oid, pygit2.Commit]]
-]:  # tuple if there is a problem, indicate the reason, the commit, and the current mapping of commits
-
+    pool: typing.Union["concurrent.futures.Executor", None],
+) -> typing.Generator[
+    RebaseEvent,
+    None,
+    typing.Union[
+        pygit2.Commit, tuple[str, pygit2.Commit, dict[pygit2.Oid, pygit2.Commit]]
+    ],
+]:
     assert rebase_options.upstream is not None
     assert rebase_options.source is not None
 
@@ -794,6 +3797,18 @@ def rebase(
     if onto is None:
         onto = upstream
 
+    if rebase_options.blob_merge_cache is None:
+        rebase_options.blob_merge_cache = LRUCache(rebase_options.blob_merge_cache_size)
+    if rebase_options.tree_merge_cache is None:
+        rebase_options.tree_merge_cache = LRUCache(rebase_options.tree_merge_cache_size)
+    if rebase_options.merge_bases is None:
+        rebase_options.merge_bases = MergeBases(CommitGraph.open(repo))
+    if (
+        rebase_options.merge_engine == MergeEngine.PYTHON
+        and rebase_options.diff3_merger is None
+    ):
+        rebase_options.diff3_merger = Diff3Merger()
+
     # lookfor commits to rebase
     signature = pygit2.Signature(
         repo.config.__getitem__("user.name"),
@@ -804,78 +3819,600 @@ def rebase(
     if merge_base_id is None:
         return "No merge base between the upstream and the source", None, None
 
-    rebase_walker = repo.walk(
-        source.id, pygit2.enums.SortMode.TOPOLOGICAL | pygit2.enums.SortMode.REVERSE
-    )
-    rebase_walker.hide(merge_base_id)
+    source_ids = [source.id]
+    merge_base_ids = [merge_base_id]
+    for name, target_id in (rebase_options.update_refs or {}).items():
+        # each reference goes on top of onto, as if it was rebased on its own
+        ref_merge_base_id = repo.merge_base(target_id, upstream.id)
+        if ref_merge_base_id is None:
+            return f"No merge base between the upstream and {name}", None, None
+        source_ids.append(target_id)
+        if ref_merge_base_id not in merge_base_ids:
+            merge_base_ids.append(ref_merge_base_id)
+
+    if rebase_options.upstream_commits is None:
+        rebase_options.upstream_commits = (
+            set()
+            if rebase_options.reapply_cherry_picks
+            else find_upstream_commits(repo, source_ids, upstream.id, merge_base_ids)
+        )
+
+    if pool is not None:
+        # independent commits can be rebased at the same time
+        return (
+            yield from _rebase_in_parallel(
+                repo,
+                rebase_options,
+                conflicts,
+                pool,
+                signature,
+                source_ids,
+                merge_base_ids,
+                onto,
+            )
+        )
 
-    commits_to_rebase = list(rebase_walker)
+    commits_count = None
+    if rebase_options.progress_hook is not None:
+        # the hook needs to know how many commits there are beforehand
+        commits_count = sum(
+            1 for _ in _walk_commits_to_rebase(repo, source_ids, merge_base_ids)
+        )
 
     # mappings between original commits and their resulting equivalents
-    commits_map = {merge_base_id: onto}
+    commits_map = {
+        merge_base_id: CommitRecord.from_commit(onto)
+        for merge_base_id in merge_base_ids
+    }
     counter = 0
-    commits_count = len(commits_to_rebase)
-    # the items in the conflicts tuple: path, rebased object, original parents, rebased parents
 
-    for rebased_commit in commits_to_rebase:
+    # commits are taken from the walker as they are needed
+    for rebased_commit in _walk_commits_to_rebase(repo, source_ids, merge_base_ids):
         counter += 1
+        start = time.perf_counter()
 
-        orig_parents = rebased_commit.parents
-        orig_parent_trees = [parent.tree for parent in orig_parents]
-        rebased_parents = [
-            commits_map.get(orig_parent.id, orig_parent) for orig_parent in orig_parents
-        ]
-        rebased_parent_trees = [parent.tree for parent in rebased_parents]
+        resumed_commit = _get_resumed_commit(repo, rebase_options, rebased_commit.id)
+        if resumed_commit is not None:
+            commits_map[rebased_commit.id] = CommitRecord.from_commit(resumed_commit)
+            if rebase_options.progress_hook is not None:
+                rebase_options.progress_hook(
+                    RebaseAction.RESUMED, counter, commits_count
+                )
+            yield RebaseEvent(
+                RebaseAction.RESUMED,
+                rebased_commit,
+                resumed_commit,
+                counter,
+                time.perf_counter() - start,
+            )
+            continue
+
+        if rebased_commit.id in rebase_options.upstream_commits:
+            # it becomes its (rebased) parent
+            commits_map[rebased_commit.id] = _get_rebased_parent(
+                repo, commits_map, rebased_commit.parent_ids[0]
+            )
+            if rebase_options.progress_hook is not None:
+                rebase_options.progress_hook(
+                    RebaseAction.DROPPED, counter, commits_count
+                )
+            yield RebaseEvent(
+                RebaseAction.DROPPED,
+                rebased_commit,
+                commits_map[rebased_commit.id],
+                counter,
+                time.perf_counter() - start,
+                repo,
+            )
+            continue
 
         if not rebase_options.force_rebase and all(
-            commits_map.get(parent.id, parent) == parent
-            for parent in rebased_commit.parents
+            commits_map[parent_id].id == parent_id
+            for parent_id in rebased_commit.parent_ids
+            if parent_id in commits_map
         ):
             # this commit can be reused as all parents are exactly the same between old and rebased commit
             if rebase_options.progress_hook is not None:
                 rebase_options.progress_hook(
                     RebaseAction.REUSED, counter, commits_count
                 )
-            commits_map[rebased_commit.id] = rebased_commit
+            commits_map[rebased_commit.id] = CommitRecord.from_commit(rebased_commit)
+            yield RebaseEvent(
+                RebaseAction.REUSED,
+                rebased_commit,
+                rebased_commit,
+                counter,
+                time.perf_counter() - start,
+            )
             continue
 
-        commit_metadata = CommitMetadata(repo, rebased_commit, rebased_parents)
+        new_commit = _rebase_commit(
+            repo,
+            rebase_options,
+            rebased_commit,
+            [
+                _get_rebased_parent(repo, commits_map, parent_id)
+                for parent_id in rebased_commit.parent_ids
+            ],
+            signature,
+            conflicts,
+            pool,
+        )
+        if new_commit is None:
+            # There were conflicts
+            if rebase_options.progress_hook is not None:
+                rebase_options.progress_hook(
+                    RebaseAction.CONFLICTS, counter, commits_count
+                )
+            yield RebaseEvent(
+                RebaseAction.CONFLICTS,
+                rebased_commit,
+                None,
+                counter,
+                time.perf_counter() - start,
+            )
+            return (
+                f"There were conflicts",
+                rebased_commit,
+                _get_commits(repo, commits_map),
+            )
+
+        commits_map[rebased_commit.id] = new_commit
+        if rebase_options.progress_hook is not None:
+            rebase_options.progress_hook(RebaseAction.REBASED, counter, commits_count)
+        yield RebaseEvent(
+            RebaseAction.REBASED,
+            rebased_commit,
+            new_commit,
+            counter,
+            time.perf_counter() - start,
+            repo,
+        )
+
+    return _get_rebase_result(repo, rebase_options, commits_map, onto)
+
+
+def _get_rebase_result(
+    repo: pygit2.Repository,
+    rebase_options: RebaseOptions,
+    commits_map: dict[pygit2.Oid, CommitRecord],
+    onto: pygit2.Commit,
+) -> pygit2.Commit:
+    # the rebased source (onto if there was nothing to rebase) and where the references go
+    if rebase_options.update_refs is not None:
+        rebase_options.rebased_refs = {
+            name: (commits_map[target_id].id if target_id in commits_map else target_id)
+            for name, target_id in rebase_options.update_refs.items()
+        }
+    if rebase_options.source.id not in commits_map:
+        return onto
+    return repo.get(commits_map[rebase_options.source.id].id)
+
+
+def _get_rebased_parent(
+    repo: pygit2.Repository,
+    commits_map: dict[pygit2.Oid, CommitRecord],
+    parent_id: pygit2.Oid,
+) -> CommitRecord:
+    # parents that are not being rebased are kept
+    parent = commits_map.get(parent_id)
+    if parent is None:
+        parent = CommitRecord.from_commit(repo.get(parent_id))
+    return parent
+
+
+def _get_commits(
+    repo: pygit2.Repository, commits_map: dict[pygit2.Oid, CommitRecord]
+) -> dict[pygit2.Oid, pygit2.Commit]:
+    # the mapping of commits as it is returned if the rebase fails
+    return {
+        commit_id: repo.get(rebased_commit.id)
+        for commit_id, rebased_commit in commits_map.items()
+    }
+
+
+def _get_resumed_commit(
+    repo: pygit2.Repository, rebase_options: RebaseOptions, commit_id: pygit2.Oid
+) -> typing.Union[pygit2.Commit, None]:
+    # the commit as it was rebased on a previous run, if it is still around
+    if not rebase_options.commits_map or commit_id not in rebase_options.commits_map:
+        return None
+    return repo.get(rebase_options.commits_map[commit_id])
+
+
+def _rebase_commit(
+    repo: pygit2.Repository,
+    rebase_options: RebaseOptions,
+    rebased_commit: pygit2.Commit,
+    rebased_parents: list[CommitRecord],
+    signature: pygit2.Signature,
+    conflicts: list[
+        tuple[
+            str,
+            typing.Union[pygit2.Object, None],
+            list[typing.Union[pygit2.Object, None]],
+            list[typing.Union[pygit2.Object, None]],
+        ]
+    ],
+    pool: typing.Union["concurrent.futures.Executor", None],
+) -> typing.Union[CommitRecord, None]:  # None if there were conflicts
+    # the items in the conflicts tuple: path, rebased object, original parents, rebased parents
+    result_tree = (
+        rebase_options.resolutions.get(rebased_commit.id)
+        if rebase_options.resolutions
+        else None
+    )
+    cache_key, cached_commit = None, None
+    if rebase_options.rebase_cache is not None and result_tree is None:
+        # commits that were solved by hand are not cached
+        cache_key = RebaseCache.get_key(
+            rebase_options,
+            rebased_commit,
+            [parent.id for parent in rebased_parents],
+            signature,
+        )
+        cached_commit = rebase_options.rebase_cache.get(repo, cache_key)
+        if cached_commit is not None and not rebase_options.verify_rebase_cache:
+            return CommitRecord.from_commit(cached_commit)
+
+    if rebase_options.merge_bases is not None:
+        rebase_options.merge_bases.add_commit(
+            repo,
+            rebased_commit.id,
+            rebased_commit.commit_time,
+            rebased_commit.parent_ids,
+        )
+
+    if result_tree is None:
+        commit_metadata = CommitMetadata(
+            repo, rebased_commit, rebased_parents, pool, rebase_options.merge_bases
+        )
 
         log("Will make call to merge_trees from the rebase method", rebase_options)
         result_tree = merge_trees(
             rebase_options,
             commit_metadata,
             rebased_commit.tree,
-            orig_parent_trees,
-            rebased_parent_trees,
+            [parent.tree for parent in rebased_commit.parents],
+            [repo.get(parent.tree_id) for parent in rebased_parents],
             conflicts,
             [],  # this is behaving funny when running all tests with pytest if it is not set
         )
+        if isinstance(result_tree, PendingTree):
+            result_tree = result_tree.write(conflicts)
         if conflicts:
-            # There were conflicts
-            if rebase_options.progress_hook is not None:
-                rebase_options.progress_hook(
-                    RebaseAction.CONFLICTS, counter, commits_count
-                )
-            return f"There were conflicts", rebased_commit, commits_map
+            return None
 
-        if result_tree is None:
-            # is there a constant for an empty tree?
-            result_tree = repo.TreeBuilder().write()
+    if result_tree is None:
+        # is there a constant for an empty tree?
+        result_tree = repo.TreeBuilder().write()
+
+    if cached_commit is not None:
+        # verifying the cache
+        if cached_commit.tree_id == result_tree:
+            return CommitRecord.from_commit(cached_commit)
+        log(
+            f"Cached rebase of commit {rebased_commit.id} ({cached_commit.id}) "
+            f"does not match: {cached_commit.tree_id} != {result_tree}"
+        )
+        rebase_options.rebase_cache.mismatches += 1
 
-        rebased_parent_ids = [parent.id for parent in rebased_parents]
-        new_commit = repo.create_commit(
+    # no need to read the commit back from the repository
+    new_commit = CommitRecord(
+        repo.create_commit(
             None,
             rebased_commit.author,
             signature,
             rebased_commit.message,
             result_tree,
-            rebased_parent_ids,
+            [parent.id for parent in rebased_parents],
+        ),
+        result_tree,
+        [parent.id for parent in rebased_parents],
+    )
+    if cache_key is not None:
+        rebase_options.rebase_cache.put(cache_key, new_commit.id)
+    if rebase_options.merge_bases is not None:
+        rebase_options.merge_bases.add_commit(
+            repo, new_commit.id, signature.time, new_commit.parent_ids
         )
+    return new_commit
 
-        new_commit = repo.get(new_commit)
-        commits_map[rebased_commit.id] = new_commit
-        if rebase_options.progress_hook is not None:
-            rebase_options.progress_hook(RebaseAction.REBASED, counter, commits_count)
 
-    return commits_map[commits_to_rebase[-1].id]
+def _rebase_commit_in_worker(
+    repo_path: str,
+    objects_path: typing.Union[str, None],
+    rebase_options: RebaseOptions,
+    commit_id: pygit2.Oid,
+    rebased_parents: list[CommitRecord],
+    signature: pygit2.Signature,
+    conflicts: list[
+        tuple[
+            str,
+            typing.Union[pygit2.Object, None],
+            list[typing.Union[pygit2.Object, None]],
+            list[typing.Union[pygit2.Object, None]],
+        ]
+    ],
+    pool: typing.Union["concurrent.futures.Executor", None],
+) -> typing.Union[CommitRecord, None]:
+    repo = _get_worker_repository(repo_path, objects_path)
+    return _rebase_commit(
+        repo,
+        rebase_options,
+        repo.get(commit_id),
+        rebased_parents,
+        signature,
+        conflicts,
+        pool,
+    )
+
+
+class CommitPlan:
+    """
+    A commit of the range to rebase, as seen by the scheduler
+    """
+
+    __slots__ = (
+        "commit",
+        "parents",
+        "children",
+        "reuse",
+        "resumed",
+        "dropped",
+        "cost",
+        "priority",
+    )
+
+    def __init__(self, commit: pygit2.Commit):
+        self.commit = commit
+        self.parents: list[CommitPlan] = []  # parents that are also being rebased
+        self.children: list[CommitPlan] = []
+        self.reuse = False  # no parent changes so the commit is kept as it is
+        # the commit was rebased on a previous run
+        self.resumed: typing.Union[pygit2.Commit, None] = None
+        self.dropped = False  # its changes are already upstream
+        self.cost = 0  # paths changed against its parents (see _estimate_rebase_cost)
+        self.priority = (
+            0  # cost of the commit and the costliest chain of its descendants
+        )
+
+
+def _estimate_rebase_cost(commit: pygit2.Commit) -> int:
+    # paths changed against each parent: merge commits have to be merged with every
+    # parent. Diffing trees only reads trees (no blobs) and skips the subtrees that match
+    if not commit.parents:
+        return max(1, len(commit.tree.diff_to_tree(swap=True)))
+    return max(
+        1, sum(len(parent.tree.diff_to_tree(commit.tree)) for parent in commit.parents)
+    )
+
+
+def plan_rebase(
+    repo: pygit2.Repository,
+    rebase_options: RebaseOptions,
+    source_ids: list[pygit2.Oid],
+    merge_base_ids: list[pygit2.Oid],
+    onto: pygit2.Commit,
+) -> list[CommitPlan]:
+    """
+    Build the DAG of the commits to rebase (in topological order), telling which commits
+    are reused and how costly the other ones are.
+    """
+    plans: dict[pygit2.Oid, CommitPlan] = {}
+    for commit in _walk_commits_to_rebase(repo, source_ids, merge_base_ids):
+        plan = plans[commit.id] = CommitPlan(commit)
+        for parent_id in commit.parent_ids:
+            parent = plans.get(parent_id)
+            if parent is not None:
+                plan.parents.append(parent)
+                parent.children.append(plan)
+        plan.resumed = _get_resumed_commit(repo, rebase_options, commit.id)
+        if plan.resumed is not None:
+            plan.reuse = plan.resumed.id == commit.id
+            continue
+        if (
+            rebase_options.upstream_commits
+            and commit.id in rebase_options.upstream_commits
+        ):
+            plan.dropped = True
+            continue
+        plan.reuse = not rebase_options.force_rebase and all(
+            (
+                plans[parent_id].reuse
+                if parent_id in plans
+                else parent_id not in merge_base_ids or onto.id == parent_id
+            )
+            for parent_id in commit.parent_ids
+        )
+        plan.cost = 0 if plan.reuse else _estimate_rebase_cost(commit)
+
+    ordered_plans = list(plans.values())
+    for plan in reversed(ordered_plans):
+        plan.priority = plan.cost + max(
+            (child.priority for child in plan.children), default=0
+        )
+    return ordered_plans
+
+
+def _rebase_in_parallel(
+    repo: pygit2.Repository,
+    rebase_options: RebaseOptions,
+    conflicts: list[
+        tuple[
+            str,
+            typing.Union[pygit2.Object, None],
+            list[typing.Union[pygit2.Object, None]],
+            list[typing.Union[pygit2.Object, None]],
+        ]
+    ],
+    pool: "concurrent.futures.Executor",
+    signature: pygit2.Signature,
+    source_ids: list[pygit2.Oid],
+    merge_base_ids: list[pygit2.Oid],
+    onto: pygit2.Commit,
+) -> typing.Generator[
+    RebaseEvent,
+    None,
+    typing.Union[
+        pygit2.Commit, tuple[str, pygit2.Commit, dict[pygit2.Oid, pygit2.Commit]]
+    ],
+]:
+    """
+    Rebase the commits of the range as soon as their parents are rebased, running up to
+    `jobs` of them at the same time. The costliest chains of commits go first.
+    Blobs are still merged in the pool.
+    """
+    import concurrent.futures
+
+    plans = plan_rebase(repo, rebase_options, source_ids, merge_base_ids, onto)
+    commits_count = len(plans)
+    commits_map = {
+        merge_base_id: CommitRecord.from_commit(onto)
+        for merge_base_id in merge_base_ids
+    }
+    counter = 0
+
+    waiting = {plan.commit.id: len(plan.parents) for plan in plans}
+    ready = [
+        (-plan.priority, index, plan)
+        for index, plan in enumerate(plans)
+        if not plan.parents
+    ]
+    heapq.heapify(ready)
+    index_of = {plan.commit.id: index for index, plan in enumerate(plans)}
+
+    def release_children(plan: CommitPlan):
+        for child in plan.children:
+            waiting[child.commit.id] -= 1
+            if waiting[child.commit.id] == 0:
+                heapq.heappush(
+                    ready, (-child.priority, index_of[child.commit.id], child)
+                )
+
+    # future => (plan, start time, conflicts of the commit)
+    running: dict[concurrent.futures.Future, tuple[CommitPlan, float, list]] = {}
+    with concurrent.futures.ThreadPoolExecutor(rebase_options.jobs) as commits_pool:
+        while ready or running:
+            while ready and len(running) < rebase_options.jobs:
+                _, _, plan = heapq.heappop(ready)
+                start = time.perf_counter()
+                if plan.resumed is not None:
+                    counter += 1
+                    if rebase_options.progress_hook is not None:
+                        rebase_options.progress_hook(
+                            RebaseAction.RESUMED, counter, commits_count
+                        )
+                    commits_map[plan.commit.id] = CommitRecord.from_commit(plan.resumed)
+                    yield RebaseEvent(
+                        RebaseAction.RESUMED,
+                        plan.commit,
+                        plan.resumed,
+                        counter,
+                        time.perf_counter() - start,
+                    )
+                    release_children(plan)
+                    continue
+                if plan.dropped:
+                    counter += 1
+                    if rebase_options.progress_hook is not None:
+                        rebase_options.progress_hook(
+                            RebaseAction.DROPPED, counter, commits_count
+                        )
+                    commits_map[plan.commit.id] = _get_rebased_parent(
+                        repo, commits_map, plan.commit.parent_ids[0]
+                    )
+                    yield RebaseEvent(
+                        RebaseAction.DROPPED,
+                        plan.commit,
+                        commits_map[plan.commit.id],
+                        counter,
+                        time.perf_counter() - start,
+                        repo,
+                    )
+                    release_children(plan)
+                    continue
+                if plan.reuse:
+                    counter += 1
+                    if rebase_options.progress_hook is not None:
+                        rebase_options.progress_hook(
+                            RebaseAction.REUSED, counter, commits_count
+                        )
+                    commits_map[plan.commit.id] = CommitRecord.from_commit(plan.commit)
+                    yield RebaseEvent(
+                        RebaseAction.REUSED,
+                        plan.commit,
+                        plan.commit,
+                        counter,
+                        time.perf_counter() - start,
+                    )
+                    release_children(plan)
+                    continue
+                commit_conflicts = []
+                future = commits_pool.submit(
+                    _rebase_commit_in_worker,
+                    repo.path,
+                    _get_objects_path(repo),
+                    rebase_options,
+                    plan.commit.id,
+                    [
+                        _get_rebased_parent(repo, commits_map, parent_id)
+                        for parent_id in plan.commit.parent_ids
+                    ],
+                    signature,
+                    commit_conflicts,
+                    pool,
+                )
+                running[future] = (plan, start, commit_conflicts)
+
+            if not running:
+                continue
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            # commits that finish together are processed in topological order so that
+            # the earliest commit with conflicts is the one that is reported
+            for future in sorted(
+                done, key=lambda future: index_of[running[future][0].commit.id]
+            ):
+                plan, start, commit_conflicts = running.pop(future)
+                new_commit = future.result()
+                counter += 1
+                if new_commit is None:
+                    # There were conflicts
+                    conflicts.extend(commit_conflicts)
+                    if rebase_options.progress_hook is not None:
+                        rebase_options.progress_hook(
+                            RebaseAction.CONFLICTS, counter, commits_count
+                        )
+                    yield RebaseEvent(
+                        RebaseAction.CONFLICTS,
+                        plan.commit,
+                        None,
+                        counter,
+                        time.perf_counter() - start,
+                    )
+                    for other_future in running:
+                        other_future.cancel()
+                    return (
+                        f"There were conflicts",
+                        plan.commit,
+                        _get_commits(repo, commits_map),
+                    )
+
+                commits_map[plan.commit.id] = new_commit
+                if rebase_options.progress_hook is not None:
+                    rebase_options.progress_hook(
+                        RebaseAction.REBASED, counter, commits_count
+                    )
+                yield RebaseEvent(
+                    RebaseAction.REBASED,
+                    plan.commit,
+                    new_commit,
+                    counter,
+                    time.perf_counter() - start,
+                    repo,
+                )
+                release_children(plan)
+
+    return _get_rebase_result(repo, rebase_options, commits_map, onto)